@@ -0,0 +1,438 @@
+"""
+End-to-end load test of the three services, in a single process.
+
+Runs user-service, ride-request-service and driver-management-service
+in-process. Their infrastructure is replaced by stand-ins: SQLite for MySQL,
+mongomock for MongoDB, a shared fakeredis server for Redis and an in-memory
+broker for Kafka (see benchmarks/stand_ins.py). Services call each other
+through Flask test clients, so the numbers measure the services' own cost
+without the network.
+
+Riders and drivers are registered and logged in first. Then, for the given
+duration:
+  - riders create ride requests at --rate per second and poll their status
+    until it is ACCEPTED (time to assignment),
+  - drivers send bulk heartbeats every --heartbeat-interval seconds, making
+    the drivers assigned since the last heartbeat available again,
+  - single driver status updates and logins run at their own rates.
+
+With --replay, the lines of a JSONL file are sent in order at --rate per
+second instead of the synthesized ride requests. Each line is an HTTP call:
+    {"service": "user" | "ride" | "driver", "method": "POST", "path": "/users/login",
+     "json": {...}, "headers": {...}, "name": "login"}
+
+No request starts after --duration seconds. Rides requested just before
+then are polled for up to --drain more seconds; rides still unassigned after
+that count as failed, and requests still queued for a client thread are
+dropped. Throughput and p50/p95/p99 latency
+are reported per endpoint. The run exits with status 1 if a service worker or
+a client task dies or a service logs an exception, and, without --replay, if
+no ride was assigned or any ride failed.
+
+Usage (from the repository root, with benchmarks/requirements.txt installed):
+    python -m benchmarks.e2e_load [--rate 50] [--duration 30] [--riders 200] [--drivers 500]
+"""
+import argparse
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+import importlib
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+from threading import Lock, Thread
+import time
+from types import SimpleNamespace
+from unittest import mock
+import uuid
+
+import jwt
+import mongomock
+import redis
+
+from benchmarks.stand_ins import FakeRedisFactory, InMemoryBroker, InProcessServiceClient
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SECRET_KEY = 'load-test-secret'
+# Pickups and drivers are spread around this point
+CENTER = (44.4949, 11.3426)
+
+
+class Recorder:
+    """Thread-safe latency samples and error counts per endpoint."""
+
+    def __init__(self):
+        self._lock = Lock()
+        self.samples = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def record(self, name, seconds, ok=True):
+        with self._lock:
+            if ok:
+                self.samples[name].append(seconds)
+            else:
+                self.errors[name] += 1
+
+    def report(self, duration):
+        print(f"{'endpoint':<34} {'req/s':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}")
+        for name in sorted(set(self.samples) | set(self.errors)):
+            samples = sorted(self.samples[name])
+            if not samples:
+                print(f"{name:<34} {'-':>8} {'-':>9} {'-':>9} {'-':>9} {self.errors[name]:>7}")
+                continue
+
+            def percentile(p):
+                return samples[min(int(len(samples) * p), len(samples) - 1)] * 1000
+
+            print(f"{name:<34} {len(samples) / duration:8.1f} {percentile(0.5):9.2f} "
+                  f"{percentile(0.95):9.2f} {percentile(0.99):9.2f} {self.errors[name]:>7}")
+
+
+class Failures:
+    """
+    Collects the exceptions that killed a thread or a client task, or that a
+    service caught and logged, which would otherwise only show up as a
+    stalled run or missing numbers.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.errors = []
+
+    def add(self, where, error):
+        with self._lock:
+            self.errors.append(f"{where}: {error if isinstance(error, str) else repr(error)}")
+
+    def install(self):
+        """Record every thread that dies with an exception, printing its traceback as before."""
+        excepthook = threading.excepthook
+
+        def record(hook_args):
+            self.add(f"thread {hook_args.thread.name if hook_args.thread else '?'}", hook_args.exc_value)
+            excepthook(hook_args)
+
+        threading.excepthook = record
+
+    def watch_logger(self, logger):
+        """Record every exception logged by a service, e.g. by a worker that retries a failed batch."""
+        failures = self
+
+        class ExceptionHandler(logging.Handler):
+            def emit(self, record):
+                if record.exc_info:
+                    failures.add(f"logged by {record.module}", record.exc_info[1])
+
+        logger.addHandler(ExceptionHandler(logging.ERROR))
+
+    def watch(self, future):
+        """Record the exception of a task submitted to a thread pool."""
+        def done(future):
+            if not future.cancelled() and future.exception() is not None:
+                self.add('client task', future.exception())
+        future.add_done_callback(done)
+        return future
+
+
+def load_service(name, env, prepare=None, finish=None):
+    """
+    Import a service's `app` package and create its application.
+
+    Every service has a top-level package named `app`, so each one is imported
+    on its own and removed from sys.modules afterwards; the application keeps
+    references to the modules it needs.
+
+    Args:
+        name (str): The directory of the service.
+        env (dict): Environment variables read by the service's Config.
+        prepare (callable, optional): Called with the package before create_app.
+        finish (callable, optional): Called with the application and the
+            package after create_app, while the package is still importable.
+
+    Returns:
+        Flask: The application.
+    """
+    service_dir = os.path.join(ROOT, name)
+    os.environ.update(env)
+    sys.path.insert(0, service_dir)
+    try:
+        package = importlib.import_module('app')
+        if prepare is not None:
+            prepare(package)
+        app = package.create_app()
+        if finish is not None:
+            finish(app, package)
+        return app
+    finally:
+        sys.path.remove(service_dir)
+        for module in [module for module in sys.modules if module == 'app' or module.startswith('app.')]:
+            del sys.modules[module]
+
+
+def start_services(args, workdir):
+    broker = InMemoryBroker()
+    redis_factory = FakeRedisFactory()
+    mongo_client = mongomock.MongoClient()
+    common = {
+        'SECRET_KEY': SECRET_KEY,
+        'KAFKA_TOPIC': 'ride_requests',
+        'LOG_HOT_PATH_SAMPLE_RATE': str(args.log_sample_rate)
+    }
+
+    def prepare_user_service(_package):
+        # SQLite has no pool sizes; wait for locks instead of failing under concurrent writes
+        sys.modules['app.config'].Config.SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 30}}
+
+    def finish_user_service(app, package):
+        # What `flask init-db` does
+        with app.app_context():
+            package.db.create_all()
+
+    user_env = dict(common, LOG_FILE=os.path.join(workdir, 'user-service.log'),
+                    SQLALCHEMY_DATABASE_URI=f"sqlite:///{os.path.join(workdir, 'users.db')}")
+    if args.password_hash_method:
+        user_env['PASSWORD_HASH_METHOD'] = args.password_hash_method
+    user_app = load_service('user-service', user_env, prepare=prepare_user_service, finish=finish_user_service)
+
+    def prepare_ride_service(package):
+        package.KafkaProducer = broker.producer
+        sys.modules['app.projector'].KafkaConsumer = broker.consumer
+
+    def finish_ride_service(app, _package):
+        app.mongo = SimpleNamespace(db=mongo_client['rides'])
+        sys.modules['app.db'].ensure_indexes(app, app.mongo.db)
+        app.user_service = InProcessServiceClient(user_app)
+
+    with mock.patch.object(redis, 'Redis', redis_factory):
+        ride_app = load_service('ride-request-service', dict(
+            common,
+            LOG_FILE=os.path.join(workdir, 'ride-request-service.log'),
+            MONGO_URI='mongodb://stand-in:27017/rides',
+            MONGO_CREATE_INDEXES='false',
+            REDIS_URL='redis://stand-in:6379/0',
+            KAFKA_DELIVERY_MODE='sync',
+            BACKGROUND_WORKERS='true'
+        ), prepare=prepare_ride_service, finish=finish_ride_service)
+
+    def prepare_driver_service(package):
+        package.KafkaProducer = broker.producer
+        sys.modules['app.consumer'].KafkaConsumer = broker.consumer
+
+    def finish_driver_service(app, _package):
+        app.ride_request_service = InProcessServiceClient(ride_app, auth=app.ride_request_service.session.auth)
+
+    with mock.patch.object(redis, 'Redis', redis_factory):
+        driver_app = load_service('driver-management-service', dict(
+            common,
+            LOG_FILE=os.path.join(workdir, 'driver-management-service.log'),
+            KAFKA_GROUP_ID='driver-management-service-group',
+            CONSUMER_WORKERS=str(args.consumer_workers),
+            CONSUMER_BATCH_SIZE=str(args.consumer_batch_size),
+            RIDE_STATUS_DELIVERY=args.ride_status_delivery,
+            BACKGROUND_WORKERS='true'
+        ), prepare=prepare_driver_service, finish=finish_driver_service)
+
+    return {'user': user_app, 'ride': ride_app, 'driver': driver_app}, broker
+
+
+def call(recorder, app, method, path, name=None, **kwargs):
+    """Send one request to an in-process app and record its latency."""
+    start = time.perf_counter()
+    with app.test_client() as client:
+        response = client.open(path, method=method, **kwargs)
+    recorder.record(name or f"{method} {path}", time.perf_counter() - start, response.status_code < 400)
+    return response
+
+
+def random_location():
+    return {'lat': CENTER[0] + random.uniform(-0.05, 0.05), 'lon': CENTER[1] + random.uniform(-0.05, 0.05)}
+
+
+def register_users(recorder, apps, pool, count, role):
+    """Register and log in users, returning (user_id, username, password, token) for each."""
+    def register(i):
+        username = f"{role.lower()}-{i}-{uuid.uuid4().hex[:8]}"
+        password = 'load-test-password'
+        call(recorder, apps['user'], 'POST', '/users/register', json={
+            'username': username,
+            'password': password,
+            'email': f"{username}@example.com",
+            # The role column stores UserRole names
+            'role': role
+        })
+        response = call(recorder, apps['user'], 'POST', '/users/login',
+                        json={'username': username, 'password': password})
+        if response.status_code != 200:
+            return None
+        token = response.get_json()['token']
+        user_id = jwt.decode(token, SECRET_KEY, algorithms=['HS256'])['user_id']
+        call(recorder, apps['user'], 'GET', f"/users/id/{user_id}", name='GET /users/id/<user_id>')
+        return user_id, username, password, token
+
+    return [user for user in pool.map(register, range(count)) if user is not None]
+
+
+def run_paced(rate, duration, fn, pool, failures):
+    """Submit fn to the pool `rate` times per second for `duration` seconds."""
+    if rate <= 0:
+        return
+    interval = 1 / rate
+    start = time.perf_counter()
+    deadline = start + duration
+    i = 0
+    while True:
+        next_at = start + i * interval
+        if next_at >= deadline:
+            break
+        delay = next_at - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        failures.watch(pool.submit(fn, i))
+        i += 1
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rate', type=float, default=50, help='ride requests (or replayed lines) per second')
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    parser.add_argument('--riders', type=int, default=200)
+    parser.add_argument('--drivers', type=int, default=500)
+    parser.add_argument('--heartbeat-interval', type=float, default=5)
+    parser.add_argument('--driver-status-rate', type=float, default=20)
+    parser.add_argument('--login-rate', type=float, default=5)
+    parser.add_argument('--assignment-timeout', type=float, default=30)
+    parser.add_argument('--poll-interval', type=float, default=0.05)
+    parser.add_argument('--drain', type=float, default=2,
+                        help='seconds rides requested before the end are still polled for')
+    parser.add_argument('--concurrency', type=int, default=64, help='client threads')
+    parser.add_argument('--consumer-workers', type=int, default=1)
+    parser.add_argument('--consumer-batch-size', type=int, default=50)
+    parser.add_argument('--ride-status-delivery', choices=['events', 'http'], default='events',
+                        help='how the driver consumer confirms assignments')
+    parser.add_argument('--password-hash-method', default='pbkdf2:sha256:1000',
+                        help='cheap by default so that setup is fast; use login_benchmark for hashing costs')
+    parser.add_argument('--log-sample-rate', type=float, default=0.01)
+    parser.add_argument('--replay', help='JSONL file of HTTP calls to replay instead of synthesized rides')
+    args = parser.parse_args()
+
+    failures = Failures()
+    failures.install()
+    workdir = tempfile.mkdtemp(prefix='ride-sharing-load-')
+    apps, broker = start_services(args, workdir)
+    # The services' loggers are shared when their apps have the same name
+    for logger in {app.logger for app in apps.values()}:
+        failures.watch_logger(logger)
+    print(f"Services started, logs and database in {workdir}")
+
+    setup = Recorder()
+    recorder = Recorder()
+    pool = ThreadPoolExecutor(max_workers=args.concurrency)
+
+    setup_start = time.perf_counter()
+    riders = register_users(setup, apps, pool, args.riders, 'RIDER')
+    drivers = register_users(setup, apps, pool, args.drivers, 'DRIVER')
+    driver_ids = [user_id for user_id, _username, _password, _token in drivers]
+    print(f"Registered {len(riders)} riders and {len(drivers)} drivers in {time.perf_counter() - setup_start:.1f}s")
+    setup.report(time.perf_counter() - setup_start)
+    print()
+
+    stopping = False
+    deadline = None
+
+    def send_heartbeats():
+        while not stopping:
+            for start in range(0, len(driver_ids), 1000):
+                call(recorder, apps['driver'], 'POST', '/drivers/heartbeats', json={'updates': [
+                    dict(random_location(), driver_id=driver_id, status='AVAILABLE', ts=time.time())
+                    for driver_id in driver_ids[start:start + 1000]
+                ]})
+            time.sleep(args.heartbeat_interval)
+
+    def request_ride(_i):
+        _user_id, username, _password, token = random.choice(riders)
+        start = time.perf_counter()
+        response = call(recorder, apps['ride'], 'POST', '/rides/request', headers={
+            'Authorization': f"Bearer {token}"
+        }, json={
+            'username': username,
+            'pickup_location': 'Via Santa Sofia 62',
+            'dropoff_location': 'Viale Andrea Doria 16',
+            'pickup_coordinates': random_location()
+        })
+        if response.status_code != 201:
+            return
+        request_id = response.get_json()['request_id']
+        # Rides still unassigned once the load phase has drained count as failed
+        while time.perf_counter() - start < args.assignment_timeout and time.perf_counter() < deadline + args.drain:
+            response = call(recorder, apps['ride'], 'GET', f"/rides/status/{request_id}",
+                            name='GET /rides/status/<request_id>', headers={'Authorization': f"Bearer {token}"})
+            status = response.get_json().get('status') if response.status_code == 200 else None
+            if status == 'ACCEPTED':
+                recorder.record('time to assignment', time.perf_counter() - start)
+                return
+            if status == 'CANCELLED':
+                break
+            time.sleep(args.poll_interval)
+        recorder.record('time to assignment', 0, ok=False)
+
+    def update_driver_status(_i):
+        call(recorder, apps['driver'], 'POST', '/drivers/update_status',
+             json=dict(random_location(), driver_id=random.choice(driver_ids), status='AVAILABLE'))
+
+    def login(_i):
+        _user_id, username, password, _token = random.choice(riders)
+        call(recorder, apps['user'], 'POST', '/users/login', json={'username': username, 'password': password})
+
+    background = [
+        Thread(target=send_heartbeats, daemon=True),
+        Thread(target=run_paced, args=(args.driver_status_rate, args.duration, update_driver_status, pool, failures),
+               daemon=True),
+        Thread(target=run_paced, args=(args.login_rate, args.duration, login, pool, failures), daemon=True)
+    ]
+    start = time.perf_counter()
+    deadline = start + args.duration
+    for thread in background:
+        thread.start()
+
+    if args.replay:
+        with open(args.replay) as f:
+            lines = [json.loads(line) for line in f if line.strip()]
+
+        def replay(i):
+            line = lines[i % len(lines)]
+            call(recorder, apps[line['service']], line.get('method', 'GET'), line['path'],
+                 name=line.get('name'), json=line.get('json'), headers=line.get('headers'))
+
+        run_paced(args.rate, min(args.duration, len(lines) / args.rate), replay, pool, failures)
+    else:
+        run_paced(args.rate, args.duration, request_ride, pool, failures)
+    for thread in background[1:]:
+        thread.join()
+    stopping = True
+    # Requests the client threads did not get to before the deadline are dropped
+    pool.shutdown(wait=True, cancel_futures=True)
+    elapsed = time.perf_counter() - start
+
+    print(f"Load phase: {elapsed:.1f}s, Kafka consumer lag at the end: "
+          f"{broker.lag('driver-management-service-group', 'ride_requests')}")
+    recorder.report(elapsed)
+
+    if not args.replay:
+        if not recorder.samples['time to assignment']:
+            failures.add('rides', 'no ride was assigned')
+        failed = recorder.errors['time to assignment'] + recorder.errors['POST /rides/request']
+        if failed:
+            failures.add('rides', f"{failed} rides failed or were not assigned")
+    if failures.errors:
+        print(f"\n{len(failures.errors)} failures:", file=sys.stderr)
+        for error in failures.errors[:20]:
+            print(f"  {error}", file=sys.stderr)
+        if len(failures.errors) > 20:
+            print(f"  ... and {len(failures.errors) - 20} more", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,205 @@
+"""
+In-process stand-ins for the infrastructure of the three services, used by
+the end-to-end load test: an in-memory Kafka broker, a shared fakeredis
+server, and a client calling another Flask app through its test client.
+MongoDB is replaced by mongomock and MySQL by SQLite in the harness itself.
+"""
+from collections import defaultdict, namedtuple
+from threading import Condition
+import time
+
+import fakeredis
+import requests
+
+ConsumerRecord = namedtuple('ConsumerRecord', ['topic', 'partition', 'offset', 'key', 'value'])
+RecordMetadata = namedtuple('RecordMetadata', ['topic', 'partition', 'offset'])
+TopicPartition = namedtuple('TopicPartition', ['topic', 'partition'])
+
+
+class InMemoryBroker:
+    """
+    A single-partition, in-memory Kafka broker.
+
+    Every consumer group has one position per topic, shared by the consumers
+    of the group, so several consumer workers split the records between them.
+    """
+
+    def __init__(self):
+        self._logs = defaultdict(list)
+        self._positions = defaultdict(int)
+        self._condition = Condition()
+
+    def append(self, topic, key, value):
+        with self._condition:
+            log = self._logs[topic]
+            log.append((key, value))
+            self._condition.notify_all()
+            return len(log) - 1
+
+    def fetch(self, group_id, topics, max_records, timeout):
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while True:
+                records = {}
+                for topic in topics:
+                    position = self._positions[(group_id, topic)]
+                    log = self._logs[topic][position:position + max_records]
+                    if log:
+                        records[TopicPartition(topic, 0)] = [
+                            ConsumerRecord(topic, 0, position + i, key, value) for i, (key, value) in enumerate(log)
+                        ]
+                        self._positions[(group_id, topic)] = position + len(log)
+                        max_records -= len(log)
+                    if max_records <= 0:
+                        break
+                remaining = deadline - time.monotonic()
+                if records or remaining <= 0:
+                    return records
+                self._condition.wait(remaining)
+
+    def seek(self, group_id, topic, offset):
+        with self._condition:
+            self._positions[(group_id, topic)] = offset
+
+    def highwater(self, topic):
+        with self._condition:
+            return len(self._logs[topic])
+
+    def lag(self, group_id, topic):
+        with self._condition:
+            return len(self._logs[topic]) - self._positions[(group_id, topic)]
+
+    def producer(self, value_serializer=None, key_serializer=None, **_config):
+        """Drop-in replacement for kafka.KafkaProducer(...)."""
+        return InMemoryProducer(self, value_serializer, key_serializer)
+
+    def consumer(self, *topics, group_id=None, value_deserializer=None, **_config):
+        """Drop-in replacement for kafka.KafkaConsumer(...)."""
+        consumer = InMemoryConsumer(self, group_id, value_deserializer)
+        if topics:
+            consumer.subscribe(list(topics))
+        return consumer
+
+
+class CompletedSend:
+    """An already acknowledged send, mimicking kafka-python's FutureRecordMetadata."""
+
+    def __init__(self, metadata):
+        self.metadata = metadata
+
+    def get(self, timeout=None):
+        return self.metadata
+
+    def add_callback(self, fn, *args, **kwargs):
+        fn(*args, self.metadata, **kwargs)
+        return self
+
+    def add_errback(self, fn, *args, **kwargs):
+        return self
+
+
+class InMemoryProducer:
+
+    def __init__(self, broker, value_serializer, key_serializer):
+        self.broker = broker
+        self.value_serializer = value_serializer or (lambda v: v)
+        self.key_serializer = key_serializer or (lambda k: k)
+
+    def send(self, topic, value=None, key=None, **_kwargs):
+        offset = self.broker.append(
+            topic,
+            self.key_serializer(key) if key is not None else None,
+            self.value_serializer(value)
+        )
+        return CompletedSend(RecordMetadata(topic, 0, offset))
+
+    def flush(self, timeout=None):
+        pass
+
+    def close(self, timeout=None):
+        pass
+
+
+class InMemoryConsumer:
+
+    def __init__(self, broker, group_id, value_deserializer):
+        self.broker = broker
+        self.group_id = group_id
+        self.value_deserializer = value_deserializer or (lambda v: v)
+        self.topics = []
+
+    def subscribe(self, topics, listener=None):
+        self.topics = list(topics)
+        if listener is not None:
+            listener.on_partitions_assigned([TopicPartition(topic, 0) for topic in self.topics])
+
+    def poll(self, timeout_ms=0, max_records=500):
+        records = self.broker.fetch(self.group_id, self.topics, max_records or 500, timeout_ms / 1000)
+        return {
+            partition: [message._replace(value=self.value_deserializer(message.value)) for message in messages]
+            for partition, messages in records.items()
+        }
+
+    def commit(self, offsets=None):
+        pass
+
+    def seek(self, partition, offset):
+        self.broker.seek(self.group_id, partition.topic, offset)
+
+    def highwater(self, partition):
+        return self.broker.highwater(partition.topic)
+
+    def close(self):
+        pass
+
+
+class FakeRedisFactory:
+    """Replaces redis.Redis so that every client created through it shares one fakeredis server."""
+
+    def __init__(self):
+        self.server = fakeredis.FakeServer()
+
+    def __call__(self, *_args, **_kwargs):
+        return fakeredis.FakeRedis(server=self.server)
+
+    def from_url(self, _url, **_kwargs):
+        return fakeredis.FakeRedis(server=self.server)
+
+
+class StandInResponse:
+    """The subset of requests.Response used by the services."""
+
+    def __init__(self, response):
+        self._response = response
+        self.status_code = response.status_code
+        self.headers = response.headers
+
+    def json(self):
+        return self._response.get_json()
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error", response=self)
+
+
+class InProcessServiceClient:
+    """Stands in for app.service_client.ServiceClient, calling another app through its test client."""
+
+    def __init__(self, app, auth=None):
+        self.app = app
+        self.auth = auth
+
+    def request(self, method, path, timeout=None, **kwargs):
+        if self.auth is not None:
+            kwargs['headers'] = dict(kwargs.get('headers') or {}, Authorization=f"Bearer {self.auth.token()}")
+        with self.app.test_client() as client:
+            return StandInResponse(client.open(path, method=method, **kwargs))
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
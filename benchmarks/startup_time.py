@@ -0,0 +1,89 @@
+"""
+Startup time of the three services.
+
+Measures, in a fresh interpreter per run, how long importing each service's
+`app` package and calling `create_app()` take. Brokers and databases point
+at an address where nothing listens, so a factory that connects eagerly
+shows up as slow or failing. Background workers are off by default, as in
+a web process; --background-workers starts them, like a designated worker.
+
+Usage (from the repository root, with the services' requirements installed):
+    python -m benchmarks.startup_time [--runs 5] [--background-workers]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Nothing listens on port 1, connecting there fails right away
+UNREACHABLE = '127.0.0.1:1'
+
+MEASURE = """
+import json, time
+start = time.perf_counter()
+from app import create_app
+imported = time.perf_counter()
+create_app()
+created = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create_app': created - imported}))
+"""
+
+
+def service_env(workdir, background_workers):
+    return {
+        'SECRET_KEY': 'startup-benchmark',
+        'LOG_FILE': os.path.join(workdir, 'app.log'),
+        'KAFKA_BOOTSTRAP_SERVERS': UNREACHABLE,
+        'MONGO_URI': f"mongodb://{UNREACHABLE}/rides",
+        'REDIS_HOST': '127.0.0.1',
+        'REDIS_PORT': '1',
+        'SQLALCHEMY_DATABASE_URI': f"sqlite:///{os.path.join(workdir, 'users.db')}",
+        'USER_SERVICE_URL': f"http://{UNREACHABLE}",
+        'RIDE_REQUEST_SERVICE_URL': f"http://{UNREACHABLE}",
+        'BACKGROUND_WORKERS': 'true' if background_workers else 'false'
+    }
+
+
+def measure(service, env, timeout):
+    result = subprocess.run(
+        [sys.executable, '-c', MEASURE],
+        cwd=os.path.join(ROOT, service),
+        env=dict(os.environ, **env),
+        capture_output=True,
+        text=True,
+        timeout=timeout
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'failed')
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--timeout', type=float, default=60, help='seconds per run')
+    parser.add_argument('--background-workers', action='store_true')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = service_env(workdir, args.background_workers)
+        for service in ('user-service', 'ride-request-service', 'driver-management-service'):
+            samples = []
+            try:
+                for _ in range(args.runs):
+                    samples.append(measure(service, env, args.timeout))
+            except (RuntimeError, subprocess.TimeoutExpired) as e:
+                print(f"{service:<26} failed: {e}")
+                continue
+            imports = statistics.median(sample['import'] for sample in samples)
+            creates = statistics.median(sample['create_app'] for sample in samples)
+            print(f"{service:<26} import={imports * 1000:7.1f}ms  create_app={creates * 1000:7.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
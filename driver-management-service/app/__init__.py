@@ -1,41 +1,117 @@
+import atexit
 import json
 from threading import Thread
 
 from flask import Flask
-from kafka import KafkaConsumer
+from kafka import KafkaProducer
 import redis
 
 from app.config import Config
 from app.logger import setup_logging
+from app.metrics import register_stats, setup_metrics
+from app.service_client import ServiceClient, ServiceToken
 from app.routes import driver_bp
-from app.consumer import consume_ride_requests
+from app.consumer import consume_ride_requests, run_retry_scheduler
+from app.geo import GridIndex
+from app.heartbeats import run_heartbeat_sweeper
+from app.lazy import LazyClient
+from app.retry_queue import MatchingStats, unmatched_queue_depth
+from app.ride_events import RideStatusDelivery
+from app.utils import load_driver_index
 
-def create_app():
+def create_app(start_workers=None):
+    """
+    Create the Flask application.
+
+    Clients connect on first use, so creating the application does no I/O
+    unless the grid driver index is enabled.
+
+    Args:
+        start_workers (bool, optional): Whether to start the background
+            workers in this process, BACKGROUND_WORKERS by default.
+
+    Returns:
+        Flask: The application.
+    """
     app = Flask(__name__)
     app.config.from_object(Config)
 
     # Setup logging
     setup_logging(app)
 
+    # Setup metrics, served at /metrics
+    setup_metrics(app)
+
     # Initialize the Redis client
     app.redis_client = redis.Redis(host=app.config['REDIS_HOST'])
 
-    # Initialize Kafka Consumer
-    consumer = KafkaConsumer(
-        app.config['KAFKA_TOPIC'],
-        bootstrap_servers=app.config['KAFKA_BOOTSTRAP_SERVERS'],
-        group_id=app.config['KAFKA_GROUP_ID'],
-        value_deserializer=lambda v: json.loads(v.decode('utf-8'))
+    # Initialize the in-process driver index, if enabled
+    app.driver_index = None
+    if app.config['DRIVER_MATCHING_INDEX'] == 'grid':
+        app.driver_index = GridIndex(app.config['DRIVER_GRID_CELL_SIZE_DEG'])
+        loaded = load_driver_index(app.redis_client, app.driver_index)
+        app.logger.info(f"Loaded {loaded} available drivers into the grid index")
+
+    # Initialize the pooled client for ride-request-service, authenticated
+    # with a token of this service
+    app.ride_request_service = ServiceClient.from_config(
+        app.config, 'RIDE_REQUEST_SERVICE', auth=ServiceToken(app.config['SECRET_KEY'], 'driver-management-service')
     )
-    app.consumer = consumer
 
-    # Start the kafka consumer in a separate thread
-    consumer_thread = Thread(target=consume_ride_requests, args=(app,))
-    consumer_thread.daemon = True
-    consumer_thread.start()
+    # Initialize the Kafka producer of ride events, created with the first event
+    app.kafka_producer = None
+    if app.config['RIDE_STATUS_DELIVERY'] == RideStatusDelivery.EVENTS:
+        app.kafka_producer = LazyClient(lambda: KafkaProducer(
+            bootstrap_servers=app.config['KAFKA_BOOTSTRAP_SERVERS'],
+            value_serializer=lambda v: json.dumps(v).encode('utf-8'),
+            acks='all'
+        ))
+        atexit.register(app.kafka_producer.close, timeout=app.config['RIDE_EVENTS_TIMEOUT'])
+
+    app.matching_stats = MatchingStats()
+    register_stats('matching', 'Driver matching counters and times to match.', app.matching_stats.as_dict)
+    register_stats(
+        'retry_queue', 'Ride requests waiting for a driver.',
+        lambda: {'depth': unmatched_queue_depth(app.redis_client)}
+    )
 
+    if app.config['BACKGROUND_WORKERS'] if start_workers is None else start_workers:
+        start_background_workers(app)
 
     # Register blueprints
     app.register_blueprint(driver_bp)
 
     return app
+
+
+def start_background_workers(app):
+    """
+    Start the Kafka consumer workers, the retry scheduler and the heartbeat
+    sweeper in separate threads.
+
+    Returns:
+        list: The started threads.
+    """
+    threads = []
+
+    # Start the kafka consumer workers in separate threads, each with its own
+    # consumer in the consumer group
+    for worker_id in range(app.config['CONSUMER_WORKERS']):
+        consumer_thread = Thread(target=consume_ride_requests, args=(app, worker_id))
+        consumer_thread.daemon = True
+        consumer_thread.start()
+        threads.append(consumer_thread)
+
+    # Start the scheduler retrying ride requests without an available driver
+    retry_thread = Thread(target=run_retry_scheduler, args=(app,))
+    retry_thread.daemon = True
+    retry_thread.start()
+    threads.append(retry_thread)
+
+    # Start the sweeper expiring drivers whose heartbeats lapsed
+    sweeper_thread = Thread(target=run_heartbeat_sweeper, args=(app,))
+    sweeper_thread.daemon = True
+    sweeper_thread.start()
+    threads.append(sweeper_thread)
+
+    return threads
@@ -0,0 +1,184 @@
+import json
+
+import redis
+
+from app.metrics import timer
+
+# Fields of a ride request kept in its ride hash
+RIDE_FIELDS = (
+    'request_id', 'user_id', 'username', 'pickup_location', 'dropoff_location',
+    'pickup_coordinates', 'status', 'driver_id', 'assigned_at', 'created_at'
+)
+
+# Converts the active and archived rides of a driver from the lists they
+# used to be stored in to sorted sets, numbering the entries in order with
+# the driver's ride sequence (KEYS[3]), archived rides first
+_MIGRATE_LUA = """
+for _, key in ipairs({KEYS[2], KEYS[1]}) do
+    if redis.call('TYPE', key).ok == 'list' then
+        local entries = redis.call('LRANGE', key, 0, -1)
+        redis.call('DEL', key)
+        for _, entry in ipairs(entries) do
+            redis.call('ZADD', key, redis.call('INCR', KEYS[3]), entry)
+        end
+    end
+end
+"""
+
+_MIGRATE_SCRIPT = _MIGRATE_LUA + "return 1"
+
+# Adds a ride ID to the active rides of a driver under the next number of the
+# driver's ride sequence, and moves the oldest IDs beyond the active window to
+# the archive, which is capped at ARGV[3] IDs. Rides keep their number in the
+# archive, so cursors stay valid when rides move.
+_APPEND_SCRIPT = _MIGRATE_LUA + """
+redis.call('ZADD', KEYS[1], redis.call('INCR', KEYS[3]), ARGV[1])
+local excess = redis.call('ZCARD', KEYS[1]) - tonumber(ARGV[2])
+if excess > 0 then
+    local archived = redis.call('ZRANGE', KEYS[1], 0, excess - 1, 'WITHSCORES')
+    redis.call('ZREMRANGEBYRANK', KEYS[1], 0, excess - 1)
+    for i = 1, #archived, 2 do
+        redis.call('ZADD', KEYS[2], archived[i + 1], archived[i])
+    end
+    redis.call('ZREMRANGEBYRANK', KEYS[2], 0, -tonumber(ARGV[3]) - 1)
+end
+return excess
+"""
+
+_scripts = {}
+
+
+def ride_key(request_id):
+    return f"ride:{request_id}"
+
+
+def active_rides_key(driver_id):
+    return f"driver:{driver_id}:assigned_rides"
+
+
+def archived_rides_key(driver_id):
+    return f"driver:{driver_id}:assigned_rides:archive"
+
+
+def ride_sequence_key(driver_id):
+    return f"driver:{driver_id}:assigned_rides:seq"
+
+
+def _run_script(redis_client, source, driver_id, args=()):
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = redis_client.register_script(source)
+    return script(
+        keys=[active_rides_key(driver_id), archived_rides_key(driver_id), ride_sequence_key(driver_id)],
+        args=list(args),
+        client=redis_client
+    )
+
+
+def store_assigned_rides(redis_client, ride_requests, window, archive_max, ttl):
+    """
+    Store assigned rides as a hash per ride plus sorted sets of ride IDs per
+    driver, scored by the driver's ride sequence.
+
+    Only the last `window` rides of a driver stay in its active set, older
+    ride IDs are moved to its archive set, which keeps the last
+    `archive_max` of them. Ride hashes expire after `ttl` seconds. Every
+    field is stored JSON-encoded, so rides come back with the types they had.
+
+    Args:
+        redis_client (Redis): A Redis client or pipeline.
+        ride_requests (list): The assigned ride requests, with their driver_id.
+        window (int): The number of active rides kept per driver.
+        archive_max (int): The number of archived rides kept per driver.
+        ttl (int): The lifetime of a ride hash, in seconds.
+    """
+    for ride_request in ride_requests:
+        fields = {field: json.dumps(ride_request[field]) for field in RIDE_FIELDS
+                  if ride_request.get(field) is not None}
+        key = ride_key(ride_request['request_id'])
+        redis_client.hset(key, mapping=fields)
+        redis_client.expire(key, ttl)
+        _run_script(redis_client, _APPEND_SCRIPT, ride_request['driver_id'],
+                    [ride_request['request_id'], window, archive_max])
+
+
+def remove_assigned_rides(redis_client, ride_requests):
+    """
+    Remove rides from the active rides of their drivers, by ride ID.
+
+    Args:
+        redis_client (Redis): A Redis client or pipeline.
+        ride_requests (list): The assigned ride requests, with their driver_id.
+    """
+    for ride_request in ride_requests:
+        redis_client.zrem(active_rides_key(ride_request['driver_id']), ride_request['request_id'])
+        redis_client.delete(ride_key(ride_request['request_id']))
+
+
+def _decode_ride(fields):
+    return {key.decode('utf-8'): json.loads(value.decode('utf-8')) for key, value in fields.items()}
+
+
+@timer('redis', 'fetch_assigned_rides')
+def fetch_assigned_rides(redis_client, driver_id, cursor=0, limit=50, archived=False):
+    """
+    Return one page of the rides assigned to a driver, oldest first.
+
+    The cursor is the sequence number of the last ride of the previous page,
+    so pages neither skip nor repeat rides while new assignments push old
+    ones to the archive. Rides whose hash has expired are removed from the
+    driver's rides instead of shortening the page.
+
+    Args:
+        redis_client (Redis): An instance of a Redis client.
+        driver_id (str): The ID of the driver.
+        cursor (int): The sequence number of the last ride of the previous
+            page, or 0 for the first page.
+        limit (int): The maximum number of rides in the page.
+        archived (bool): Whether to page through the archived rides instead
+            of the active ones.
+
+    Returns:
+        tuple: The rides, and the cursor of the next page or None if this is
+        the last page.
+    """
+    key = archived_rides_key(driver_id) if archived else active_rides_key(driver_id)
+    rides = []
+    expired = []
+    while True:
+        wanted = limit - len(rides)
+        # One extra entry tells whether there is a next page
+        try:
+            entries = redis_client.zrangebyscore(key, f"({cursor}", '+inf', start=0, num=wanted + 1, withscores=True)
+        except redis.ResponseError:
+            # Still stored as a list, convert it and read again
+            _run_script(redis_client, _MIGRATE_SCRIPT, driver_id)
+            continue
+
+        pipe = redis_client.pipeline(transaction=False)
+        for entry, _score in entries[:wanted]:
+            if not entry.startswith(b'{'):
+                pipe.hgetall(ride_key(entry.decode('utf-8')))
+        hashes = iter(pipe.execute())
+
+        for entry, score in entries[:wanted]:
+            cursor = int(score)
+            if entry.startswith(b'{'):
+                # Stored as a JSON document before rides had their own hash
+                rides.append(json.loads(entry.decode('utf-8')))
+                continue
+            fields = next(hashes)
+            if fields:
+                rides.append(_decode_ride(fields))
+            else:
+                expired.append(entry)
+
+        if len(entries) <= wanted:
+            cursor = None
+            break
+        if len(rides) >= limit:
+            break
+
+    if expired:
+        redis_client.zrem(key, *expired)
+    return rides, cursor
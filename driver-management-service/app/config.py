@@ -10,3 +10,79 @@ class Config:
     KAFKA_TOPIC = os.getenv('KAFKA_TOPIC', 'ride_requests')
     KAFKA_GROUP_ID = os.getenv('KAFKA_GROUP_ID', 'driver-management-service-group')
     RIDE_REQUEST_SERVICE_URL = os.getenv('RIDE_REQUEST_SERVICE_URL', 'http://ride-request-service:5001')
+
+    # Connection pool, timeouts (seconds), retries and circuit breaker for ride-request-service
+    RIDE_REQUEST_SERVICE_POOL_SIZE = int(os.getenv('RIDE_REQUEST_SERVICE_POOL_SIZE', 10))
+    RIDE_REQUEST_SERVICE_CONNECT_TIMEOUT = float(os.getenv('RIDE_REQUEST_SERVICE_CONNECT_TIMEOUT', 1))
+    RIDE_REQUEST_SERVICE_READ_TIMEOUT = float(os.getenv('RIDE_REQUEST_SERVICE_READ_TIMEOUT', 2))
+    RIDE_REQUEST_SERVICE_RETRIES = int(os.getenv('RIDE_REQUEST_SERVICE_RETRIES', 2))
+    RIDE_REQUEST_SERVICE_BACKOFF = float(os.getenv('RIDE_REQUEST_SERVICE_BACKOFF', 0.1))
+    RIDE_REQUEST_SERVICE_BREAKER_THRESHOLD = int(os.getenv('RIDE_REQUEST_SERVICE_BREAKER_THRESHOLD', 5))
+    RIDE_REQUEST_SERVICE_BREAKER_RESET_TIMEOUT = float(os.getenv('RIDE_REQUEST_SERVICE_BREAKER_RESET_TIMEOUT', 30))
+
+    # Driver matching
+    # 'redis' searches the Redis geo set, 'grid' an in-process cell index
+    DRIVER_MATCHING_INDEX = os.getenv('DRIVER_MATCHING_INDEX', 'redis')
+    DRIVER_GRID_CELL_SIZE_DEG = float(os.getenv('DRIVER_GRID_CELL_SIZE_DEG', 0.002))
+    MATCHING_INITIAL_RADIUS_KM = float(os.getenv('MATCHING_INITIAL_RADIUS_KM', 0.5))
+    MATCHING_MAX_RADIUS_KM = float(os.getenv('MATCHING_MAX_RADIUS_KM', 10))
+    MATCHING_CANDIDATES = int(os.getenv('MATCHING_CANDIDATES', 10))
+    MATCHING_FALLBACK_TO_ANY = os.getenv('MATCHING_FALLBACK_TO_ANY', 'true').lower() == 'true'
+
+    # Run the background workers (consumers, retry scheduler, heartbeat
+    # sweeper) in the web processes too; by default only `python -m app.worker`
+    # runs them. The grid driver index is per process, so with
+    # DRIVER_MATCHING_INDEX=grid the workers must run in the web process.
+    BACKGROUND_WORKERS = os.getenv('BACKGROUND_WORKERS', 'false').lower() == 'true'
+
+    # Consumer workers, each consuming its share of the topic partitions
+    CONSUMER_WORKERS = int(os.getenv('CONSUMER_WORKERS', 1))
+    # How long (seconds) assignments are remembered to ignore redelivered rides
+    ASSIGNMENT_DEDUPE_TTL = int(os.getenv('ASSIGNMENT_DEDUPE_TTL', 86400))
+
+    # Batch consumption
+    CONSUMER_BATCH_SIZE = int(os.getenv('CONSUMER_BATCH_SIZE', 1))
+    CONSUMER_BATCH_TIMEOUT_MS = int(os.getenv('CONSUMER_BATCH_TIMEOUT_MS', 100))
+    CONSUMER_RETRY_BACKOFF_MS = int(os.getenv('CONSUMER_RETRY_BACKOFF_MS', 1000))
+    RIDE_STATUS_BULK_TIMEOUT = float(os.getenv('RIDE_STATUS_BULK_TIMEOUT', 10))
+
+    # How assignments and cancellations reach ride-request-service: 'events'
+    # publishes them to RIDE_EVENTS_TOPIC, 'http' calls its bulk status endpoint
+    RIDE_STATUS_DELIVERY = os.getenv('RIDE_STATUS_DELIVERY', 'events')
+    RIDE_EVENTS_TOPIC = os.getenv('RIDE_EVENTS_TOPIC', 'ride_events')
+    RIDE_EVENTS_TIMEOUT = float(os.getenv('RIDE_EVENTS_TIMEOUT', 10))
+    # How long (seconds) the version counter of a ride is kept
+    RIDE_VERSION_TTL = int(os.getenv('RIDE_VERSION_TTL', 30 * 24 * 3600))
+
+    # Retry queue of ride requests without an available driver (seconds)
+    RETRY_BASE_DELAY = float(os.getenv('RETRY_BASE_DELAY', 2))
+    RETRY_MAX_DELAY = float(os.getenv('RETRY_MAX_DELAY', 30))
+    RETRY_MAX_AGE = float(os.getenv('RETRY_MAX_AGE', 300))
+    RETRY_POLL_INTERVAL = float(os.getenv('RETRY_POLL_INTERVAL', 1))
+    RETRY_BATCH_SIZE = int(os.getenv('RETRY_BATCH_SIZE', 50))
+    # Parked ride requests retried right away when a driver becomes available
+    RETRY_WAKE_COUNT = int(os.getenv('RETRY_WAKE_COUNT', 10))
+
+    # Assigned rides kept per driver, older ones are archived
+    ASSIGNED_RIDES_ACTIVE_WINDOW = int(os.getenv('ASSIGNED_RIDES_ACTIVE_WINDOW', 100))
+    ASSIGNED_RIDES_ARCHIVE_MAX = int(os.getenv('ASSIGNED_RIDES_ARCHIVE_MAX', 1000))
+    ASSIGNED_RIDE_TTL = int(os.getenv('ASSIGNED_RIDE_TTL', 30 * 24 * 3600))
+    ASSIGNED_RIDES_PAGE_SIZE = int(os.getenv('ASSIGNED_RIDES_PAGE_SIZE', 50))
+    ASSIGNED_RIDES_MAX_PAGE_SIZE = int(os.getenv('ASSIGNED_RIDES_MAX_PAGE_SIZE', 200))
+
+    # Driver heartbeats; drivers whose last heartbeat is older than HEARTBEAT_TTL
+    # seconds are no longer available
+    HEARTBEAT_TTL = float(os.getenv('HEARTBEAT_TTL', 30))
+    HEARTBEAT_SWEEP_INTERVAL = float(os.getenv('HEARTBEAT_SWEEP_INTERVAL', 5))
+    HEARTBEAT_BATCH_MAX_ITEMS = int(os.getenv('HEARTBEAT_BATCH_MAX_ITEMS', 5000))
+
+    # Logging; LOG_FORMAT is 'json' or 'text', hot-path messages are sampled
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_FILE = os.getenv('LOG_FILE', 'logs/app.log')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 10))
+    LOG_HOT_PATH_SAMPLE_RATE = float(os.getenv('LOG_HOT_PATH_SAMPLE_RATE', 1.0))
+
+    # Prometheus metrics, served at /metrics
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
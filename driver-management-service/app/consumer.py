@@ -1,9 +1,17 @@
 from datetime import datetime
 import json
 from enum import Enum
+import time
+
+from kafka import ConsumerRebalanceListener, KafkaConsumer
+from kafka.errors import KafkaError
 import requests
 
-from app.utils import find_available_driver
+from app.assigned_rides import remove_assigned_rides, store_assigned_rides
+from app.metrics import CONSUMER_BATCH_SIZE, CONSUMER_LAG, timer
+from app.retry_queue import claim_due_ride_requests, park_ride_requests, wait_for_wakeup
+from app.ride_events import RideStatusDelivery, publish_ride_events, ride_assigned_event, ride_cancelled_event
+from app.utils import find_available_drivers, index_drivers, set_driver_available
 
 
 class RideStatus(Enum):
@@ -16,62 +24,454 @@ class RideStatus(Enum):
     CANCELLED = 'CANCELLED'
 
 
-def consume_ride_requests(app):
+def assignment_key(request_id):
+    """Redis key recording which driver a ride was assigned to."""
+    return f"ride:{request_id}:assignment"
+
+
+def deserialize_ride_request(value):
+    """Decode a ride request, or return None if it is not valid JSON so that it is skipped."""
+    try:
+        return json.loads(value.decode('utf-8'))
+    except ValueError:
+        return None
+
+
+def is_valid_ride_request(ride_request):
+    return (
+        isinstance(ride_request, dict)
+        and isinstance(ride_request.get('request_id'), str) and bool(ride_request['request_id'])
+    )
+
+
+class RebalanceListener(ConsumerRebalanceListener):
+    """
+    Logs partition movements between consumer workers and commits the
+    consumed offsets before partitions are taken away.
+    """
+
+    def __init__(self, app, consumer, worker_id):
+        self.app = app
+        self.consumer = consumer
+        self.worker_id = worker_id
+
+    def on_partitions_revoked(self, revoked):
+        if not revoked:
+            return
+        self.app.logger.info(f"Consumer worker {self.worker_id} revoked partitions: {sorted(p.partition for p in revoked)}")
+        try:
+            self.consumer.commit()
+        except KafkaError as e:
+            # Uncommitted messages are redelivered, assignments are idempotent
+            self.app.logger.warning(f"Consumer worker {self.worker_id} failed to commit on revoke: {e}")
+
+    def on_partitions_assigned(self, assigned):
+        self.app.logger.info(f"Consumer worker {self.worker_id} assigned partitions: {sorted(p.partition for p in assigned)}")
+
+
+def create_consumer(app, worker_id):
+    """
+    Create a Kafka consumer for one consumer worker.
+
+    Every worker has its own consumer in the same consumer group, so Kafka
+    spreads the partitions of the ride requests topic across them. Offsets are
+    committed manually, once a batch has been processed.
+
+    Args:
+        app: The Flask application instance containing the configuration.
+        worker_id (int): The index of the worker.
+
+    Returns:
+        KafkaConsumer: The subscribed consumer.
+    """
+    consumer = KafkaConsumer(
+        bootstrap_servers=app.config['KAFKA_BOOTSTRAP_SERVERS'],
+        group_id=app.config['KAFKA_GROUP_ID'],
+        client_id=f"{app.config['KAFKA_GROUP_ID']}-{worker_id}",
+        value_deserializer=deserialize_ride_request,
+        enable_auto_commit=False
+    )
+    consumer.subscribe([app.config['KAFKA_TOPIC']], listener=RebalanceListener(app, consumer, worker_id))
+    return consumer
+
+
+def consume_ride_requests(app, worker_id=0):
     """
-    Consumes ride requests from the application's consumer, assigns available drivers,
+    Consumes ride requests from Kafka, assigns available drivers,
     updates ride statuses, and manages related data storage.
 
+    Messages are processed in batches of up to CONSUMER_BATCH_SIZE messages or
+    CONSUMER_BATCH_TIMEOUT_MS milliseconds, whichever comes first. Offsets are
+    committed only once a batch has been fully processed. If the
+    ride-request-service cannot be reached, the batch is reverted and the
+    consumer seeks back to it so that it is retried after a short backoff;
+    so is a batch that failed with an error, which the idempotent assignments
+    make safe. Malformed ride requests are logged and skipped, and no error
+    stops the consumer.
+
     Args:
-        app: The Flask application instance containing the consumer, logger, and Redis client.
+        app: The Flask application instance containing the logger and Redis client.
+        worker_id (int): The index of this consumer worker.
 
     Functionality:
         - Processes incoming ride request messages.
-        - Finds and assigns available drivers to ride requests.
+        - Finds and assigns the nearest available driver to each ride request.
         - Updates the ride status to 'ACCEPTED' and records the assignment time.
         - Stores assigned rides in Redis.
         - Logs assignments and handles cases with no available drivers.
     """
+    consumer = create_consumer(app, worker_id)
+    backoff = app.config['CONSUMER_RETRY_BACKOFF_MS'] / 1000
+    with app.app_context():
+        while True:
+            try:
+                records = consumer.poll(
+                    timeout_ms=app.config['CONSUMER_BATCH_TIMEOUT_MS'],
+                    max_records=app.config['CONSUMER_BATCH_SIZE']
+                )
+            except KafkaError as e:
+                app.logger.error(f"Consumer worker {worker_id} failed to poll ride requests: {e}")
+                time.sleep(backoff)
+                continue
+            if not records:
+                continue
+
+            record_consumer_metrics(consumer, records, worker_id)
+            messages = [message for partition_messages in records.values() for message in partition_messages]
+            ride_requests = [message.value for message in messages if is_valid_ride_request(message.value)]
+            if len(ride_requests) < len(messages):
+                # Retrying cannot fix a malformed ride request, so it is logged and skipped
+                app.logger.error(f"Skipping {len(messages) - len(ride_requests)} malformed ride requests")
+
+            try:
+                processed = not ride_requests or process_ride_request_batch(app, ride_requests)
+            except Exception as e:
+                app.logger.exception(f"Failed to process {len(ride_requests)} ride requests: {e}")
+                processed = False
+            if not processed:
+                # Rewind to the first message of the batch in every partition
+                for partition, partition_messages in records.items():
+                    consumer.seek(partition, partition_messages[0].offset)
+                time.sleep(backoff)
+                continue
+
+            try:
+                consumer.commit()
+            except KafkaError as e:
+                # The batch is processed again after a rebalance, assignments are idempotent
+                app.logger.error(f"Consumer worker {worker_id} failed to commit ride requests: {e}")
+
+
+def record_consumer_metrics(consumer, records, worker_id):
+    """
+    Update the batch size gauge of a worker and the lag gauge of every
+    partition in a polled batch.
+
+    Args:
+        consumer (KafkaConsumer): The consumer the batch was polled from.
+        records (dict): The batch, as returned by `KafkaConsumer.poll`.
+        worker_id (int): The index of the consumer worker.
+    """
+    CONSUMER_BATCH_SIZE.labels(worker_id).set(sum(len(messages) for messages in records.values()))
+    for partition, messages in records.items():
+        # The high watermark is only known after a fetch from the partition
+        highwater = consumer.highwater(partition)
+        if highwater is not None:
+            CONSUMER_LAG.labels(partition.topic, partition.partition).set(highwater - messages[-1].offset - 1)
+
+
+def process_ride_request_batch(app, ride_requests):
+    """
+    Assigns drivers to a batch of ride requests.
+
+    Drivers are claimed in one Redis pipeline, the assigned rides are stored in
+    one MULTI/EXEC transaction (see app.assigned_rides) and the ride statuses are updated with a single
+    bulk call to ride-request-service, or by publishing ride events it projects
+    (see app.ride_events), according to RIDE_STATUS_DELIVERY.
+
+    Assignment is idempotent on request_id: the first assignment of a ride is
+    recorded under `assignment_key`, and a redelivered ride (e.g. after a
+    rebalance) only has its recorded assignment confirmed again instead of
+    claiming another driver.
+
+    Args:
+        app: The Flask application instance containing the logger and Redis client.
+        ride_requests (list): The ride requests to assign.
+
+    Ride requests without an available driver are parked in the retry queue
+    (see run_retry_scheduler) once the batch is processed.
+
+    Returns:
+        bool: True if the batch was processed, False if it should be retried.
+    """
+    app.logger.info(f"Received batch of {len(ride_requests)} ride requests")
+
+    # Rides assigned by an earlier delivery
+    with timer('redis', 'mget_assignments'):
+        recorded = app.redis_client.mget(
+            [assignment_key(ride_request['request_id']) for ride_request in ride_requests]
+        )
+    redelivered = []
+    pending = []
+    for ride_request, assignment in zip(ride_requests, recorded):
+        if assignment is not None:
+            ride_request.update(json.loads(assignment))
+            redelivered.append(ride_request)
+        else:
+            pending.append(ride_request)
+
+    with timer('redis', 'find_available_drivers'):
+        driver_ids = find_available_drivers(
+            app.redis_client,
+            [ride_request.get('pickup_coordinates') or ride_request.get('pickup_location')
+             for ride_request in pending],
+            index=app.driver_index,
+            max_radius_km=app.config['MATCHING_MAX_RADIUS_KM'],
+            candidates=app.config['MATCHING_CANDIDATES'],
+            fallback_to_any=app.config['MATCHING_FALLBACK_TO_ANY'],
+            initial_radius_km=app.config['MATCHING_INITIAL_RADIUS_KM']
+        )
+
+    assigned = []
+    unmatched = []
+    assigned_at = datetime.utcnow().isoformat()
+    for ride_request, driver_id in zip(pending, driver_ids):
+        if driver_id:
+            ride_request['driver_id'] = driver_id
+            ride_request['status'] = RideStatus.ACCEPTED.value
+            ride_request['assigned_at'] = assigned_at
+            assigned.append(ride_request)
+        else:
+            app.logger.warning(f"No available drivers for ride request {ride_request.get('request_id')}")
+            unmatched.append(ride_request)
+
+    if assigned:
+        # Record the assignments; a ride another worker assigned concurrently
+        # keeps its first assignment and our driver is released
+        pipe = app.redis_client.pipeline(transaction=False)
+        for ride_request in assigned:
+            pipe.set(
+                assignment_key(ride_request['request_id']),
+                json.dumps({'driver_id': ride_request['driver_id'], 'assigned_at': ride_request['assigned_at']}),
+                nx=True,
+                ex=app.config['ASSIGNMENT_DEDUPE_TTL']
+            )
+        with timer('redis', 'record_assignments'):
+            recorded = pipe.execute()
+        duplicates = [ride_request for ride_request, ok in zip(assigned, recorded) if not ok]
+        if duplicates:
+            app.logger.info(f"Skipping {len(duplicates)} rides already assigned by another worker")
+            release_drivers(app, [ride_request['driver_id'] for ride_request in duplicates])
+            assigned = [ride_request for ride_request, ok in zip(assigned, recorded) if ok]
+
+    if assigned:
+        # Store assigned rides
+        pipe = app.redis_client.pipeline(transaction=True)
+        store_assigned_rides(
+            pipe,
+            assigned,
+            app.config['ASSIGNED_RIDES_ACTIVE_WINDOW'],
+            app.config['ASSIGNED_RIDES_ARCHIVE_MAX'],
+            app.config['ASSIGNED_RIDE_TTL']
+        )
+        with timer('redis', 'store_assigned_rides'):
+            pipe.execute()
+
+    to_confirm = assigned + redelivered
+    if not to_confirm:
+        park_unmatched(app, unmatched)
+        return True
+
+    # Confirm the assignments to ride-request-service
+    if app.config['RIDE_STATUS_DELIVERY'] == RideStatusDelivery.EVENTS:
+        published = publish_ride_events(
+            app, [ride_assigned_event(ride_request, RideStatus.ACCEPTED.value) for ride_request in to_confirm]
+        )
+        rejected = set() if published else None
+    else:
+        rejected = confirm_assignments(app, to_confirm)
+    if rejected is None:
+        revert_assignments(app, assigned)
+        return False
+
+    failed = [ride_request for ride_request in assigned if ride_request['request_id'] in rejected]
+    if failed:
+        app.logger.warning(f"Ride status update rejected for {len(failed)} of {len(assigned)} rides")
+        revert_assignments(app, failed)
+
+    park_unmatched(app, unmatched)
+    app.matching_stats.record_matched([ride_request for ride_request in assigned
+                                       if ride_request['request_id'] not in rejected])
+    app.logger.info(f"Assigned {len(assigned) - len(failed)} rides in batch, "
+                    f"confirmed {len(redelivered)} redelivered assignments")
+    return True
+
+
+def confirm_assignments(app, ride_requests):
+    """
+    Update the statuses of assigned rides in ride-request-service with a
+    single bulk call.
+
+    Args:
+        app: The Flask application instance containing the logger and ride-request-service client.
+        ride_requests (list): The assigned ride requests.
+
+    Returns:
+        set: The IDs of the rides whose update was rejected, or None if the call failed.
+    """
+    try:
+        response = app.ride_request_service.put(
+            "/rides/update_status/bulk",
+            json={
+                'updates': [
+                    {
+                        'request_id': ride_request['request_id'],
+                        'status': RideStatus.ACCEPTED.value,
+                        'driver_id': ride_request['driver_id'],
+                        'assigned_at': ride_request['assigned_at']
+                    }
+                    for ride_request in ride_requests
+                ]
+            },
+            timeout=(app.config['RIDE_REQUEST_SERVICE_CONNECT_TIMEOUT'], app.config['RIDE_STATUS_BULK_TIMEOUT'])
+        )
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        app.logger.error(f"Failed to update ride statuses: {e}")
+        return None
+
+    results = {item.get('request_id'): item.get('result') for item in response.json().get('results', [])}
+    return {ride_request['request_id'] for ride_request in ride_requests
+            if results.get(ride_request['request_id']) != 'updated'}
+
+
+def park_unmatched(app, ride_requests):
+    """Park ride requests without an available driver in the retry queue."""
+    if not ride_requests:
+        return
+    park_ride_requests(app.redis_client, ride_requests, app.config['RETRY_BASE_DELAY'], app.config['RETRY_MAX_DELAY'])
+    app.matching_stats.record_parked(len(ride_requests))
+    app.logger.info(f"Parked {len(ride_requests)} unmatched ride requests for retry")
+
+
+def release_drivers(app, driver_ids):
+    """
+    Makes claimed drivers available again.
+
+    Args:
+        app: The Flask application instance containing the Redis client.
+        driver_ids (list): The IDs of the drivers.
+    """
+    pipe = app.redis_client.pipeline(transaction=False)
+    for driver_id in driver_ids:
+        set_driver_available(pipe, driver_id)
+    pipe.execute()
+
+    if app.driver_index is not None:
+        index_drivers(app.redis_client, app.driver_index, driver_ids)
+
+
+def revert_assignments(app, ride_requests):
+    """
+    Makes the drivers of the given rides available again, removes the rides
+    from their assigned rides and forgets the assignments, in a single
+    MULTI/EXEC transaction.
+
+    Args:
+        app: The Flask application instance containing the logger and Redis client.
+        ride_requests (list): The assigned ride requests to revert.
+    """
+    if not ride_requests:
+        return
+
+    pipe = app.redis_client.pipeline(transaction=True)
+    remove_assigned_rides(pipe, ride_requests)
+    for ride_request in ride_requests:
+        pipe.delete(assignment_key(ride_request['request_id']))
+        set_driver_available(pipe, ride_request['driver_id'])
+    pipe.execute()
+
+    if app.driver_index is not None:
+        index_drivers(app.redis_client, app.driver_index, [ride_request['driver_id'] for ride_request in ride_requests])
+
+    app.logger.info(f"Reverted {len(ride_requests)} ride assignments")
+
+
+def cancel_ride_requests(app, ride_requests):
+    """
+    Cancel ride requests in ride-request-service with a single bulk call, or
+    by publishing ride events.
+
+    Returns:
+        bool: True if the call succeeded.
+    """
+    if app.config['RIDE_STATUS_DELIVERY'] == RideStatusDelivery.EVENTS:
+        return publish_ride_events(
+            app, [ride_cancelled_event(ride_request, RideStatus.CANCELLED.value) for ride_request in ride_requests]
+        )
+
+    try:
+        response = app.ride_request_service.put(
+            "/rides/update_status/bulk",
+            json={
+                'updates': [
+                    {'request_id': ride_request['request_id'], 'status': RideStatus.CANCELLED.value}
+                    for ride_request in ride_requests
+                ]
+            },
+            timeout=(app.config['RIDE_REQUEST_SERVICE_CONNECT_TIMEOUT'], app.config['RIDE_STATUS_BULK_TIMEOUT'])
+        )
+        response.raise_for_status()
+    except requests.exceptions.RequestException as e:
+        app.logger.error(f"Failed to cancel expired ride requests: {e}")
+        return False
+    return True
+
+
+def run_retry_scheduler(app):
+    """
+    Re-attempts matching of parked ride requests.
+
+    Due ride requests are claimed in batches of RETRY_BATCH_SIZE and matched
+    again in bulk, every RETRY_POLL_INTERVAL seconds or as soon as a web
+    process brings parked rides forward (see wake_parked_ride_requests), since
+    the scheduler waits on a Redis wakeup key. Ride requests parked for longer than
+    RETRY_MAX_AGE seconds are cancelled instead.
+
+    Args:
+        app: The Flask application instance containing the logger, Redis client and matching stats.
+    """
     with app.app_context():
-        for message in app.consumer:
-            ride_request = message.value
-            app.logger.info(f"Received ride request: {ride_request}")
-
-            # Attempt to assign the ride to a driver
-            driver_id = find_available_driver(app.redis_client)
-            if driver_id:
-                ride_request['driver_id'] = driver_id
-                ride_request['status'] = RideStatus.ACCEPTED.value
-                ride_request['assigned_at'] = datetime.utcnow().isoformat()
-
-                # Store assigned ride
-                assigned_rides_key = f"driver:{driver_id}:assigned_rides"
-                app.redis_client.rpush(assigned_rides_key, json.dumps(ride_request))
-                app.logger.info(f"Assigned ride {ride_request['request_id']} to driver: {driver_id}")
-
-                # Update ride status in ride-request-service
-                ride_request_service_url = app.config.get('RIDE_REQUEST_SERVICE_URL')
-                try:
-                    response = requests.put(
-                        f"{ride_request_service_url}/rides/update_status",
-                        json={
-                            'request_id': ride_request['request_id'],
-                            'status': RideStatus.ACCEPTED.value
-                        },
-                        timeout=5
-                    )
-                    response.raise_for_status()
-                    app.logger.info(f"Ride status updated to ACCEPTED for request_id: {ride_request['request_id']}")
-                except requests.exceptions.RequestException as e:
-                    app.logger.error(f"Failed to update ride status: {e}")
-                    # Revert driver's status to AVAILABLE
-                    app.redis_client.sadd('drivers:available', driver_id)
-                    app.logger.info(f"Driver {driver_id} status reverted to AVAILABLE")
-                    # Remove the ride request from assigned rides
-                    assigned_rides_key = f"driver:{driver_id}:assigned_rides"
-                    app.redis_client.lrem(assigned_rides_key, 0, json.dumps(ride_request))
-                    app.logger.info(f"Removed ride {ride_request['request_id']} from driver {driver_id}'s assigned rides")
-                    continue
-
-            else:
-                app.logger.warning("No available drivers for ride request")
-                continue
\ No newline at end of file
+        while True:
+            try:
+                wait_for_wakeup(app.redis_client, app.config['RETRY_POLL_INTERVAL'])
+            except Exception as e:
+                app.logger.error(f"Retry scheduler failed to wait for wakeups: {e}")
+                time.sleep(app.config['RETRY_POLL_INTERVAL'])
+            try:
+                while True:
+                    ride_requests = claim_due_ride_requests(app.redis_client, app.config['RETRY_BATCH_SIZE'])
+                    if not ride_requests:
+                        break
+
+                    max_parked_at = time.time() - app.config['RETRY_MAX_AGE']
+                    expired = [ride_request for ride_request in ride_requests
+                               if ride_request['parked_at'] < max_parked_at]
+                    retried = [ride_request for ride_request in ride_requests
+                               if ride_request['parked_at'] >= max_parked_at]
+
+                    if expired:
+                        if cancel_ride_requests(app, expired):
+                            app.matching_stats.record_expired(len(expired))
+                            app.logger.warning(f"Cancelled {len(expired)} ride requests without a driver")
+                        else:
+                            retried.extend(expired)
+
+                    if retried:
+                        app.logger.info(f"Retrying {len(retried)} unmatched ride requests")
+                        app.matching_stats.record_retried(len(retried))
+                        if not process_ride_request_batch(app, retried):
+                            park_unmatched(app, retried)
+                            break
+            except Exception as e:
+                app.logger.error(f"Retry scheduler failed: {e}")
@@ -0,0 +1,183 @@
+import heapq
+import math
+from threading import Lock
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+
+def parse_location(location):
+    """
+    Parse a location into a (lat, lon) tuple.
+
+    Accepts a dict with 'lat'/'lon' (or 'latitude'/'longitude', 'lng'), a
+    [lat, lon] list or tuple, or a "lat,lon" string. Anything else (e.g. a
+    free-form street address) is not a coordinate and yields None.
+
+    Args:
+        location: The location as sent by a client.
+
+    Returns:
+        tuple or None: A (lat, lon) tuple of floats, or None if the location cannot be parsed.
+    """
+    try:
+        if isinstance(location, dict):
+            lat = location.get('lat', location.get('latitude'))
+            lon = location.get('lon', location.get('lng', location.get('longitude')))
+        elif isinstance(location, (list, tuple)) and len(location) == 2:
+            lat, lon = location
+        elif isinstance(location, str) and location.count(',') == 1:
+            lat, lon = location.split(',')
+        else:
+            return None
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+
+    if not (-85.05112878 <= lat <= 85.05112878 and -180.0 <= lon <= 180.0):
+        # Outside the range Redis GEO can index
+        return None
+    return lat, lon
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Return the great-circle distance in kilometers between two points."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+class GridIndex:
+    """
+    In-process spatial index bucketing drivers into fixed-size lat/lon cells.
+
+    Nearest-neighbour queries scan rings of cells around the query point and
+    stop as soon as no unscanned cell can contain a closer driver, so the cost
+    depends on local driver density rather than on the fleet size.
+    """
+
+    def __init__(self, cell_size_deg=0.002):
+        self.cell_size_deg = cell_size_deg
+        self._cells = {}
+        self._positions = {}
+        # Bounding box of every cell ever used; only grows, which keeps
+        # updates O(1) and merely over-estimates how far a search may go.
+        self._bounds = None
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._positions)
+
+    def __contains__(self, driver_id):
+        return driver_id in self._positions
+
+    def _cell(self, lat, lon):
+        return int(math.floor(lat / self.cell_size_deg)), int(math.floor(lon / self.cell_size_deg))
+
+    def add(self, driver_id, lat, lon):
+        """Insert a driver or move it to a new position."""
+        cell = self._cell(lat, lon)
+        with self._lock:
+            previous = self._positions.get(driver_id)
+            if previous is not None and previous[2] != cell:
+                self._discard_from_cell(driver_id, previous[2])
+            self._positions[driver_id] = (lat, lon, cell)
+            self._cells.setdefault(cell, set()).add(driver_id)
+            if self._bounds is None:
+                self._bounds = [cell[0], cell[0], cell[1], cell[1]]
+            else:
+                self._bounds[0] = min(self._bounds[0], cell[0])
+                self._bounds[1] = max(self._bounds[1], cell[0])
+                self._bounds[2] = min(self._bounds[2], cell[1])
+                self._bounds[3] = max(self._bounds[3], cell[1])
+
+    def remove(self, driver_id):
+        """Remove a driver from the index. Returns True if it was present."""
+        with self._lock:
+            previous = self._positions.pop(driver_id, None)
+            if previous is None:
+                return False
+            self._discard_from_cell(driver_id, previous[2])
+            return True
+
+    def _discard_from_cell(self, driver_id, cell):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(driver_id)
+            if not members:
+                del self._cells[cell]
+
+    def nearest(self, lat, lon, k=1, max_radius_km=None):
+        """
+        Return up to k (distance_km, driver_id) tuples ordered by distance.
+
+        Args:
+            lat (float): Latitude of the query point.
+            lon (float): Longitude of the query point.
+            k (int): Maximum number of drivers to return.
+            max_radius_km (float, optional): Ignore drivers farther than this.
+
+        Returns:
+            list: (distance_km, driver_id) tuples, nearest first.
+        """
+        center_row, center_col = self._cell(lat, lon)
+        # A cell is narrowest along the longitude axis; use that width to bound
+        # the distance of anything outside the rings scanned so far.
+        cos_lat = max(math.cos(math.radians(lat)), 0.01)
+        cell_km = self.cell_size_deg * KM_PER_DEGREE_LAT * cos_lat
+
+        # Candidates are ranked with an equirectangular approximation, which is
+        # accurate at pickup distances and much cheaper than haversine.
+        best = []
+        with self._lock:
+            if not self._positions:
+                return []
+            max_ring = self._max_ring(center_row, center_col)
+            ring = 0
+            while ring <= max_ring:
+                for cell in self._ring_cells(center_row, center_col, ring):
+                    for driver_id in self._cells.get(cell, ()):
+                        d_lat, d_lon, _ = self._positions[driver_id]
+                        dx = (d_lon - lon) * cos_lat
+                        dy = d_lat - lat
+                        best.append(((dx * dx + dy * dy) ** 0.5 * KM_PER_DEGREE_LAT, driver_id))
+
+                # Anything not yet scanned is at least `ring * cell_km` away
+                lower_bound = ring * cell_km
+                if max_radius_km is not None and lower_bound > max_radius_km:
+                    break
+                if len(best) >= k:
+                    best = heapq.nsmallest(k, best)
+                    if best[-1][0] <= lower_bound:
+                        break
+                ring += 1
+
+            results = []
+            for _, driver_id in heapq.nsmallest(k, best):
+                d_lat, d_lon, _ = self._positions[driver_id]
+                distance = haversine_km(lat, lon, d_lat, d_lon)
+                if max_radius_km is None or distance <= max_radius_km:
+                    results.append((distance, driver_id))
+        return results
+
+    def _max_ring(self, center_row, center_col):
+        min_row, max_row, min_col, max_col = self._bounds
+        return max(
+            center_row - min_row, max_row - center_row,
+            center_col - min_col, max_col - center_col,
+            0,
+        )
+
+    @staticmethod
+    def _ring_cells(center_row, center_col, ring):
+        if ring == 0:
+            yield center_row, center_col
+            return
+        for col in range(center_col - ring, center_col + ring + 1):
+            yield center_row - ring, col
+            yield center_row + ring, col
+        for row in range(center_row - ring + 1, center_row + ring):
+            yield row, center_col - ring
+            yield row, center_col + ring
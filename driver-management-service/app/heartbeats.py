@@ -0,0 +1,32 @@
+import time
+
+from app.utils import expire_lapsed_drivers
+
+# Drivers expired per Redis call
+SWEEP_BATCH_SIZE = 1000
+
+
+def run_heartbeat_sweeper(app):
+    """
+    Periodically removes drivers whose heartbeats lapsed from matching.
+
+    Runs every HEARTBEAT_SWEEP_INTERVAL seconds. Several processes can sweep
+    concurrently, each lapsed driver is expired once.
+
+    Args:
+        app: The Flask application instance containing the logger and Redis client.
+    """
+    with app.app_context():
+        while True:
+            time.sleep(app.config['HEARTBEAT_SWEEP_INTERVAL'])
+            try:
+                while True:
+                    expired = expire_lapsed_drivers(
+                        app.redis_client, app.config['HEARTBEAT_TTL'], limit=SWEEP_BATCH_SIZE, index=app.driver_index
+                    )
+                    if expired:
+                        app.logger.info(f"Expired {len(expired)} drivers with lapsed heartbeats")
+                    if len(expired) < SWEEP_BATCH_SIZE:
+                        break
+            except Exception as e:
+                app.logger.error(f"Heartbeat sweeper failed: {e}")
@@ -1,19 +1,175 @@
+import atexit
+from contextvars import ContextVar
+import copy
+from datetime import datetime, timezone
+import json
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 import os
+import queue
+import random
+import uuid
+
+REQUEST_ID_HEADER = 'X-Request-ID'
+
+# Pass as `extra` to mark frequent, per-request messages; they are sampled
+# at LOG_HOT_PATH_SAMPLE_RATE. Pass their arguments %-style, so that dropped
+# messages are never formatted
+HOT_PATH = {'hot_path': True}
+
+request_id_var = ContextVar('request_id', default=None)
+
+_traceback_formatter = logging.Formatter()
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as JSON lines."""
+
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'request_id': getattr(record, 'request_id', None),
+            'thread': record.threadName,
+            'location': f"{record.pathname}:{record.lineno}"
+        }
+        if record.exc_info:
+            entry['exc_info'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            # Formatted before the record was queued, see TracebackQueueHandler
+            entry['exc_info'] = record.exc_text
+        return json.dumps(entry)
+
+
+class TracebackQueueHandler(QueueHandler):
+    """
+    Queue records with their traceback formatted into `exc_text`.
+
+    QueueHandler folds the traceback into the message and drops `exc_info`,
+    which is not picklable, so formatters on the other side of the queue could
+    not tell them apart.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = _traceback_formatter.formatException(record.exc_info)
+        record.exc_info = None
+        return record
+
+
+class ContextFilter(logging.Filter):
+    """
+    Attach the current request ID to records and sample hot-path messages.
+
+    Runs on the thread that logs, before the record is queued, so dropped
+    records never reach the queue.
+    """
+
+    def __init__(self, hot_path_sample_rate=1.0):
+        super().__init__()
+        self.hot_path_sample_rate = hot_path_sample_rate
+
+    def filter(self, record):
+        if getattr(record, 'hot_path', False) and random.random() >= self.hot_path_sample_rate:
+            return False
+        record.request_id = request_id_var.get()
+        return True
+
+
+def _bind_request_id(request):
+    request_id = request.headers.get(REQUEST_ID_HEADER) or uuid.uuid4().hex
+    return request_id_var.set(request_id)
+
+
+def _register_request_id_hooks(app):
+    """
+    Bind a request ID, taken from the X-Request-ID header or generated, to the
+    logs of every request, and return it in the response headers.
+    """
+    def add_request_id_header(response):
+        request_id = request_id_var.get()
+        if request_id is not None:
+            response.headers[REQUEST_ID_HEADER] = request_id
+        return response
+
+    if hasattr(app, 'before_serving'):
+        # Quart runs synchronous hooks in a thread pool, outside of the
+        # request's context, and every request runs in its own task
+        from quart import request as async_request
+
+        @app.before_request
+        async def bind_request_id_async():
+            _bind_request_id(async_request)
+
+        @app.after_request
+        async def add_request_id_header_async(response):
+            return add_request_id_header(response)
+        return
+
+    from flask import g, request
+
+    @app.before_request
+    def bind_request_id():
+        g.request_id_token = _bind_request_id(request)
+
+    app.after_request(add_request_id_header)
+
+    @app.teardown_request
+    def unbind_request_id(_exc):
+        token = g.pop('request_id_token', None)
+        if token is not None:
+            request_id_var.reset(token)
+
 
 def setup_logging(app):
-    """Configure logging for the Flask application."""
-    if not os.path.exists('logs'):
-        os.mkdir('logs')
-    
-    file_handler = RotatingFileHandler('logs/app.log', maxBytes=10240, backupCount=10)
-    file_handler.setFormatter(logging.Formatter(
-        '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]'
-    ))
-    file_handler.setLevel(logging.INFO)
-    
-    app.logger.addHandler(file_handler)
-    
-    app.logger.setLevel(logging.INFO)
-    app.logger.info('Application startup')
\ No newline at end of file
+    """
+    Configure logging for the application.
+
+    Records are put on an in-memory queue by the thread that logs and written
+    by a background listener thread, so file I/O never blocks a request. The
+    log file holds one JSON object per line (LOG_FORMAT=text restores the
+    plain format) and rotates at LOG_MAX_BYTES.
+    """
+    log_file = app.config.get('LOG_FILE', 'logs/app.log')
+    log_dir = os.path.dirname(log_file)
+    if log_dir and not os.path.exists(log_dir):
+        os.makedirs(log_dir, exist_ok=True)
+
+    file_handler = RotatingFileHandler(
+        log_file,
+        maxBytes=app.config.get('LOG_MAX_BYTES', 10 * 1024 * 1024),
+        backupCount=app.config.get('LOG_BACKUP_COUNT', 10)
+    )
+    if app.config.get('LOG_FORMAT', 'json') == 'json':
+        file_handler.setFormatter(JsonFormatter())
+    else:
+        file_handler.setFormatter(logging.Formatter(
+            '%(asctime)s %(levelname)s: %(message)s [request_id=%(request_id)s] [in %(pathname)s:%(lineno)d]'
+        ))
+
+    # The framework's console handler is moved behind the queue as well
+    handlers = [file_handler] + list(app.logger.handlers)
+    for handler in list(app.logger.handlers):
+        app.logger.removeHandler(handler)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = TracebackQueueHandler(log_queue)
+    queue_handler.addFilter(ContextFilter(app.config.get('LOG_HOT_PATH_SAMPLE_RATE', 1.0)))
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    # Write the records still queued before the process exits
+    atexit.register(listener.stop)
+
+    app.logger.addHandler(queue_handler)
+    app.logger.setLevel(app.config.get('LOG_LEVEL', 'INFO'))
+    app.log_listener = listener
+
+    _register_request_id_hooks(app)
+
+    app.logger.info('Application startup')
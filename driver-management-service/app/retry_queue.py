@@ -0,0 +1,171 @@
+from datetime import datetime, timezone
+import json
+from threading import Lock
+import time
+
+UNMATCHED_RIDES_KEY = 'rides:unmatched'
+UNMATCHED_RIDES_DATA_KEY = 'rides:unmatched:data'
+# Holds a token while parked rides were brought forward since the retry
+# scheduler last looked, so that it wakes up whichever process woke them
+RETRY_WAKEUP_KEY = 'rides:unmatched:wakeup'
+
+# Pops the parked rides that are due, at most ARGV[2] of them
+_CLAIM_DUE_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+if #ids == 0 then
+    return {}
+end
+redis.call('ZREM', KEYS[1], unpack(ids))
+local rides = redis.call('HMGET', KEYS[2], unpack(ids))
+redis.call('HDEL', KEYS[2], unpack(ids))
+return rides
+"""
+
+# Makes the ARGV[2] parked rides with the earliest retry time due at ARGV[1],
+# and leaves a wakeup token for the retry scheduler if any was brought forward
+_WAKE_SCRIPT = """
+local entries = redis.call('ZRANGE', KEYS[1], 0, tonumber(ARGV[2]) - 1, 'WITHSCORES')
+local woken = 0
+for i = 1, #entries, 2 do
+    if tonumber(entries[i + 1]) > tonumber(ARGV[1]) then
+        redis.call('ZADD', KEYS[1], 'XX', ARGV[1], entries[i])
+        woken = woken + 1
+    end
+end
+if woken > 0 then
+    redis.call('LPUSH', KEYS[3], 1)
+    redis.call('LTRIM', KEYS[3], 0, 0)
+end
+return woken
+"""
+
+_scripts = {}
+
+
+def _run_script(redis_client, source, args=()):
+    """Run one of the Lua scripts above, loading it into Redis on first use."""
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = redis_client.register_script(source)
+    return script(keys=[UNMATCHED_RIDES_KEY, UNMATCHED_RIDES_DATA_KEY, RETRY_WAKEUP_KEY],
+                  args=list(args), client=redis_client)
+
+
+class MatchingStats:
+    """
+    Thread-safe counters of driver matching, shared by the consumer workers
+    and the retry scheduler.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.matched = 0
+        self.parked = 0
+        self.retried = 0
+        self.expired = 0
+        self.time_to_match_total = 0.0
+        self.time_to_match_max = 0.0
+
+    def record_matched(self, ride_requests):
+        now = datetime.now(timezone.utc)
+        waits = []
+        for ride_request in ride_requests:
+            try:
+                created_at = datetime.fromisoformat(ride_request['created_at'])
+            except (KeyError, TypeError, ValueError):
+                continue
+            if created_at.tzinfo is None:
+                created_at = created_at.replace(tzinfo=timezone.utc)
+            waits.append(max((now - created_at).total_seconds(), 0.0))
+        with self._lock:
+            self.matched += len(ride_requests)
+            self.time_to_match_total += sum(waits)
+            self.time_to_match_max = max([self.time_to_match_max] + waits)
+
+    def record_parked(self, count):
+        with self._lock:
+            self.parked += count
+
+    def record_retried(self, count):
+        with self._lock:
+            self.retried += count
+
+    def record_expired(self, count):
+        with self._lock:
+            self.expired += count
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'matched': self.matched,
+                'parked': self.parked,
+                'retried': self.retried,
+                'expired': self.expired,
+                'time_to_match_avg': self.time_to_match_total / self.matched if self.matched else None,
+                'time_to_match_max': self.time_to_match_max
+            }
+
+
+def park_ride_requests(redis_client, ride_requests, base_delay, max_delay):
+    """
+    Park unmatched ride requests in the delay queue.
+
+    Each ride is retried after an exponential backoff, `base_delay` seconds
+    after its first attempt and doubling with every attempt up to `max_delay`.
+
+    Args:
+        redis_client (Redis): An instance of a Redis client.
+        ride_requests (list): The unmatched ride requests.
+        base_delay (float): The delay before the first retry, in seconds.
+        max_delay (float): The maximum delay between two retries, in seconds.
+    """
+    if not ride_requests:
+        return
+    now = time.time()
+    pipe = redis_client.pipeline(transaction=True)
+    for ride_request in ride_requests:
+        ride_request['match_attempts'] = ride_request.get('match_attempts', 0) + 1
+        ride_request.setdefault('parked_at', now)
+        delay = min(base_delay * 2 ** (ride_request['match_attempts'] - 1), max_delay)
+        pipe.hset(UNMATCHED_RIDES_DATA_KEY, ride_request['request_id'], json.dumps(ride_request))
+        pipe.zadd(UNMATCHED_RIDES_KEY, {ride_request['request_id']: now + delay})
+    pipe.execute()
+
+
+def claim_due_ride_requests(redis_client, limit):
+    """
+    Remove the parked ride requests that are due for a retry from the queue.
+
+    Args:
+        redis_client (Redis): An instance of a Redis client.
+        limit (int): The maximum number of ride requests to claim.
+
+    Returns:
+        list: The claimed ride requests.
+    """
+    rides = _run_script(redis_client, _CLAIM_DUE_SCRIPT, [time.time(), limit])
+    return [json.loads(ride) for ride in rides if ride]
+
+
+def wake_parked_ride_requests(redis_client, count):
+    """
+    Make the next `count` parked ride requests due now, e.g. because a driver
+    became available.
+
+    Returns:
+        int: The number of ride requests brought forward.
+    """
+    return _run_script(redis_client, _WAKE_SCRIPT, [time.time(), count])
+
+
+def wait_for_wakeup(redis_client, timeout):
+    """
+    Block until wake_parked_ride_requests brought rides forward, in any
+    process, or for at most `timeout` seconds.
+    """
+    redis_client.blpop(RETRY_WAKEUP_KEY, timeout=timeout)
+
+
+def unmatched_queue_depth(redis_client):
+    return redis_client.zcard(UNMATCHED_RIDES_KEY)
+
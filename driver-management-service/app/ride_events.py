@@ -0,0 +1,78 @@
+from kafka.errors import KafkaError
+
+from app.metrics import timer
+
+
+class RideStatusDelivery:
+    # Bulk PUT to ride-request-service, which replies per ride
+    HTTP = 'http'
+    # Ride events published to Kafka and projected by ride-request-service
+    EVENTS = 'events'
+
+
+class RideEventType:
+    ASSIGNED = 'ride_assigned'
+    CANCELLED = 'ride_cancelled'
+
+
+def ride_version_key(request_id):
+    return f"ride:{request_id}:version"
+
+
+def ride_assigned_event(ride_request, status):
+    return {
+        'type': RideEventType.ASSIGNED,
+        'request_id': ride_request['request_id'],
+        'status': status,
+        'driver_id': ride_request['driver_id'],
+        'assigned_at': ride_request['assigned_at']
+    }
+
+
+def ride_cancelled_event(ride_request, status):
+    return {
+        'type': RideEventType.CANCELLED,
+        'request_id': ride_request['request_id'],
+        'status': status
+    }
+
+
+def publish_ride_events(app, events):
+    """
+    Publish ride events to the RIDE_EVENTS_TOPIC topic and wait until the
+    broker acknowledged all of them.
+
+    Every event gets the next version of its ride from a Redis counter, so
+    the projector in ride-request-service can drop events older than the
+    state it already applied, whichever worker produced them. Events are
+    keyed by request ID, which keeps the events of a ride in order.
+
+    Args:
+        app: The Flask application instance containing the Redis client and Kafka producer.
+        events (list): The events, without versions.
+
+    Returns:
+        bool: True if every event was acknowledged.
+    """
+    pipe = app.redis_client.pipeline(transaction=False)
+    for event in events:
+        pipe.incr(ride_version_key(event['request_id']))
+        pipe.expire(ride_version_key(event['request_id']), app.config['RIDE_VERSION_TTL'])
+    versions = pipe.execute()[::2]
+
+    try:
+        with timer('kafka', 'publish_ride_events'):
+            futures = [
+                app.kafka_producer.send(
+                    app.config['RIDE_EVENTS_TOPIC'],
+                    dict(event, version=version),
+                    key=event['request_id'].encode('utf-8')
+                )
+                for event, version in zip(events, versions)
+            ]
+            for future in futures:
+                future.get(timeout=app.config['RIDE_EVENTS_TIMEOUT'])
+    except KafkaError as e:
+        app.logger.error(f"Failed to publish {len(events)} ride events: {e}")
+        return False
+    return True
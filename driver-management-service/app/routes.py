@@ -1,5 +1,11 @@
 from flask import Blueprint, request, jsonify, current_app
-import json
+import time
+
+from app.assigned_rides import fetch_assigned_rides
+from app.geo import parse_location
+from app.logger import HOT_PATH
+from app.retry_queue import unmatched_queue_depth, wake_parked_ride_requests
+from app.utils import apply_driver_heartbeats, set_driver_available, set_driver_unavailable, update_driver_location
 
 driver_bp = Blueprint('driver', __name__)
 
@@ -9,34 +15,139 @@ def update_driver_status():
     driver_id = data.get('driver_id')
     status = data.get('status')
 
-    current_app.logger.info(f"Updating driver status for driver: {driver_id}")
+    current_app.logger.info("Updating driver status for driver: %s", driver_id, extra=HOT_PATH)
 
     # Validate input
     if not all([driver_id, status]):
         current_app.logger.warning("Missing required parameters during driver status update")
         return jsonify({'error': 'Missing required parameters'}), 400
-    
+
+    # The current location is optional here, drivers can also report it separately
+    location = None
+    if 'lat' in data or 'lon' in data:
+        location = parse_location(data)
+        if location is None:
+            current_app.logger.warning("Invalid location during driver status update")
+            return jsonify({'error': 'Invalid location'}), 400
+        update_driver_location(current_app.redis_client, driver_id, *location)
+
     # Update driver status
     if status == 'AVAILABLE':
-        current_app.redis_client.sadd('drivers:available', driver_id)
-        current_app.logger.info(f"Driver {driver_id} set to AVAILABLE")
+        set_driver_available(current_app.redis_client, driver_id, index=current_app.driver_index)
+        current_app.logger.info("Driver %s set to AVAILABLE", driver_id, extra=HOT_PATH)
+
+        # Retry the ride requests waiting for a driver
+        wake_parked_ride_requests(current_app.redis_client, current_app.config['RETRY_WAKE_COUNT'])
     else:
-        current_app.redis_client.srem('drivers:available', driver_id)
-        current_app.logger.info(f"Driver {driver_id} set to UNAVAILABLE")
+        set_driver_unavailable(current_app.redis_client, driver_id, index=current_app.driver_index)
+        current_app.logger.info("Driver %s set to UNAVAILABLE", driver_id, extra=HOT_PATH)
 
     return jsonify({'message': 'Driver status updated'}), 200
 
+@driver_bp.route('/drivers/update_location', methods=['POST'])
+def update_location():
+    data = request.get_json()
+    driver_id = data.get('driver_id')
+
+    # Validate input
+    if not driver_id:
+        current_app.logger.warning("Missing driver_id during driver location update")
+        return jsonify({'error': 'Missing required parameters'}), 400
+
+    location = parse_location(data)
+    if location is None:
+        current_app.logger.warning("Invalid location during driver location update")
+        return jsonify({'error': 'Invalid location'}), 400
+
+    available = update_driver_location(
+        current_app.redis_client, driver_id, *location, index=current_app.driver_index
+    )
+
+    return jsonify({'message': 'Driver location updated', 'available': available}), 200
+
+@driver_bp.route('/drivers/heartbeats', methods=['POST'])
+def bulk_driver_heartbeats():
+    data = request.get_json()
+    updates = data.get('updates') if isinstance(data, dict) else None
+    # Validate input
+    if not isinstance(updates, list) or not updates:
+        return jsonify({'error': 'Missing required parameters'}), 400
+    if len(updates) > current_app.config['HEARTBEAT_BATCH_MAX_ITEMS']:
+        return jsonify({'error': 'Too many updates in a single request'}), 413
+
+    now = time.time()
+    results = []
+    heartbeats = []
+    heartbeat_items = []
+    for item in updates:
+        driver_id = item.get('driver_id') if isinstance(item, dict) else None
+        status = item.get('status') if isinstance(item, dict) else None
+        if not all([driver_id, status]):
+            results.append({'driver_id': driver_id, 'result': 'invalid'})
+            continue
+
+        location = None
+        if 'lat' in item or 'lon' in item:
+            location = parse_location(item)
+            if location is None:
+                results.append({'driver_id': driver_id, 'result': 'invalid'})
+                continue
+
+        ts = item.get('ts', now)
+        if not isinstance(ts, (int, float)) or isinstance(ts, bool):
+            results.append({'driver_id': driver_id, 'result': 'invalid'})
+            continue
+
+        heartbeats.append((driver_id, status == 'AVAILABLE', ts, location))
+        heartbeat_items.append(len(results))
+        results.append({'driver_id': driver_id, 'result': None})
+
+    became_available = 0
+    if heartbeats:
+        applied = apply_driver_heartbeats(
+            current_app.redis_client, heartbeats, current_app.config['HEARTBEAT_TTL'], index=current_app.driver_index
+        )
+        for i, result in zip(heartbeat_items, applied):
+            if result == 'became_available':
+                became_available += 1
+                result = 'available'
+            results[i]['result'] = result
+
+    current_app.logger.info("Applied %s of %s driver heartbeats", len(heartbeats), len(updates), extra=HOT_PATH)
+
+    # Retry the ride requests waiting for a driver
+    if became_available:
+        wake_parked_ride_requests(current_app.redis_client, min(became_available, current_app.config['RETRY_WAKE_COUNT']))
+
+    return jsonify({'results': results}), 200
+
+@driver_bp.route('/drivers/matching/stats', methods=['GET'])
+def get_matching_stats():
+    stats = current_app.matching_stats.as_dict()
+    stats['unmatched_queue_depth'] = unmatched_queue_depth(current_app.redis_client)
+    return jsonify(stats), 200
+
 @driver_bp.route('/drivers/assigned_rides/<driver_id>', methods=['GET'])
 def get_assigned_rides(driver_id):
-    current_app.logger.info(f"Fetching assigned rides for driver: {driver_id}")
+    current_app.logger.info("Fetching assigned rides for driver: %s", driver_id, extra=HOT_PATH)
+
+    try:
+        cursor = int(request.args.get('cursor', 0))
+        limit = int(request.args.get('limit', current_app.config['ASSIGNED_RIDES_PAGE_SIZE']))
+    except ValueError:
+        return jsonify({'error': 'Invalid cursor or limit'}), 400
+    if cursor < 0 or limit < 1:
+        return jsonify({'error': 'Invalid cursor or limit'}), 400
+    limit = min(limit, current_app.config['ASSIGNED_RIDES_MAX_PAGE_SIZE'])
+    archived = request.args.get('archived', 'false').lower() == 'true'
 
     try:
-        assigned_rides_key = f"driver:{driver_id}:assigned_rides"
-        rides = current_app.redis_client.lrange(assigned_rides_key, 0, -1)
-        rides = [json.loads(ride.decode('utf-8')) for ride in rides]
+        rides, next_cursor = fetch_assigned_rides(
+            current_app.redis_client, driver_id, cursor=cursor, limit=limit, archived=archived
+        )
 
-        current_app.logger.info(f"Assigned rides: {rides}")
-        return jsonify({'assigned_rides': rides}), 200
+        current_app.logger.info("Fetched %s assigned rides for driver %s", len(rides), driver_id, extra=HOT_PATH)
+        return jsonify({'assigned_rides': rides, 'next_cursor': next_cursor}), 200
     except Exception as e:
         current_app.logger.error(f"Error fetching assigned rides: {e}")
-        return jsonify({'error': 'Unable to fetch assigned rides'}), 500
\ No newline at end of file
+        return jsonify({'error': 'Unable to fetch assigned rides'}), 500
@@ -0,0 +1,204 @@
+from datetime import datetime, timedelta, timezone
+import random
+from threading import Lock
+import time
+
+import jwt
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import AuthBase
+
+from app.metrics import timer
+
+RETRYABLE_METHODS = frozenset(['GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'])
+RETRYABLE_STATUS_CODES = frozenset([502, 503, 504])
+
+
+class CircuitOpenError(requests.exceptions.ConnectionError):
+    """Raised instead of calling a downstream service whose circuit is open."""
+
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    fail fast for `reset_timeout` seconds. Then a single trial call is let
+    through: success closes the circuit, failure opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0
+        self._lock = Lock()
+
+    def allow_request(self):
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+                # Let one trial call through
+                self.state = self.HALF_OPEN
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self.failures = 0
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+
+class ServiceToken(AuthBase):
+    """
+    Authenticates calls to another service with a JWT signed with the shared
+    SECRET_KEY, like the tokens issued by user-service.
+
+    The token names the calling service in its `user_id` claim and has the
+    SERVICE role. It is reused until `refresh_margin` seconds before it
+    expires, so the receiving service can serve it from its token cache.
+    """
+
+    ROLE = 'SERVICE'
+
+    def __init__(self, secret_key, service_name, lifetime=3600, refresh_margin=60):
+        self.secret_key = secret_key
+        self.service_name = service_name
+        self.lifetime = lifetime
+        self.refresh_margin = refresh_margin
+        self._token = None
+        self._expires_at = 0
+        self._lock = Lock()
+
+    def token(self):
+        with self._lock:
+            if time.time() >= self._expires_at - self.refresh_margin:
+                expires_at = datetime.now(timezone.utc) + timedelta(seconds=self.lifetime)
+                self._token = jwt.encode({
+                    'user_id': self.service_name,
+                    'username': self.service_name,
+                    'role': self.ROLE,
+                    'exp': expires_at
+                }, self.secret_key, algorithm='HS256')
+                self._expires_at = expires_at.timestamp()
+            return self._token
+
+    def __call__(self, request):
+        request.headers['Authorization'] = f"Bearer {self.token()}"
+        return request
+
+
+class ServiceClient:
+    """
+    HTTP client for calls to another service of the application.
+
+    Keeps a pool of keep-alive connections, retries idempotent requests on
+    connection errors and 502/503/504 responses with full-jitter exponential
+    backoff, and fails fast through a circuit breaker while the service is
+    unhealthy. Errors are raised as requests exceptions, like module-level
+    `requests` calls. Every call, retries included, is timed under the
+    client's `name`. `auth` (e.g. a ServiceToken) authenticates every call.
+    """
+
+    def __init__(self, base_url, pool_size=10, connect_timeout=1.0, read_timeout=2.0,
+                 retries=2, backoff=0.1, max_backoff=1.0,
+                 breaker_threshold=5, breaker_reset_timeout=30, name=None, auth=None):
+        self.base_url = base_url.rstrip('/')
+        self.name = name or self.base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.breaker = CircuitBreaker(breaker_threshold, breaker_reset_timeout)
+
+        self.session = requests.Session()
+        self.session.auth = auth
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=False)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    @classmethod
+    def from_config(cls, config, prefix, auth=None):
+        """Build a client from the `<prefix>_*` settings of a Flask config."""
+        return cls(
+            config[f'{prefix}_URL'],
+            pool_size=config[f'{prefix}_POOL_SIZE'],
+            connect_timeout=config[f'{prefix}_CONNECT_TIMEOUT'],
+            read_timeout=config[f'{prefix}_READ_TIMEOUT'],
+            retries=config[f'{prefix}_RETRIES'],
+            backoff=config[f'{prefix}_BACKOFF'],
+            breaker_threshold=config[f'{prefix}_BREAKER_THRESHOLD'],
+            breaker_reset_timeout=config[f'{prefix}_BREAKER_RESET_TIMEOUT'],
+            name=prefix.lower().replace('_', '-'),
+            auth=auth
+        )
+
+    def request(self, method, path, timeout=None, **kwargs):
+        """
+        Send a request to `path` on the service.
+
+        Args:
+            method (str): The HTTP method.
+            path (str): The path of the endpoint, starting with '/'.
+            timeout (float or tuple, optional): Overrides the client's (connect, read) timeout.
+            **kwargs: Passed on to `requests.Session.request`.
+
+        Returns:
+            requests.Response: The response, whatever its status code.
+
+        Raises:
+            CircuitOpenError: If the circuit is open.
+            requests.exceptions.RequestException: If the request failed after all retries.
+        """
+        method = method.upper()
+        with timer(self.name, method):
+            return self._request(method, path, timeout, **kwargs)
+
+    def _request(self, method, path, timeout, **kwargs):
+        attempts = self.retries + 1 if method in RETRYABLE_METHODS else 1
+        url = f"{self.base_url}{path}"
+
+        for attempt in range(attempts):
+            if not self.breaker.allow_request():
+                raise CircuitOpenError(f"Circuit open for {self.base_url}")
+
+            last_attempt = attempt == attempts - 1
+            try:
+                response = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            except requests.exceptions.RequestException as e:
+                self.breaker.record_failure()
+                retryable = isinstance(e, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+                if last_attempt or not retryable:
+                    raise
+            else:
+                if response.status_code not in RETRYABLE_STATUS_CODES:
+                    self.breaker.record_success()
+                    return response
+                self.breaker.record_failure()
+                if last_attempt:
+                    return response
+
+            # Full jitter: sleep a random time up to the exponential backoff
+            time.sleep(random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt)))
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
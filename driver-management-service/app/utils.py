@@ -1,23 +1,379 @@
-import redis
+import time
 
-# TODO: Change the implementation of this function in order to find the best
-# available driver based on the driver's current location and the ride's pickup
-def find_available_driver(redis_client):
+from app.geo import parse_location
+from app.metrics import timer
+
+AVAILABLE_DRIVERS_KEY = 'drivers:available'
+AVAILABLE_DRIVERS_GEO_KEY = 'drivers:available:geo'
+DRIVER_LOCATIONS_KEY = 'drivers:locations'
+DRIVER_HEARTBEATS_KEY = 'drivers:heartbeats'
+
+# Mark a driver as available and, if its last location is known, copy the
+# location into the geo set of available drivers.
+_SET_AVAILABLE_SCRIPT = """
+redis.call('SADD', KEYS[1], ARGV[1])
+local position = redis.call('GEOPOS', KEYS[3], ARGV[1])[1]
+if position then
+    redis.call('GEOADD', KEYS[2], position[1], position[2], ARGV[1])
+end
+return 1
+"""
+
+# Record a driver's location, mirroring it into the geo set of available
+# drivers only while the driver is available.
+_UPDATE_LOCATION_SCRIPT = """
+redis.call('GEOADD', KEYS[3], ARGV[2], ARGV[3], ARGV[1])
+if redis.call('SISMEMBER', KEYS[1], ARGV[1]) == 1 then
+    redis.call('GEOADD', KEYS[2], ARGV[2], ARGV[3], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# Claim the nearest available driver within a radius. The search starts with a
+# small radius and widens it, so its cost follows the local driver density
+# rather than the fleet size. Candidates are removed from both the geo set and
+# the available set in the same script, so two consumers can never claim the
+# same driver.
+_CLAIM_NEAREST_SCRIPT = """
+local max_radius = tonumber(ARGV[3])
+local radius = math.min(tonumber(ARGV[5]), max_radius)
+while true do
+    local candidates = redis.call('GEOSEARCH', KEYS[2], 'FROMLONLAT', ARGV[1], ARGV[2],
+                                  'BYRADIUS', radius, 'km', 'ASC', 'COUNT', tonumber(ARGV[4]))
+    for _, driver_id in ipairs(candidates) do
+        redis.call('ZREM', KEYS[2], driver_id)
+        if redis.call('SREM', KEYS[1], driver_id) == 1 then
+            return driver_id
+        end
+    end
+    if radius >= max_radius then
+        return false
+    end
+    radius = math.min(radius * 4, max_radius)
+end
+"""
+
+# Claim any available driver, keeping the geo set in sync.
+_CLAIM_ANY_SCRIPT = """
+local driver_id = redis.call('SPOP', KEYS[1])
+if driver_id then
+    redis.call('ZREM', KEYS[2], driver_id)
+end
+return driver_id
+"""
+
+# Claim a specific driver picked by an in-process index.
+_CLAIM_DRIVER_SCRIPT = """
+if redis.call('SREM', KEYS[1], ARGV[1]) == 1 then
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    return 1
+end
+return 0
+"""
+
+# Apply one driver heartbeat: record when it was received, the location if it
+# carries one, and the driver's availability. Heartbeats sent before ARGV[4]
+# have lapsed already and are ignored.
+_HEARTBEAT_SCRIPT = """
+if tonumber(ARGV[3]) < tonumber(ARGV[4]) then
+    return 'expired'
+end
+redis.call('ZADD', KEYS[4], ARGV[5], ARGV[1])
+if ARGV[6] ~= '' then
+    redis.call('GEOADD', KEYS[3], ARGV[6], ARGV[7], ARGV[1])
+end
+if ARGV[2] == '1' then
+    local added = redis.call('SADD', KEYS[1], ARGV[1])
+    local position = redis.call('GEOPOS', KEYS[3], ARGV[1])[1]
+    if position then
+        redis.call('GEOADD', KEYS[2], position[1], position[2], ARGV[1])
+    end
+    if added == 1 then
+        return 'became_available'
+    end
+    return 'available'
+end
+redis.call('SREM', KEYS[1], ARGV[1])
+redis.call('ZREM', KEYS[2], ARGV[1])
+return 'unavailable'
+"""
+
+# Remove up to ARGV[2] drivers whose last heartbeat is older than ARGV[1] from
+# matching.
+_EXPIRE_LAPSED_SCRIPT = """
+local driver_ids = redis.call('ZRANGEBYSCORE', KEYS[4], '-inf', ARGV[1], 'LIMIT', 0, tonumber(ARGV[2]))
+for _, driver_id in ipairs(driver_ids) do
+    redis.call('SREM', KEYS[1], driver_id)
+    redis.call('ZREM', KEYS[2], driver_id)
+    redis.call('ZREM', KEYS[4], driver_id)
+end
+return driver_ids
+"""
+
+_scripts = {}
+
+
+def _run_script(redis_client, source, args=()):
+    """Run one of the Lua scripts above, loading it into Redis on first use."""
+    script = _scripts.get(source)
+    if script is None:
+        script = _scripts[source] = redis_client.register_script(source)
+    keys = [AVAILABLE_DRIVERS_KEY, AVAILABLE_DRIVERS_GEO_KEY, DRIVER_LOCATIONS_KEY, DRIVER_HEARTBEATS_KEY]
+    return script(keys=keys, args=list(args), client=redis_client)
+
+
+def _decode(value):
+    if isinstance(value, bytes):
+        return value.decode('utf-8')
+    return value
+
+
+def set_driver_available(redis_client, driver_id, index=None):
+    """
+    Mark a driver as available for matching.
+
+    Args:
+        redis_client (Redis): An instance of a Redis client.
+        driver_id (str): The ID of the driver.
+        index (GridIndex, optional): In-process index to keep in sync.
+    """
+    _run_script(redis_client, _SET_AVAILABLE_SCRIPT, [driver_id])
+    if index is not None:
+        index_drivers(redis_client, index, [driver_id])
+
+
+@timer('redis', 'set_driver_unavailable')
+def set_driver_unavailable(redis_client, driver_id, index=None):
     """
-    Find and return an available driver from the Redis set "drivers:available".
+    Remove a driver from matching.
 
-    This function pops a driver ID from the Redis set "drivers:available" and returns it.
-    If no driver ID is available, it returns None.
+    Args:
+        redis_client (Redis): An instance of a Redis client.
+        driver_id (str): The ID of the driver.
+        index (GridIndex, optional): In-process index to keep in sync.
+    """
+    pipe = redis_client.pipeline()
+    pipe.srem(AVAILABLE_DRIVERS_KEY, driver_id)
+    pipe.zrem(AVAILABLE_DRIVERS_GEO_KEY, driver_id)
+    pipe.execute()
+    if index is not None:
+        index.remove(driver_id)
+
+
+@timer('redis', 'update_driver_location')
+def update_driver_location(redis_client, driver_id, lat, lon, index=None):
+    """
+    Record the current location of a driver.
+
+    Args:
+        redis_client (Redis): An instance of a Redis client.
+        driver_id (str): The ID of the driver.
+        lat (float): Latitude reported by the driver.
+        lon (float): Longitude reported by the driver.
+        index (GridIndex, optional): In-process index to keep in sync.
+
+    Returns:
+        bool: True if the driver is currently available for matching.
+    """
+    available = bool(_run_script(redis_client, _UPDATE_LOCATION_SCRIPT, [driver_id, lon, lat]))
+    if index is not None and available:
+        index.add(driver_id, lat, lon)
+    return available
+
+
+@timer('redis', 'apply_driver_heartbeats')
+def apply_driver_heartbeats(redis_client, heartbeats, ttl, index=None):
+    """
+    Apply a batch of driver heartbeats in a single Redis pipeline.
 
     Args:
         redis_client (Redis): An instance of a Redis client.
+        heartbeats (list): Tuples of (driver_id, available, ts, location), where
+            ts is the UNIX time the heartbeat was sent at and location is a
+            (lat, lon) tuple or None.
+        ttl (float): How long, in seconds, a heartbeat keeps a driver available.
+        index (GridIndex, optional): In-process index to keep in sync.
 
     Returns:
-        str or None: The ID of an available driver as a string, or None if no driver is available.
+        list: 'available', 'unavailable' or 'expired' for each heartbeat, and
+        'became_available' for drivers that were not available before.
     """
+    now = time.time()
+    pipe = redis_client.pipeline(transaction=False)
+    for driver_id, available, ts, location in heartbeats:
+        lat, lon = location if location is not None else ('', '')
+        _run_script(pipe, _HEARTBEAT_SCRIPT, [driver_id, int(available), ts, now - ttl, now, lon, lat])
+    results = [_decode(result) for result in pipe.execute()]
+
+    if index is not None:
+        unlocated = []
+        for (driver_id, _available, _ts, location), result in zip(heartbeats, results):
+            if result == 'unavailable':
+                index.remove(driver_id)
+            elif result in ('available', 'became_available'):
+                if location is not None:
+                    index.add(driver_id, *location)
+                else:
+                    unlocated.append(driver_id)
+        index_drivers(redis_client, index, unlocated)
+    return results
+
 
-    driver_id = redis_client.spop("drivers:available")
-    if driver_id is not None:
-        return driver_id.decode('utf-8')
+@timer('redis', 'expire_lapsed_drivers')
+def expire_lapsed_drivers(redis_client, ttl, limit=1000, index=None):
+    """
+    Remove drivers whose heartbeats lapsed more than `ttl` seconds ago from matching.
+
+    Drivers that never sent a heartbeat are not affected.
+
+    Args:
+        redis_client (Redis): An instance of a Redis client.
+        ttl (float): How long, in seconds, a heartbeat keeps a driver available.
+        limit (int): The maximum number of drivers to expire.
+        index (GridIndex, optional): In-process index to keep in sync.
+
+    Returns:
+        list: The IDs of the expired drivers.
+    """
+    driver_ids = [_decode(d) for d in _run_script(redis_client, _EXPIRE_LAPSED_SCRIPT, [time.time() - ttl, limit])]
+    if index is not None:
+        for driver_id in driver_ids:
+            index.remove(driver_id)
+    return driver_ids
+
+
+def index_drivers(redis_client, index, driver_ids):
+    """
+    Add drivers to an in-process index at their last known location.
+
+    Args:
+        redis_client (Redis): An instance of a Redis client.
+        index (GridIndex): The index to update.
+        driver_ids (list): The IDs of the drivers, which must be available.
+    """
+    for start in range(0, len(driver_ids), 1000):
+        chunk = driver_ids[start:start + 1000]
+        for driver_id, position in zip(chunk, redis_client.geopos(DRIVER_LOCATIONS_KEY, *chunk)):
+            if position is not None:
+                lon, lat = position
+                index.add(driver_id, lat, lon)
+
+
+def load_driver_index(redis_client, index):
+    """
+    Populate an in-process index with every available driver whose location is known.
+
+    Args:
+        redis_client (Redis): An instance of a Redis client.
+        index (GridIndex): The index to populate.
+
+    Returns:
+        int: The number of drivers loaded.
+    """
+    driver_ids = [_decode(d) for d in redis_client.zrange(AVAILABLE_DRIVERS_GEO_KEY, 0, -1)]
+    index_drivers(redis_client, index, driver_ids)
+    return len(index)
+
+
+def find_available_driver(redis_client, pickup_location=None, index=None,
+                          max_radius_km=10.0, candidates=10, fallback_to_any=True,
+                          initial_radius_km=0.5):
+    """
+    Claim the available driver closest to the pickup location.
+
+    The nearest drivers are looked up in the Redis geo set of available
+    drivers (or in `index` when an in-process index is used) and the first
+    one that can be atomically removed from "drivers:available" is returned.
+    When the pickup location has no coordinates, or no driver is within
+    `max_radius_km`, any available driver is claimed if `fallback_to_any` is set.
+
+    Args:
+        redis_client (Redis): An instance of a Redis client.
+        pickup_location: The pickup location of the ride, see `parse_location`.
+        index (GridIndex, optional): In-process index to search instead of Redis.
+        max_radius_km (float): The maximum pickup distance in kilometers.
+        candidates (int): How many nearest drivers to try before giving up.
+        fallback_to_any (bool): Whether to claim any driver when none is nearby.
+        initial_radius_km (float): The radius of the first Redis search, widened up to `max_radius_km`.
+
+    Returns:
+        str or None: The ID of the claimed driver, or None if no driver is available.
+    """
+    coordinates = parse_location(pickup_location)
+    if coordinates is not None:
+        lat, lon = coordinates
+        if index is not None:
+            for _, driver_id in index.nearest(lat, lon, k=candidates, max_radius_km=max_radius_km):
+                index.remove(driver_id)
+                if _run_script(redis_client, _CLAIM_DRIVER_SCRIPT, [driver_id]):
+                    return driver_id
+        else:
+            driver_id = _run_script(
+                redis_client, _CLAIM_NEAREST_SCRIPT, [lon, lat, max_radius_km, candidates, initial_radius_km]
+            )
+            if driver_id:
+                return _decode(driver_id)
+
+        if not fallback_to_any:
+            return None
+
+    driver_id = _run_script(redis_client, _CLAIM_ANY_SCRIPT)
+    if driver_id:
+        driver_id = _decode(driver_id)
+        if index is not None:
+            index.remove(driver_id)
+        return driver_id
     return None
 
+
+def find_available_drivers(redis_client, pickup_locations, index=None,
+                           max_radius_km=10.0, candidates=10, fallback_to_any=True,
+                           initial_radius_km=0.5):
+    """
+    Claim one driver for each pickup location, in order.
+
+    Behaves like calling `find_available_driver` once per location, but when
+    searching Redis all claims are sent in a single pipeline, plus a second
+    one for the fallback claims of rides with no nearby driver.
+
+    Args:
+        redis_client (Redis): An instance of a Redis client.
+        pickup_locations (list): The pickup locations of the rides.
+        index, max_radius_km, candidates, fallback_to_any, initial_radius_km:
+            See `find_available_driver`.
+
+    Returns:
+        list: The ID of the claimed driver, or None, for each pickup location.
+    """
+    if index is not None:
+        # The in-process search is local, only the claims hit Redis
+        return [
+            find_available_driver(
+                redis_client, location, index=index, max_radius_km=max_radius_km,
+                candidates=candidates, fallback_to_any=fallback_to_any,
+                initial_radius_km=initial_radius_km
+            )
+            for location in pickup_locations
+        ]
+
+    coordinates = [parse_location(location) for location in pickup_locations]
+    pipe = redis_client.pipeline(transaction=False)
+    for point in coordinates:
+        if point is not None:
+            lat, lon = point
+            _run_script(pipe, _CLAIM_NEAREST_SCRIPT, [lon, lat, max_radius_km, candidates, initial_radius_km])
+        else:
+            _run_script(pipe, _CLAIM_ANY_SCRIPT)
+    driver_ids = [_decode(driver_id) if driver_id else None for driver_id in pipe.execute()]
+
+    if fallback_to_any:
+        retry = [i for i, driver_id in enumerate(driver_ids) if driver_id is None and coordinates[i] is not None]
+        if retry:
+            pipe = redis_client.pipeline(transaction=False)
+            for _ in retry:
+                _run_script(pipe, _CLAIM_ANY_SCRIPT)
+            for i, driver_id in zip(retry, pipe.execute()):
+                driver_ids[i] = _decode(driver_id) if driver_id else None
+
+    return driver_ids
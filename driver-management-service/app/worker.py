@@ -0,0 +1,18 @@
+"""
+Runs the background workers of the service without serving HTTP.
+
+Web processes do not start the background workers (unless
+BACKGROUND_WORKERS is set), so they run in their own designated processes:
+    python -m app.worker
+"""
+from app import create_app, start_background_workers
+
+
+def main():
+    app = create_app(start_workers=False)
+    for thread in start_background_workers(app):
+        thread.join()
+
+
+if __name__ == '__main__':
+    main()
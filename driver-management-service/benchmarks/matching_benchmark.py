@@ -0,0 +1,115 @@
+"""
+Driver matching latency benchmark.
+
+Measures how long it takes to claim a driver for a ride request with 1k, 10k
+and 100k online drivers spread over a metropolitan area, comparing the
+nearest-driver search against the old random SPOP.
+
+The in-process grid index is always measured. Pass --redis-url to also measure
+the Redis geo set and the SPOP baseline against a real Redis server; the
+benchmark uses its own database number and flushes it.
+
+Usage (from the driver-management-service directory):
+    python -m benchmarks.matching_benchmark [--redis-url redis://localhost:6379/15]
+"""
+import argparse
+import random
+import statistics
+import time
+
+from app.geo import GridIndex
+from app.utils import (
+    AVAILABLE_DRIVERS_KEY, find_available_driver, set_driver_available, update_driver_location
+)
+
+# Roughly the city of Milan
+CENTER_LAT, CENTER_LON = 45.4642, 9.1900
+SPREAD_DEG = 0.15
+
+
+def random_point(rng):
+    return (CENTER_LAT + rng.uniform(-SPREAD_DEG, SPREAD_DEG),
+            CENTER_LON + rng.uniform(-SPREAD_DEG, SPREAD_DEG))
+
+
+def summarize(label, fleet_size, samples):
+    samples = sorted(samples)
+    p50 = statistics.median(samples)
+    p99 = samples[int(len(samples) * 0.99) - 1]
+    print(f"{label:<14} drivers={fleet_size:>7}  p50={p50 * 1e6:8.1f}us  p99={p99 * 1e6:8.1f}us")
+
+
+def bench_grid(fleet_size, queries, rng):
+    index = GridIndex()
+    positions = {}
+    for i in range(fleet_size):
+        driver_id = f"driver-{i}"
+        positions[driver_id] = random_point(rng)
+        index.add(driver_id, *positions[driver_id])
+
+    samples = []
+    for _ in range(queries):
+        lat, lon = random_point(rng)
+        start = time.perf_counter()
+        nearest = index.nearest(lat, lon, k=1, max_radius_km=10)
+        if nearest:
+            index.remove(nearest[0][1])
+        samples.append(time.perf_counter() - start)
+        # Put the driver back so the fleet size stays constant
+        if nearest:
+            index.add(nearest[0][1], *positions[nearest[0][1]])
+    summarize('grid', fleet_size, samples)
+
+
+def bench_redis(redis_client, fleet_size, queries, rng):
+    redis_client.flushdb()
+    positions = {}
+    pipe = redis_client.pipeline(transaction=False)
+    for i in range(fleet_size):
+        driver_id = f"driver-{i}"
+        positions[driver_id] = random_point(rng)
+        update_driver_location(pipe, driver_id, *positions[driver_id])
+        set_driver_available(pipe, driver_id)
+        if i % 1000 == 999:
+            pipe.execute()
+    pipe.execute()
+
+    geo_samples, spop_samples = [], []
+    for _ in range(queries):
+        pickup = random_point(rng)
+        start = time.perf_counter()
+        driver_id = find_available_driver(redis_client, pickup_location=pickup)
+        geo_samples.append(time.perf_counter() - start)
+        set_driver_available(redis_client, driver_id)
+
+        start = time.perf_counter()
+        driver_id = redis_client.spop(AVAILABLE_DRIVERS_KEY)
+        spop_samples.append(time.perf_counter() - start)
+        redis_client.sadd(AVAILABLE_DRIVERS_KEY, driver_id)
+
+    summarize('redis geo', fleet_size, geo_samples)
+    summarize('redis spop', fleet_size, spop_samples)
+    redis_client.flushdb()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--redis-url', help='Redis database to benchmark against (will be flushed)')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    redis_client = None
+    if args.redis_url:
+        import redis
+        redis_client = redis.Redis.from_url(args.redis_url)
+
+    for fleet_size in args.sizes:
+        bench_grid(fleet_size, args.queries, rng)
+        if redis_client is not None:
+            bench_redis(redis_client, fleet_size, args.queries, rng)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,131 @@
+import atexit
+from concurrent.futures import ThreadPoolExecutor
 import json
+from threading import Thread
 
 from flask import Flask
 from flask_pymongo import PyMongo
 from kafka import KafkaProducer
+import redis
 
 from app.routes import ride_bp
+from app.cache import RideStatusCache, TTLCache, UserProfileCache
 from app.config import Config
+from app.db import ensure_indexes
+from app.lazy import LazyClient
 from app.logger import setup_logging
+from app.metrics import register_stats, setup_metrics
+from app.service_client import ServiceClient
+from app.producer import DeliveryStats
+from app.projector import run_ride_event_projector
 
 
-def create_app():
+def create_app(start_workers=None):
+    """
+    Create the Flask application.
+
+    Clients connect on first use, so creating the application does no I/O
+    unless MONGO_CREATE_INDEXES is set.
+
+    Args:
+        start_workers (bool, optional): Whether to start the background
+            workers in this process, BACKGROUND_WORKERS by default.
+
+    Returns:
+        Flask: The application.
+    """
     app = Flask(__name__)
     app.config.from_object(Config)
 
     # Initialize logging
     setup_logging(app)
 
-    # Initialize PyMongo
-    mongo = PyMongo(app)
+    # Initialize metrics, served at /metrics
+    setup_metrics(app)
+
+    # Initialize PyMongo; the client connects on the first operation
+    mongo = PyMongo(app, connect=False)
     app.mongo = mongo
+    if app.config['MONGO_CREATE_INDEXES']:
+        ensure_indexes(app, mongo.db)
+
+    @app.cli.command('init-db')
+    def init_db():
+        """Create the MongoDB indexes."""
+        ensure_indexes(app, mongo.db)
+
+    # Initialize the optional Redis client shared by the worker processes
+    app.redis_client = redis.Redis.from_url(app.config['REDIS_URL']) if app.config['REDIS_URL'] else None
+
+    # Initialize the pooled client for user-service
+    app.user_service = ServiceClient.from_config(app.config, 'USER_SERVICE')
+
+    # Initialize the user profile cache
+    app.user_cache = None
+    if app.config['USER_CACHE_ENABLED']:
+        app.user_cache = UserProfileCache(
+            maxsize=app.config['USER_CACHE_MAX_ENTRIES'],
+            ttl=app.config['USER_CACHE_TTL'],
+            negative_ttl=app.config['USER_CACHE_NEGATIVE_TTL'],
+            redis_client=app.redis_client if app.config['USER_CACHE_SHARED'] else None
+        )
+        register_stats('user_cache', 'User profile cache counters.', app.user_cache.stats)
 
-    # Initialize Kafka Producer
-    producer = KafkaProducer(
+    # Initialize the verified token cache
+    app.token_cache = None
+    if app.config['TOKEN_CACHE_ENABLED']:
+        app.token_cache = TTLCache(app.config['TOKEN_CACHE_MAX_ENTRIES'], app.config['TOKEN_CACHE_TTL'])
+        register_stats('token_cache', 'Verified token cache counters.', app.token_cache.stats)
+
+    # Initialize the ride status cache
+    app.status_cache = None
+    if app.config['STATUS_CACHE_ENABLED']:
+        app.status_cache = RideStatusCache(
+            maxsize=app.config['STATUS_CACHE_MAX_ENTRIES'],
+            ttl=app.config['STATUS_CACHE_TTL'],
+            redis_client=app.redis_client,
+            shared_ttl=app.config['STATUS_CACHE_SHARED_TTL']
+        )
+        register_stats('status_cache', 'Ride status cache counters.', app.status_cache.stats)
+
+    # Initialize Kafka Producer, created with the first ride request
+    producer = LazyClient(lambda: KafkaProducer(
         bootstrap_servers=app.config['KAFKA_BOOTSTRAP_SERVERS'],
-        value_serializer=lambda v: json.dumps(v).encode('utf-8')
-    )
+        value_serializer=lambda v: json.dumps(v).encode('utf-8'),
+        acks=app.config['KAFKA_ACKS'],
+        linger_ms=app.config['KAFKA_LINGER_MS'],
+        batch_size=app.config['KAFKA_BATCH_SIZE'],
+        compression_type=app.config['KAFKA_COMPRESSION_TYPE']
+    ))
     app.kafka_producer = producer
+    app.delivery_stats = DeliveryStats()
+    register_stats('kafka_delivery', 'Kafka delivery counters of ride requests.', app.delivery_stats.as_dict)
+    # Cancels the rides whose async delivery failed; its thread starts with the first failure
+    app.delivery_failures = ThreadPoolExecutor(max_workers=1, thread_name_prefix='delivery-failures')
+
+    # Deliver records still buffered by the producer before the process exits
+    atexit.register(producer.close, timeout=app.config['KAFKA_CLOSE_TIMEOUT'])
+
+    if app.config['BACKGROUND_WORKERS'] if start_workers is None else start_workers:
+        start_background_workers(app)
 
     # Register blueprints
     app.register_blueprint(ride_bp)
 
-    return app
\ No newline at end of file
+    return app
+
+
+def start_background_workers(app):
+    """
+    Start the projectors of ride events in separate threads.
+
+    Returns:
+        list: The started threads.
+    """
+    threads = []
+    for worker_id in range(app.config['RIDE_EVENTS_PROJECTOR_WORKERS']):
+        projector_thread = Thread(target=run_ride_event_projector, args=(app, worker_id))
+        projector_thread.daemon = True
+        projector_thread.start()
+        threads.append(projector_thread)
+    return threads
\ No newline at end of file
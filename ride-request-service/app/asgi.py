@@ -0,0 +1,5 @@
+# Run the asyncio serving mode with an ASGI server, e.g.
+#   hypercorn app.asgi:app --bind 0.0.0.0:5001
+from app.async_app import create_async_app
+
+app = create_async_app()
@@ -0,0 +1,601 @@
+"""
+Asyncio serving mode for ride-request-service.
+
+Serves the same endpoints as the Flask app with Quart, using motor for
+MongoDB, aiokafka for Kafka and httpx for user-service, so that a single
+process can hold thousands of in-flight requests instead of one worker
+thread each. See app/asgi.py for how to run it.
+"""
+import asyncio
+from datetime import datetime, timezone
+from functools import wraps
+import json
+import uuid
+
+from aiokafka import AIOKafkaProducer
+from aiokafka.errors import KafkaError
+import httpx
+import jwt
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError
+from quart import Blueprint, Quart, current_app, g, jsonify, make_response, request
+
+from app.cache import RideStatusCache, TTLCache
+from app.config import Config
+from app.db import RIDE_STATUS_PROJECTION, ensure_indexes_async
+from app.logger import HOT_PATH, setup_logging
+from app.metrics import register_stats, setup_metrics, timer
+from app.producer import DeliveryMode, DeliveryStats, pickup_region_key
+from app.routes import (
+    RideStatus, prepare_bulk_updates, record_bulk_write_errors, record_missing_rides, status_etag, updated_statuses
+)
+from app.service_client import CircuitBreaker, CircuitOpenError, ServiceToken
+from app.status_events import StatusBroadcaster
+from app.utils import decode_token, get_bearer_token
+
+async_ride_bp = Blueprint('async_ride_bp', __name__)
+
+# Statuses after which a ride never changes again
+FINAL_STATUSES = {RideStatus.COMPLETED.value, RideStatus.CANCELLED.value}
+
+
+def check_token(token):
+    """Verify a token and bind its claims to g; return an error response, or None if it is valid."""
+    if not token:
+        current_app.logger.warning("Token is missing")
+        return jsonify({'message': 'Token is missing'}), 401
+
+    try:
+        data = decode_token(token, current_app.config['SECRET_KEY'], current_app.token_cache)
+        g.user_id = data['user_id']
+        g.username = data.get('username')
+        g.role = data.get('role')
+    except jwt.ExpiredSignatureError:
+        return jsonify({'message': 'Token is expired'}), 401
+    except jwt.InvalidTokenError:
+        return jsonify({'message': 'Invalid token'}), 401
+    return None
+
+
+def token_required(f):
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        # Get token from the Authorization header
+        error = check_token(get_bearer_token(request.headers))
+        if error is not None:
+            return error
+        return await f(*args, **kwargs)
+    return decorated
+
+
+def stream_token_required(f):
+    """
+    Like token_required, but also accepts the token as the `token` query
+    parameter, since browsers' EventSource cannot send headers.
+    """
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        error = check_token(get_bearer_token(request.headers) or request.args.get('token'))
+        if error is not None:
+            return error
+        return await f(*args, **kwargs)
+    return decorated
+
+
+def service_required(f):
+    """Only let other services of the application through; apply below @token_required."""
+    @wraps(f)
+    async def decorated(*args, **kwargs):
+        if g.get('role') != ServiceToken.ROLE:
+            current_app.logger.warning(f"Service role required, user {g.get('user_id')} has role {g.get('role')}")
+            return jsonify({'message': 'Forbidden'}), 403
+        return await f(*args, **kwargs)
+    return decorated
+
+
+class AsyncUserService:
+    """
+    Async counterpart of the user-service client and user profile cache.
+
+    Uses a pooled httpx client guarded by the same circuit breaker as the
+    sync client, caches profiles (and 404s) in-process, and coalesces
+    concurrent lookups of the same user into one request.
+    """
+
+    NOT_FOUND = object()
+
+    def __init__(self, config):
+        self.client = httpx.AsyncClient(
+            base_url=config['USER_SERVICE_URL'],
+            timeout=httpx.Timeout(config['USER_SERVICE_READ_TIMEOUT'], connect=config['USER_SERVICE_CONNECT_TIMEOUT']),
+            # The client ignores its own limits when given a transport. The
+            # transport retries failed connection attempts only
+            transport=httpx.AsyncHTTPTransport(
+                limits=httpx.Limits(max_connections=config['USER_SERVICE_POOL_SIZE']),
+                retries=config['USER_SERVICE_RETRIES']
+            )
+        )
+        self.breaker = CircuitBreaker(config['USER_SERVICE_BREAKER_THRESHOLD'],
+                                      config['USER_SERVICE_BREAKER_RESET_TIMEOUT'])
+        self.cache = None
+        if config['USER_CACHE_ENABLED']:
+            self.cache = TTLCache(config['USER_CACHE_MAX_ENTRIES'], config['USER_CACHE_TTL'])
+        self.negative_ttl = config['USER_CACHE_NEGATIVE_TTL']
+        self._in_flight = {}
+
+    async def get_profile(self, user_id):
+        """
+        Return the profile of a user, or None if it does not exist.
+
+        Raises httpx.HTTPError or CircuitOpenError if user-service cannot be reached.
+        """
+        if self.cache is not None:
+            profile = self.cache.get(user_id)
+            if profile is not None:
+                return None if profile is self.NOT_FOUND else profile
+
+        future = self._in_flight.get(user_id)
+        if future is not None:
+            return await asyncio.shield(future)
+
+        future = self._in_flight[user_id] = asyncio.get_running_loop().create_future()
+        try:
+            profile = await self._fetch(user_id)
+        except Exception as e:
+            future.set_exception(e)
+            # Mark the exception as retrieved when nobody else was waiting
+            future.exception()
+            raise
+        else:
+            future.set_result(profile)
+            if self.cache is not None:
+                if profile is None:
+                    self.cache.set(user_id, self.NOT_FOUND, ttl=self.negative_ttl)
+                else:
+                    self.cache.set(user_id, profile)
+            return profile
+        finally:
+            del self._in_flight[user_id]
+
+    async def _fetch(self, user_id):
+        if not self.breaker.allow_request():
+            raise CircuitOpenError(f"Circuit open for {self.client.base_url}")
+        try:
+            with timer('user-service', 'GET'):
+                response = await self.client.get(f"/users/id/{user_id}")
+        except httpx.HTTPError:
+            self.breaker.record_failure()
+            raise
+        if response.status_code >= 500:
+            self.breaker.record_failure()
+        else:
+            self.breaker.record_success()
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    async def close(self):
+        await self.client.aclose()
+
+
+async def publish_ride_request(app, ride_request, on_undelivered=None):
+    """
+    Publish a ride request to Kafka according to KAFKA_DELIVERY_MODE.
+
+    Same semantics as app.producer.publish_ride_request; `on_undelivered`
+    runs as a background task of the application.
+    """
+    request_id = ride_request['request_id']
+    stats = app.delivery_stats
+
+    def on_failed(exc):
+        stats.record_failed()
+        app.logger.error(f"Failed to deliver ride request {request_id} to Kafka: {exc}")
+
+    def on_done(future):
+        if future.cancelled() or future.exception() is not None:
+            on_failed(future.exception() if not future.cancelled() else 'cancelled')
+            if on_undelivered is not None:
+                app.add_background_task(on_undelivered, request_id)
+        else:
+            stats.record_delivered()
+
+    stats.record_sent()
+    try:
+        with timer('kafka', 'send'):
+            future = await app.kafka_producer.send(
+                app.config['KAFKA_TOPIC'],
+                ride_request,
+                key=pickup_region_key(ride_request, app.config['KAFKA_REGION_SIZE_DEG'])
+            )
+    except KafkaError as e:
+        on_failed(e)
+        return False
+
+    if app.config['KAFKA_DELIVERY_MODE'] == DeliveryMode.ASYNC:
+        future.add_done_callback(on_done)
+        return True
+
+    try:
+        with timer('kafka', 'acknowledge'):
+            await asyncio.wait_for(future, app.config['KAFKA_DELIVERY_TIMEOUT'])
+    except (KafkaError, asyncio.TimeoutError) as e:
+        on_failed(e)
+        return False
+    stats.record_delivered()
+    return True
+
+
+def ride_status_response(status):
+    """Same as app.routes.ride_status_response, for Quart."""
+    etag = status_etag(status)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class('', status=304)
+    else:
+        response = jsonify({'status': status})
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+
+@async_ride_bp.route('/rides/request', methods=['POST'])
+@token_required
+async def create_ride_request():
+    data = await request.get_json()
+    user_id = g.get('user_id')
+    username = data.get('username')
+    pickup_location = data.get('pickup_location')
+    dropoff_location = data.get('dropoff_location')
+    pickup_coordinates = data.get('pickup_coordinates')
+
+    current_app.logger.info(f"Ride request for user: {user_id}")
+
+    # Validate input
+    if not all([user_id, username, pickup_location, dropoff_location]):
+        current_app.logger.warning("Missing required fields during ride request")
+        return jsonify({'message': 'Missing required fields'}), 400
+
+    if g.get('username') and g.get('role'):
+        verified_username = g.username
+        verified_role = g.role
+    elif current_app.config['USER_LOOKUP_FALLBACK']:
+        try:
+            user_data = await current_app.user_service.get_profile(user_id)
+        except (httpx.HTTPError, CircuitOpenError) as e:
+            current_app.logger.error(f"Error contacting user-service: {e}")
+            return jsonify({'message': 'Failed to verify user information'}), 503
+
+        user_data = user_data or {}
+        verified_username = user_data.get('username')
+        verified_role = user_data.get('role')
+    else:
+        current_app.logger.warning("Token without user claims during ride request")
+        return jsonify({'message': 'Token is outdated, please log in again'}), 401
+
+    if not verified_username or verified_username != username:
+        current_app.logger.warning("Username mismatch during ride request")
+        return jsonify({'message': 'Username does not match user ID'}), 400
+
+    if not verified_role or verified_role != 'rider':
+        current_app.logger.warning("User is not authorized to request rides")
+        return jsonify({'message': 'User is not authorized to request rides'}), 403
+
+    # Create new ride request
+    request_id = str(uuid.uuid4())
+    ride_request = {
+        'request_id': request_id,
+        'user_id': user_id,
+        'username': username,
+        'pickup_location': pickup_location,
+        'dropoff_location': dropoff_location,
+        'status': RideStatus.PENDING.value,
+        'created_at': datetime.now(timezone.utc).isoformat()
+    }
+    if pickup_coordinates:
+        ride_request['pickup_coordinates'] = pickup_coordinates
+
+    # Save ride request to MongoDB
+    with timer('mongo', 'insert_one'):
+        await current_app.mongo_db.ride_requests.insert_one(ride_request)
+    ride_request.pop('_id', None)
+
+    # Cache the status before publishing, the ride may be accepted right away
+    if current_app.status_cache is not None:
+        current_app.status_cache.update(request_id, status=RideStatus.PENDING.value, user_id=user_id)
+
+    # Send ride request to Kafka
+    if not await publish_ride_request(current_app._get_current_object(), ride_request,
+                                      on_undelivered=cancel_ride_request):
+        await cancel_ride_request(request_id)
+        return jsonify({'message': 'Failed to submit ride request'}), 503
+
+    current_app.logger.info(f"Ride request created successfully: {request_id}")
+    return jsonify({'request_id': request_id, 'status': RideStatus.PENDING.value}), 201
+
+
+async def cancel_ride_request(request_id):
+    """Same as app.routes.cancel_ride_request, for Quart."""
+    with timer('mongo', 'update_one'):
+        result = await current_app.mongo_db.ride_requests.update_one(
+            {'request_id': request_id, 'status': RideStatus.PENDING.value},
+            {'$set': {'status': RideStatus.CANCELLED.value}}
+        )
+    if not result.modified_count:
+        return False
+    if current_app.status_cache is not None:
+        current_app.status_cache.update(request_id, status=RideStatus.CANCELLED.value)
+    await current_app.status_broadcaster.publish({request_id: RideStatus.CANCELLED.value})
+    current_app.logger.warning(f"Cancelled undelivered ride request {request_id}")
+    return True
+
+
+@async_ride_bp.route('/rides/stats', methods=['GET'])
+async def get_stats():
+    stats = {'kafka_delivery': current_app.delivery_stats.as_dict()}
+    if current_app.user_service.cache is not None:
+        stats['user_cache'] = current_app.user_service.cache.stats()
+    if current_app.status_cache is not None:
+        stats['status_cache'] = current_app.status_cache.stats()
+    stats['status_subscribers'] = current_app.status_broadcaster.connections
+    return jsonify(stats), 200
+
+
+@async_ride_bp.route('/rides/status/<request_id>', methods=['GET'])
+@token_required
+async def get_ride_status(request_id):
+    current_app.logger.info("Fetching ride status by ID: %s", request_id, extra=HOT_PATH)
+    status = await current_status(request_id)
+    if status is not None:
+        return ride_status_response(status)
+    current_app.logger.warning("Ride request not found")
+    return jsonify({'message': 'Ride request not found'}), 404
+
+
+async def current_status(request_id):
+    """Return the current status of a ride, from the cache or MongoDB, or None."""
+    ride_request = current_app.status_cache.get(request_id) if current_app.status_cache is not None else None
+    if ride_request is None:
+        with timer('mongo', 'find_one'):
+            ride_request = await current_app.mongo_db.ride_requests.find_one(
+                {'request_id': request_id}, RIDE_STATUS_PROJECTION
+            )
+        if ride_request and current_app.status_cache is not None:
+            current_app.status_cache.fill(request_id, ride_request['status'])
+    return ride_request['status'] if ride_request else None
+
+
+@async_ride_bp.route('/rides/status/<request_id>/events', methods=['GET'])
+@stream_token_required
+async def stream_ride_status(request_id):
+    """
+    Server-sent events stream of a ride's status.
+
+    Authenticated by a bearer token, in the Authorization header or, for
+    EventSource clients, in the `token` query parameter.
+
+    Sends the current status right away and then every change, until the
+    ride reaches a final status or SSE_MAX_DURATION seconds have passed.
+    Comment lines are sent every SSE_KEEPALIVE_INTERVAL seconds to keep
+    proxies from closing idle connections.
+    """
+    broadcaster = current_app.status_broadcaster
+    # Subscribe before reading the status so that no change is missed
+    queue = broadcaster.subscribe(request_id)
+    try:
+        status = await current_status(request_id)
+    except Exception:
+        broadcaster.unsubscribe(request_id, queue)
+        raise
+    if status is None:
+        broadcaster.unsubscribe(request_id, queue)
+        return jsonify({'message': 'Ride request not found'}), 404
+
+    keepalive = current_app.config['SSE_KEEPALIVE_INTERVAL']
+    max_duration = current_app.config['SSE_MAX_DURATION']
+
+    async def events():
+        last_status = status
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + max_duration
+        try:
+            yield f"event: status\ndata: {json.dumps({'status': last_status})}\n\n".encode('utf-8')
+            while last_status not in FINAL_STATUSES:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    new_status = await asyncio.wait_for(queue.get(), min(keepalive, remaining))
+                except asyncio.TimeoutError:
+                    yield b": keepalive\n\n"
+                    continue
+                if new_status != last_status:
+                    last_status = new_status
+                    yield f"event: status\ndata: {json.dumps({'status': last_status})}\n\n".encode('utf-8')
+        finally:
+            broadcaster.unsubscribe(request_id, queue)
+
+    response = await make_response(events(), {
+        'Content-Type': 'text/event-stream',
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    response.timeout = None
+    return response
+
+
+@async_ride_bp.route('/rides/status/<request_id>/wait', methods=['GET'])
+@stream_token_required
+async def wait_ride_status(request_id):
+    """
+    Long-poll for a ride's status.
+
+    Authenticated like the events stream.
+
+    Answers right away if the status differs from the client's If-None-Match
+    ETag, otherwise waits up to `timeout` seconds (at most
+    LONG_POLL_MAX_TIMEOUT) for a change and answers 304 if none happened.
+    """
+    try:
+        timeout = min(float(request.args.get('timeout', 30)), current_app.config['LONG_POLL_MAX_TIMEOUT'])
+    except ValueError:
+        return jsonify({'message': 'Invalid timeout'}), 400
+
+    broadcaster = current_app.status_broadcaster
+    queue = broadcaster.subscribe(request_id)
+    try:
+        status = await current_status(request_id)
+        if status is None:
+            return jsonify({'message': 'Ride request not found'}), 404
+
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while request.if_none_match.contains(status_etag(status)) and status not in FINAL_STATUSES:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                status = await asyncio.wait_for(queue.get(), remaining)
+            except asyncio.TimeoutError:
+                break
+        return ride_status_response(status)
+    finally:
+        broadcaster.unsubscribe(request_id, queue)
+
+
+@async_ride_bp.route('/rides/update_status', methods=['PUT'])
+@token_required
+@service_required
+async def update_ride_status():
+    data = await request.get_json()
+    request_id = data.get('request_id')
+    new_status = data.get('status')
+    # Validate input
+    if not all([request_id, new_status]):
+        return jsonify({'message': 'Missing required fields'}), 400
+    with timer('mongo', 'update_one'):
+        result = await current_app.mongo_db.ride_requests.update_one(
+            {'request_id': request_id},
+            {'$set': {'status': new_status}}
+        )
+    if result.matched_count:
+        if current_app.status_cache is not None:
+            current_app.status_cache.update(request_id, status=new_status)
+        await current_app.status_broadcaster.publish({request_id: new_status})
+        current_app.logger.info(f"Ride status updated to {new_status} for request_id: {request_id}")
+        return jsonify({'message': 'Ride status updated successfully'}), 200
+    current_app.logger.warning("Ride request not found")
+    return jsonify({'message': 'Ride request not found'}), 404
+
+
+@async_ride_bp.route('/rides/update_status/bulk', methods=['PUT'])
+@token_required
+@service_required
+async def bulk_update_ride_status():
+    data = await request.get_json()
+    updates = data.get('updates') if isinstance(data, dict) else None
+    # Validate input
+    if not isinstance(updates, list) or not updates:
+        return jsonify({'message': 'Missing required fields'}), 400
+    if len(updates) > current_app.config['RIDE_STATUS_BULK_MAX_ITEMS']:
+        return jsonify({'message': 'Too many updates in a single request'}), 413
+
+    results, operations, operation_items = prepare_bulk_updates(updates)
+    if operations:
+        collection = current_app.mongo_db.ride_requests
+        try:
+            with timer('mongo', 'bulk_write'):
+                result = await collection.bulk_write(operations, ordered=False)
+            matched_count, write_errors = result.matched_count, []
+        except BulkWriteError as e:
+            matched_count, write_errors = e.details.get('nMatched', 0), e.details.get('writeErrors', [])
+
+        if record_bulk_write_errors(results, operation_items, write_errors, matched_count):
+            cursor = collection.find(
+                {'request_id': {'$in': [results[i]['request_id'] for i in operation_items]}},
+                {'_id': 0, 'request_id': 1}
+            )
+            existing = {ride['request_id'] async for ride in cursor}
+            record_missing_rides(results, operation_items, existing)
+
+    statuses = updated_statuses(updates, results)
+    if current_app.status_cache is not None:
+        current_app.status_cache.update_many(statuses)
+    await current_app.status_broadcaster.publish(
+        {request_id: fields['status'] for request_id, fields in statuses.items()}
+    )
+
+    updated = sum(1 for item in results if item['result'] == 'updated')
+    current_app.logger.info(f"Bulk ride status update: {updated} of {len(results)} updated")
+    return jsonify({'results': results}), 200
+
+
+def create_async_app():
+    app = Quart(__name__)
+    app.config.from_object(Config)
+
+    # Initialize logging
+    setup_logging(app)
+
+    # Initialize metrics, served at /metrics
+    setup_metrics(app)
+
+    app.delivery_stats = DeliveryStats()
+    register_stats('kafka_delivery', 'Kafka delivery counters of ride requests.', app.delivery_stats.as_dict)
+
+    # Initialize the verified token cache
+    app.token_cache = None
+    if app.config['TOKEN_CACHE_ENABLED']:
+        app.token_cache = TTLCache(app.config['TOKEN_CACHE_MAX_ENTRIES'], app.config['TOKEN_CACHE_TTL'])
+        register_stats('token_cache', 'Verified token cache counters.', app.token_cache.stats)
+
+    # The shared Redis tier uses a blocking client, so this mode only
+    # caches statuses in-process
+    app.status_cache = None
+    if app.config['STATUS_CACHE_ENABLED']:
+        app.status_cache = RideStatusCache(app.config['STATUS_CACHE_MAX_ENTRIES'], app.config['STATUS_CACHE_TTL'])
+        register_stats('status_cache', 'Ride status cache counters.', app.status_cache.stats)
+
+    def on_status_update(request_id, status):
+        # Changes made by other processes also refresh this process's cache
+        if app.status_cache is not None:
+            app.status_cache.update(request_id, status=status)
+
+    app.status_broadcaster = StatusBroadcaster(
+        app.logger,
+        redis_url=app.config['REDIS_URL'],
+        channel=app.config['RIDE_STATUS_CHANNEL'],
+        on_update=on_status_update
+    )
+
+    @app.before_serving
+    async def connect():
+        # Clients bind to the running event loop, so they are created here
+        app.mongo_client = AsyncIOMotorClient(app.config['MONGO_URI'])
+        app.mongo_db = app.mongo_client.get_default_database()
+        if app.config['MONGO_CREATE_INDEXES']:
+            await ensure_indexes_async(app, app.mongo_db)
+        app.user_service = AsyncUserService(app.config)
+        app.kafka_producer = AIOKafkaProducer(
+            bootstrap_servers=app.config['KAFKA_BOOTSTRAP_SERVERS'],
+            value_serializer=lambda v: json.dumps(v).encode('utf-8'),
+            acks=app.config['KAFKA_ACKS'],
+            linger_ms=app.config['KAFKA_LINGER_MS'],
+            max_batch_size=app.config['KAFKA_BATCH_SIZE'],
+            compression_type=app.config['KAFKA_COMPRESSION_TYPE']
+        )
+        await app.kafka_producer.start()
+        await app.status_broadcaster.start()
+
+    @app.after_serving
+    async def disconnect():
+        await app.status_broadcaster.stop()
+        # Stopping the producer delivers the records it still buffers
+        await app.kafka_producer.stop()
+        await app.user_service.close()
+        app.mongo_client.close()
+
+    # Register blueprints
+    app.register_blueprint(async_ride_bp)
+
+    return app
@@ -0,0 +1,327 @@
+from collections import OrderedDict
+from concurrent.futures import Future
+import json
+from threading import Lock
+import time
+
+import redis
+
+from app.metrics import timer
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe in-process cache with a per-entry TTL and LRU eviction.
+
+    Expired entries are dropped lazily when they are read; once the cache
+    holds `maxsize` entries, the least recently used one is evicted.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Return the cached value for key, or default if it is missing or expired."""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING:
+                self.misses += 1
+                return default
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key, default=None):
+        """Like get, but without counting a hit or miss or refreshing the entry's recency."""
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is _MISSING or entry[1] <= time.monotonic():
+                return default
+            return entry[0]
+
+    def set(self, key, value, ttl=None):
+        """Cache value for key, for ttl seconds or the cache's default TTL."""
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        """
+        Cache value for key unless the key holds an unexpired entry already.
+
+        Returns:
+            bool: True if the value was cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key, _MISSING)
+            if entry is not _MISSING and entry[1] > time.monotonic():
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def _store(self, key, value, ttl):
+        # Callers hold the lock
+        self._entries[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
+
+
+class UserProfileCache:
+    """
+    Read-through cache of user profiles fetched from user-service.
+
+    Profiles are cached in-process and, when a Redis client is given, in a
+    shared Redis tier so that several worker processes share hits. Unknown
+    users are cached for `negative_ttl` seconds. Concurrent lookups of the
+    same user that miss the cache wait for a single call to the loader.
+    """
+
+    NOT_FOUND = object()
+
+    def __init__(self, maxsize, ttl, negative_ttl, redis_client=None, redis_prefix='user_profile:'):
+        self.local = TTLCache(maxsize, ttl)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.redis_client = redis_client
+        self.redis_prefix = redis_prefix
+        self._in_flight = {}
+        self._lock = Lock()
+        self.loads = 0
+        self.coalesced = 0
+        self.redis_hits = 0
+        self.redis_errors = 0
+
+    def get(self, user_id, loader):
+        """
+        Return the profile of a user.
+
+        Args:
+            user_id (str): The ID of the user.
+            loader (callable): Called with user_id on a cache miss. Must return
+                the profile as a dict, or None if the user does not exist.
+                Exceptions are propagated to every waiting caller and not cached.
+
+        Returns:
+            dict or None: The user profile, or None if the user does not exist.
+        """
+        value = self.local.get(user_id, _MISSING)
+        if value is not _MISSING:
+            return None if value is self.NOT_FOUND else value
+
+        with self._lock:
+            future = self._in_flight.get(user_id)
+            owner = future is None
+            if owner:
+                future = self._in_flight[user_id] = Future()
+            else:
+                self.coalesced += 1
+
+        if not owner:
+            return future.result()
+
+        try:
+            profile = self._load(user_id, loader)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(profile)
+            return profile
+        finally:
+            with self._lock:
+                del self._in_flight[user_id]
+
+    def _load(self, user_id, loader):
+        value = self._get_shared(user_id)
+        if value is _MISSING:
+            with self._lock:
+                self.loads += 1
+            profile = loader(user_id)
+            self._set_shared(user_id, profile)
+        else:
+            profile = value
+
+        if profile is None:
+            self.local.set(user_id, self.NOT_FOUND, ttl=self.negative_ttl)
+        else:
+            self.local.set(user_id, profile)
+        return profile
+
+    def _get_shared(self, user_id):
+        if self.redis_client is None:
+            return _MISSING
+        try:
+            with timer('redis', 'user_cache_get'):
+                raw = self.redis_client.get(self.redis_prefix + user_id)
+        except redis.RedisError:
+            self.redis_errors += 1
+            return _MISSING
+        if raw is None:
+            return _MISSING
+        self.redis_hits += 1
+        return json.loads(raw)
+
+    def _set_shared(self, user_id, profile):
+        if self.redis_client is None:
+            return
+        ttl = self.negative_ttl if profile is None else self.ttl
+        try:
+            self.redis_client.set(self.redis_prefix + user_id, json.dumps(profile), ex=max(int(ttl), 1))
+        except redis.RedisError:
+            self.redis_errors += 1
+
+    def invalidate(self, user_id):
+        """Drop a user from both cache tiers."""
+        self.local.delete(user_id)
+        if self.redis_client is not None:
+            try:
+                self.redis_client.delete(self.redis_prefix + user_id)
+            except redis.RedisError:
+                self.redis_errors += 1
+
+    def stats(self):
+        stats = self.local.stats()
+        stats.update({
+            'loads': self.loads,
+            'coalesced': self.coalesced,
+            'redis_hits': self.redis_hits,
+            'redis_errors': self.redis_errors
+        })
+        return stats
+
+
+class RideStatusCache:
+    """
+    Write-through cache of ride statuses, keyed by request ID.
+
+    Entries are dicts of ride fields (at least 'status') kept in-process and,
+    when a Redis client is given, in a Redis hash per ride shared by all
+    worker processes. Writers update the cache whenever they change a ride;
+    the TTLs are a safety net for writes that bypass this process.
+    """
+
+    def __init__(self, maxsize, ttl, redis_client=None, shared_ttl=300, redis_prefix='ride_status:'):
+        self.local = TTLCache(maxsize, ttl)
+        self.redis_client = redis_client
+        self.shared_ttl = shared_ttl
+        self.redis_prefix = redis_prefix
+        self.redis_hits = 0
+        self.redis_errors = 0
+
+    def get(self, request_id):
+        """Return the cached fields of a ride, or None on a miss."""
+        entry = self.local.get(request_id)
+        if entry is not None or self.redis_client is None:
+            return entry
+        try:
+            with timer('redis', 'status_cache_get'):
+                raw = self.redis_client.hgetall(self.redis_prefix + request_id)
+        except redis.RedisError:
+            self.redis_errors += 1
+            return None
+        if not raw:
+            return None
+        entry = {key.decode('utf-8'): value.decode('utf-8') for key, value in raw.items()}
+        self.redis_hits += 1
+        self.local.set(request_id, entry)
+        return entry
+
+    def fill(self, request_id, status):
+        """
+        Cache the status of a ride read from MongoDB after a miss.
+
+        Unlike update, a fill never overwrites an entry: a writer may have
+        cached a newer status since the ride was read, in this process or in
+        the shared hash, and that status must win.
+
+        Args:
+            request_id (str): The ID of the ride request.
+            status (str): The status read from MongoDB.
+        """
+        if self.redis_client is not None:
+            try:
+                pipe = self.redis_client.pipeline()
+                pipe.hsetnx(self.redis_prefix + request_id, 'status', status)
+                pipe.expire(self.redis_prefix + request_id, self.shared_ttl)
+                pipe.hget(self.redis_prefix + request_id, 'status')
+                # Another process may have cached a newer status first
+                status = pipe.execute()[2].decode('utf-8')
+            except redis.RedisError:
+                self.redis_errors += 1
+        self.local.add(request_id, {'status': status})
+
+    def update(self, request_id, **fields):
+        """Merge fields into the cached entry of a ride."""
+        self.update_many({request_id: fields})
+
+    def update_many(self, updates):
+        """
+        Merge fields into the cached entries of several rides.
+
+        Args:
+            updates (dict): Fields to set, keyed by request ID.
+        """
+        for request_id, fields in updates.items():
+            entry = dict(self.local.peek(request_id) or {})
+            entry.update(fields)
+            self.local.set(request_id, entry)
+
+        if self.redis_client is None or not updates:
+            return
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            for request_id, fields in updates.items():
+                pipe.hset(self.redis_prefix + request_id, mapping=fields)
+                pipe.expire(self.redis_prefix + request_id, self.shared_ttl)
+            pipe.execute()
+        except redis.RedisError:
+            self.redis_errors += 1
+            # A stale shared entry would outlive this write, drop it instead
+            self.invalidate_many(updates)
+
+    def invalidate_many(self, request_ids):
+        for request_id in request_ids:
+            self.local.delete(request_id)
+        if self.redis_client is not None:
+            try:
+                self.redis_client.delete(*[self.redis_prefix + request_id for request_id in request_ids])
+            except redis.RedisError:
+                self.redis_errors += 1
+
+    def stats(self):
+        stats = self.local.stats()
+        stats.update({'redis_hits': self.redis_hits, 'redis_errors': self.redis_errors})
+        return stats
@@ -5,4 +5,92 @@ class Config:
     MONGO_URI = os.getenv('MONGO_URI')
     USER_SERVICE_URL = os.getenv('USER_SERVICE_URL', 'http://user-service:5000')
     KAFKA_BOOTSTRAP_SERVERS = os.getenv('KAFKA_BOOTSTRAP_SERVERS', 'localhost:9092')
-    KAFKA_TOPIC = os.getenv('KAFKA_TOPIC', 'ride_requests')
\ No newline at end of file
+    KAFKA_TOPIC = os.getenv('KAFKA_TOPIC', 'ride_requests')
+
+    RIDE_STATUS_BULK_MAX_ITEMS = int(os.getenv('RIDE_STATUS_BULK_MAX_ITEMS', 1000))
+
+    # Kafka producer
+    # 'sync' waits for the broker to acknowledge each ride request,
+    # 'async' returns once it is queued and reports failures from callbacks
+    KAFKA_DELIVERY_MODE = os.getenv('KAFKA_DELIVERY_MODE', 'sync')
+    KAFKA_DELIVERY_TIMEOUT = float(os.getenv('KAFKA_DELIVERY_TIMEOUT', 10))
+    KAFKA_ACKS = os.getenv('KAFKA_ACKS', '1')
+    KAFKA_ACKS = KAFKA_ACKS if KAFKA_ACKS == 'all' else int(KAFKA_ACKS)
+    KAFKA_LINGER_MS = int(os.getenv('KAFKA_LINGER_MS', 5))
+    KAFKA_BATCH_SIZE = int(os.getenv('KAFKA_BATCH_SIZE', 16384))
+    KAFKA_COMPRESSION_TYPE = os.getenv('KAFKA_COMPRESSION_TYPE') or None
+    KAFKA_CLOSE_TIMEOUT = float(os.getenv('KAFKA_CLOSE_TIMEOUT', 10))
+    # Ride requests are partitioned by pickup region, a grid cell of this size in degrees
+    KAFKA_REGION_SIZE_DEG = float(os.getenv('KAFKA_REGION_SIZE_DEG', 0.1))
+
+    # Look users up in user-service when their token has no username/role
+    # claims, for tokens issued before the claims were added
+    USER_LOOKUP_FALLBACK = os.getenv('USER_LOOKUP_FALLBACK', 'false').lower() == 'true'
+
+    # Cache of verified tokens, keyed by their digest; entries expire with
+    # the token or after TOKEN_CACHE_TTL seconds, whichever is sooner
+    TOKEN_CACHE_ENABLED = os.getenv('TOKEN_CACHE_ENABLED', 'true').lower() == 'true'
+    TOKEN_CACHE_TTL = float(os.getenv('TOKEN_CACHE_TTL', 300))
+    TOKEN_CACHE_MAX_ENTRIES = int(os.getenv('TOKEN_CACHE_MAX_ENTRIES', 10000))
+
+    # Optional Redis shared by all worker processes, e.g. redis://redis:6379/0
+    REDIS_URL = os.getenv('REDIS_URL')
+
+    # User profile cache for the user-service lookup
+    USER_CACHE_ENABLED = os.getenv('USER_CACHE_ENABLED', 'true').lower() == 'true'
+    USER_CACHE_TTL = float(os.getenv('USER_CACHE_TTL', 60))
+    USER_CACHE_NEGATIVE_TTL = float(os.getenv('USER_CACHE_NEGATIVE_TTL', 10))
+    USER_CACHE_MAX_ENTRIES = int(os.getenv('USER_CACHE_MAX_ENTRIES', 10000))
+    # Also cache profiles in Redis, when REDIS_URL is set
+    USER_CACHE_SHARED = os.getenv('USER_CACHE_SHARED', 'true').lower() == 'true'
+
+    # Connection pool, timeouts (seconds), retries and circuit breaker for user-service
+    USER_SERVICE_POOL_SIZE = int(os.getenv('USER_SERVICE_POOL_SIZE', 10))
+    USER_SERVICE_CONNECT_TIMEOUT = float(os.getenv('USER_SERVICE_CONNECT_TIMEOUT', 1))
+    USER_SERVICE_READ_TIMEOUT = float(os.getenv('USER_SERVICE_READ_TIMEOUT', 2))
+    USER_SERVICE_RETRIES = int(os.getenv('USER_SERVICE_RETRIES', 2))
+    USER_SERVICE_BACKOFF = float(os.getenv('USER_SERVICE_BACKOFF', 0.1))
+    USER_SERVICE_BREAKER_THRESHOLD = int(os.getenv('USER_SERVICE_BREAKER_THRESHOLD', 5))
+    USER_SERVICE_BREAKER_RESET_TIMEOUT = float(os.getenv('USER_SERVICE_BREAKER_RESET_TIMEOUT', 30))
+
+    # Create the MongoDB indexes on startup, instead of with `flask init-db`
+    MONGO_CREATE_INDEXES = os.getenv('MONGO_CREATE_INDEXES', 'false').lower() == 'true'
+
+    # Ride status cache, shared through Redis when REDIS_URL is set.
+    # The in-process TTL bounds how stale a status served by one worker can
+    # be after another worker (without Redis) updated it.
+    STATUS_CACHE_ENABLED = os.getenv('STATUS_CACHE_ENABLED', 'true').lower() == 'true'
+    STATUS_CACHE_TTL = float(os.getenv('STATUS_CACHE_TTL', 2))
+    STATUS_CACHE_SHARED_TTL = int(os.getenv('STATUS_CACHE_SHARED_TTL', 300))
+    STATUS_CACHE_MAX_ENTRIES = int(os.getenv('STATUS_CACHE_MAX_ENTRIES', 100000))
+
+    # Redis channel carrying ride status changes to the push endpoints
+    # (server-sent events and long-polling) of the asyncio serving mode
+    RIDE_STATUS_CHANNEL = os.getenv('RIDE_STATUS_CHANNEL', 'ride_status_updates')
+    SSE_KEEPALIVE_INTERVAL = float(os.getenv('SSE_KEEPALIVE_INTERVAL', 15))
+    SSE_MAX_DURATION = float(os.getenv('SSE_MAX_DURATION', 600))
+    LONG_POLL_MAX_TIMEOUT = float(os.getenv('LONG_POLL_MAX_TIMEOUT', 60))
+
+    # Projection of the ride events published by driver-management-service;
+    # every process running background workers runs this many projectors
+    RIDE_EVENTS_TOPIC = os.getenv('RIDE_EVENTS_TOPIC', 'ride_events')
+    RIDE_EVENTS_GROUP_ID = os.getenv('RIDE_EVENTS_GROUP_ID', 'ride-request-projector')
+    RIDE_EVENTS_PROJECTOR_WORKERS = int(os.getenv('RIDE_EVENTS_PROJECTOR_WORKERS', 1))
+    RIDE_EVENTS_BATCH_SIZE = int(os.getenv('RIDE_EVENTS_BATCH_SIZE', 500))
+    RIDE_EVENTS_BATCH_TIMEOUT_MS = int(os.getenv('RIDE_EVENTS_BATCH_TIMEOUT_MS', 100))
+    RIDE_EVENTS_RETRY_BACKOFF_MS = int(os.getenv('RIDE_EVENTS_RETRY_BACKOFF_MS', 1000))
+
+    # Run the background workers (ride event projectors) in the web
+    # processes too; by default only `python -m app.worker` runs them
+    BACKGROUND_WORKERS = os.getenv('BACKGROUND_WORKERS', 'false').lower() == 'true'
+
+    # Logging; LOG_FORMAT is 'json' or 'text', hot-path messages are sampled
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_FILE = os.getenv('LOG_FILE', 'logs/app.log')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 10))
+    LOG_HOT_PATH_SAMPLE_RATE = float(os.getenv('LOG_HOT_PATH_SAMPLE_RATE', 1.0))
+
+    # Prometheus metrics, served at /metrics
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
@@ -0,0 +1,43 @@
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import PyMongoError
+
+# Indexes of the ride_requests collection
+RIDE_REQUEST_INDEXES = [
+    # Status lookups and updates by request ID
+    IndexModel([('request_id', ASCENDING)], unique=True, name='request_id_unique'),
+    # A user's ride history, newest first
+    IndexModel([('user_id', ASCENDING), ('created_at', DESCENDING)], name='user_id_created_at'),
+    # Rides in a given status, e.g. all PENDING rides
+    IndexModel([('status', ASCENDING)], name='status')
+]
+
+# Fields returned by the status endpoint
+RIDE_STATUS_PROJECTION = {'_id': 0, 'status': 1}
+
+
+def ensure_indexes(app, db):
+    """
+    Create the indexes of the ride-request-service collections.
+
+    Creating an index that already exists is a no-op, so this is safe to run
+    on every startup. Failures (e.g. duplicate request IDs preventing the
+    unique index) are logged rather than stopping the service.
+
+    Args:
+        app: The Flask application instance, used for logging.
+        db: The pymongo database.
+    """
+    try:
+        names = db.ride_requests.create_indexes(RIDE_REQUEST_INDEXES)
+        app.logger.info(f"Ensured ride_requests indexes: {', '.join(names)}")
+    except PyMongoError as e:
+        app.logger.error(f"Failed to create ride_requests indexes: {e}")
+
+
+async def ensure_indexes_async(app, db):
+    """Same as `ensure_indexes`, for a motor database."""
+    try:
+        names = await db.ride_requests.create_indexes(RIDE_REQUEST_INDEXES)
+        app.logger.info(f"Ensured ride_requests indexes: {', '.join(names)}")
+    except PyMongoError as e:
+        app.logger.error(f"Failed to create ride_requests indexes: {e}")
@@ -0,0 +1,36 @@
+from threading import Lock
+
+
+class LazyClient:
+    """
+    Creates a client on first use instead of when the application starts.
+
+    Attribute access is forwarded to the client, which `factory` creates the
+    first time it is needed, so that workers boot without waiting for (or
+    failing on) an unavailable broker. `close` only closes a client that was
+    created.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._client = None
+        self._lock = Lock()
+
+    @property
+    def created(self):
+        return self._client is not None
+
+    def get(self):
+        """Return the client, creating it if needed."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._factory()
+        return self._client
+
+    def __getattr__(self, name):
+        return getattr(self.get(), name)
+
+    def close(self, *args, **kwargs):
+        if self._client is not None:
+            self._client.close(*args, **kwargs)
@@ -0,0 +1,178 @@
+from functools import wraps
+import inspect
+import time
+
+from prometheus_client import CONTENT_TYPE_LATEST, CollectorRegistry, Gauge, Histogram, generate_latest
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.process_collector import ProcessCollector
+
+# Each copy of this module has its own registry, so that several services can
+# be loaded in one process (see benchmarks/e2e_load.py)
+REGISTRY = CollectorRegistry()
+ProcessCollector(registry=REGISTRY)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Latency of the HTTP requests served, per route.',
+    ['method', 'route', 'status'], registry=REGISTRY
+)
+DOWNSTREAM_LATENCY = Histogram(
+    'downstream_call_duration_seconds', 'Latency of the calls to databases, caches, brokers and services.',
+    ['target', 'operation', 'outcome'], registry=REGISTRY
+)
+CONSUMER_LAG = Gauge(
+    'kafka_consumer_lag', 'Messages not yet consumed, per topic partition.',
+    ['topic', 'partition'], registry=REGISTRY
+)
+CONSUMER_BATCH_SIZE = Gauge(
+    'kafka_consumer_batch_size', 'Number of messages in the last consumed batch, per worker.',
+    ['worker'], registry=REGISTRY
+)
+
+
+class timer:
+    """
+    Time a downstream call into DOWNSTREAM_LATENCY, as a context manager or a
+    decorator of plain or async functions.
+
+        with timer('mongo', 'insert_one'):
+            ...
+
+        @timer('redis', 'find_available_drivers')
+        def find_available_drivers(...):
+            ...
+
+    The histogram children of every target and operation are resolved once
+    and cached, so an observation costs a dict lookup, two clock reads and a
+    histogram update.
+    """
+
+    __slots__ = ('_ok', '_error', '_start')
+
+    _children = {}
+
+    def __init__(self, target, operation):
+        children = timer._children.get((target, operation))
+        if children is None:
+            children = timer._children[(target, operation)] = (
+                DOWNSTREAM_LATENCY.labels(target, operation, 'ok'),
+                DOWNSTREAM_LATENCY.labels(target, operation, 'error')
+            )
+        self._ok, self._error = children
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        (self._ok if exc_type is None else self._error).observe(time.perf_counter() - self._start)
+        return False
+
+    def __call__(self, fn):
+        ok, error = self._ok, self._error
+
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def timed_async(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    result = await fn(*args, **kwargs)
+                except BaseException:
+                    error.observe(time.perf_counter() - start)
+                    raise
+                ok.observe(time.perf_counter() - start)
+                return result
+            return timed_async
+
+        @wraps(fn)
+        def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                result = fn(*args, **kwargs)
+            except BaseException:
+                error.observe(time.perf_counter() - start)
+                raise
+            ok.observe(time.perf_counter() - start)
+            return result
+        return timed
+
+
+class StatsCollector:
+    """
+    Expose the counters of stats objects (e.g. DeliveryStats or a cache) as
+    gauges, read when metrics are scraped.
+    """
+
+    def __init__(self):
+        self.stats = {}
+
+    def collect(self):
+        for name, (documentation, stats) in list(self.stats.items()):
+            metric = GaugeMetricFamily(name, documentation, labels=['stat'])
+            for stat, value in stats().items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    metric.add_metric([stat], value)
+            yield metric
+
+
+# Registered once per process, create_app only adds stats to it
+STATS = StatsCollector()
+REGISTRY.register(STATS)
+
+
+def register_stats(name, documentation, stats):
+    """
+    Expose a function returning a dict of numbers as the `name{stat=...}` gauges.
+
+    Registering a name again replaces its function, so an application created
+    again neither duplicates the series nor keeps the previous one alive.
+    """
+    STATS.stats[name] = (documentation, stats)
+
+
+def setup_metrics(app):
+    """
+    Time every request of the application per route and serve the metrics of
+    this process at /metrics.
+    """
+    if not app.config.get('METRICS_ENABLED', True):
+        return
+
+    def observe(request, g, response):
+        start = g.pop('metrics_start', None)
+        if start is None:
+            return response
+        route = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+        REQUEST_LATENCY.labels(request.method, route, response.status_code).observe(time.perf_counter() - start)
+        return response
+
+    def metrics_response():
+        return generate_latest(REGISTRY), 200, {'Content-Type': CONTENT_TYPE_LATEST}
+
+    if hasattr(app, 'before_serving'):
+        # Quart, see setup_logging for why the hooks are async
+        from quart import g as async_g, request as async_request
+
+        @app.before_request
+        async def start_timer_async():
+            async_g.metrics_start = time.perf_counter()
+
+        @app.after_request
+        async def observe_request_async(response):
+            return observe(async_request, async_g, response)
+
+        @app.route('/metrics')
+        async def metrics():
+            return metrics_response()
+        return
+
+    from flask import g, request
+
+    @app.before_request
+    def start_timer():
+        g.metrics_start = time.perf_counter()
+
+    @app.after_request
+    def observe_request(response):
+        return observe(request, g, response)
+
+    app.add_url_rule('/metrics', 'metrics', metrics_response)
@@ -0,0 +1,152 @@
+import math
+from threading import Lock
+
+from kafka.errors import KafkaError
+
+from app.metrics import timer
+
+
+class DeliveryMode:
+    SYNC = 'sync'
+    ASYNC = 'async'
+
+
+class DeliveryStats:
+    """
+    Thread-safe counters of Kafka deliveries.
+
+    Delivery callbacks run on the producer's I/O thread, so every update
+    goes through a lock.
+    """
+
+    def __init__(self):
+        self._lock = Lock()
+        self.sent = 0
+        self.delivered = 0
+        self.failed = 0
+
+    def record_sent(self):
+        with self._lock:
+            self.sent += 1
+
+    def record_delivered(self):
+        with self._lock:
+            self.delivered += 1
+
+    def record_failed(self):
+        with self._lock:
+            self.failed += 1
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'sent': self.sent,
+                'delivered': self.delivered,
+                'failed': self.failed,
+                'in_flight': self.sent - self.delivered - self.failed
+            }
+
+
+def pickup_region_key(ride_request, region_size_deg):
+    """
+    Partition key grouping ride requests by pickup region.
+
+    The pickup coordinates are snapped to a grid of `region_size_deg` degrees,
+    so that requests from the same region land on the same partition and are
+    assigned by the same consumer worker.
+
+    Args:
+        ride_request (dict): The ride request.
+        region_size_deg (float): The size of a region in degrees.
+
+    Returns:
+        bytes or None: The key of the region, or None if the ride request has
+        no usable pickup coordinates (the producer then spreads it over all
+        partitions).
+    """
+    coordinates = ride_request.get('pickup_coordinates')
+    try:
+        if isinstance(coordinates, dict):
+            lat = coordinates.get('lat', coordinates.get('latitude'))
+            lon = coordinates.get('lon', coordinates.get('lng', coordinates.get('longitude')))
+        elif isinstance(coordinates, str):
+            lat, lon = coordinates.split(',')
+        else:
+            lat, lon = coordinates
+        lat, lon = float(lat), float(lon)
+    except (TypeError, ValueError):
+        return None
+    if not (math.isfinite(lat) and math.isfinite(lon)):
+        return None
+    return f"{math.floor(lat / region_size_deg)}:{math.floor(lon / region_size_deg)}".encode('utf-8')
+
+
+def publish_ride_request(app, ride_request, on_undelivered=None):
+    """
+    Publish a ride request to Kafka according to KAFKA_DELIVERY_MODE.
+
+    In 'sync' mode the call waits until this record is acknowledged by the
+    broker (without flushing other in-flight records). In 'async' mode it
+    returns as soon as the record is queued; the outcome is recorded by
+    delivery callbacks, and failures are logged and handed to `on_undelivered`.
+
+    Args:
+        app: The Flask application instance containing the producer, logger, delivery stats
+            and the delivery failures executor.
+        ride_request (dict): The ride request to publish.
+        on_undelivered (callable, optional): Called with the request ID, in an
+            application context on the delivery failures executor, when an
+            'async' delivery fails.
+
+    Returns:
+        bool: False if the delivery failed in 'sync' mode, True otherwise.
+    """
+    request_id = ride_request['request_id']
+    logger = app.logger
+    stats = app.delivery_stats
+
+    def on_delivered(_metadata):
+        stats.record_delivered()
+
+    def on_failed(exc):
+        stats.record_failed()
+        logger.error(f"Failed to deliver ride request {request_id} to Kafka: {exc}")
+
+    def handle_undelivered():
+        with app.app_context():
+            try:
+                on_undelivered(request_id)
+            except Exception as e:
+                logger.exception(f"Failed to handle undelivered ride request {request_id}: {e}")
+
+    def on_async_failed(exc):
+        on_failed(exc)
+        if on_undelivered is not None:
+            # Errbacks run on the producer's I/O thread, which must not wait on MongoDB
+            app.delivery_failures.submit(handle_undelivered)
+
+    stats.record_sent()
+    try:
+        with timer('kafka', 'send'):
+            future = app.kafka_producer.send(
+                app.config['KAFKA_TOPIC'],
+                ride_request,
+                key=pickup_region_key(ride_request, app.config['KAFKA_REGION_SIZE_DEG'])
+            )
+    except KafkaError as e:
+        on_failed(e)
+        return False
+
+    if app.config['KAFKA_DELIVERY_MODE'] == DeliveryMode.ASYNC:
+        future.add_callback(on_delivered)
+        future.add_errback(on_async_failed)
+        return True
+
+    try:
+        with timer('kafka', 'acknowledge'):
+            future.get(timeout=app.config['KAFKA_DELIVERY_TIMEOUT'])
+    except KafkaError as e:
+        on_failed(e)
+        return False
+    on_delivered(None)
+    return True
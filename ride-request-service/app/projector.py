@@ -0,0 +1,196 @@
+import json
+import time
+
+from kafka import KafkaConsumer
+from kafka.errors import KafkaError
+from pymongo import UpdateOne
+
+from app.metrics import CONSUMER_BATCH_SIZE, CONSUMER_LAG, timer
+from app.routes import RideStatus
+from app.status_events import publish_status_updates
+
+# Ride fields an event may set, besides its status and version
+RIDE_EVENT_FIELDS = ('driver_id', 'assigned_at')
+
+VALID_STATUSES = frozenset(status.value for status in RideStatus)
+
+
+def deserialize_ride_event(value):
+    """Decode a ride event, or return None if it is not valid JSON so that it is skipped."""
+    try:
+        return json.loads(value.decode('utf-8'))
+    except ValueError:
+        return None
+
+
+def is_valid_ride_event(event):
+    return (
+        isinstance(event, dict)
+        and isinstance(event.get('request_id'), str) and bool(event['request_id'])
+        and event.get('status') in VALID_STATUSES
+        and isinstance(event.get('version'), int)
+    )
+
+
+def latest_ride_events(events):
+    """
+    Keep the valid event with the highest version of every ride; invalid
+    events are dropped.
+
+    Returns:
+        dict: The events keyed by request ID.
+    """
+    latest = {}
+    for event in events:
+        if not is_valid_ride_event(event):
+            continue
+        request_id = event['request_id']
+        if request_id not in latest or latest[request_id]['version'] < event['version']:
+            latest[request_id] = event
+    return latest
+
+
+def apply_ride_events(collection, events):
+    """
+    Apply ride events to the ride_requests collection with one unordered bulk write.
+
+    Every event updates its ride only while the stored version is older than
+    the event's, so replayed and out-of-order events are no-ops. Rides are
+    always created by POST /rides/request first, so events are never
+    upserted: an event for an unknown ride matches nothing.
+
+    Args:
+        collection: The pymongo ride_requests collection.
+        events (list): The ride events, as published by driver-management-service.
+
+    Returns:
+        dict: The new status of every ride the events changed, keyed by request ID.
+
+    Raises:
+        PyMongoError: If some event could not be applied, so that the batch is retried.
+    """
+    latest = latest_ride_events(events)
+    if not latest:
+        return {}
+
+    operations = []
+    for request_id, event in latest.items():
+        fields = {'status': event['status'], 'version': event['version']}
+        for field in RIDE_EVENT_FIELDS:
+            if event.get(field):
+                fields[field] = event[field]
+        operations.append(UpdateOne(
+            {'request_id': request_id,
+             '$or': [{'version': {'$exists': False}}, {'version': {'$lt': event['version']}}]},
+            {'$set': fields}
+        ))
+
+    with timer('mongo', 'apply_ride_events'):
+        result = collection.bulk_write(operations, ordered=False)
+
+    if result.matched_count < len(operations):
+        # Some events were stale or for unknown rides; only report the rides
+        # now at the event's version
+        current = collection.find(
+            {'request_id': {'$in': list(latest)}},
+            {'_id': 0, 'request_id': 1, 'version': 1}
+        )
+        latest = {ride['request_id']: latest[ride['request_id']] for ride in current
+                  if ride.get('version') == latest[ride['request_id']]['version']}
+    return {request_id: event['status'] for request_id, event in latest.items()}
+
+
+def create_projector_consumer(app, worker_id):
+    """
+    Create the Kafka consumer of a ride event projector worker.
+
+    Args:
+        app: The Flask application instance containing the configuration.
+        worker_id (int): The index of the worker.
+
+    Returns:
+        KafkaConsumer: The subscribed consumer.
+    """
+    consumer = KafkaConsumer(
+        bootstrap_servers=app.config['KAFKA_BOOTSTRAP_SERVERS'],
+        group_id=app.config['RIDE_EVENTS_GROUP_ID'],
+        client_id=f"{app.config['RIDE_EVENTS_GROUP_ID']}-{worker_id}",
+        value_deserializer=deserialize_ride_event,
+        enable_auto_commit=False,
+        auto_offset_reset='earliest'
+    )
+    consumer.subscribe([app.config['RIDE_EVENTS_TOPIC']])
+    return consumer
+
+
+def run_ride_event_projector(app, worker_id=0):
+    """
+    Projects the ride events published by driver-management-service onto the
+    ride_requests collection.
+
+    Events are applied in batches of up to RIDE_EVENTS_BATCH_SIZE messages or
+    RIDE_EVENTS_BATCH_TIMEOUT_MS milliseconds. Offsets are committed once a
+    batch is applied; if applying it fails, the consumer seeks back to the
+    batch and retries it after a short backoff, which the version checks make
+    safe. Malformed events are logged and skipped, and no error stops the
+    projector.
+    Applied statuses are written to the status cache and published to the
+    status channel, like the status update endpoints do.
+
+    Args:
+        app: The Flask application instance containing the logger, MongoDB client and caches.
+        worker_id (int): The index of this projector worker.
+    """
+    consumer = create_projector_consumer(app, worker_id)
+    backoff = app.config['RIDE_EVENTS_RETRY_BACKOFF_MS'] / 1000
+    with app.app_context():
+        while True:
+            try:
+                records = consumer.poll(
+                    timeout_ms=app.config['RIDE_EVENTS_BATCH_TIMEOUT_MS'],
+                    max_records=app.config['RIDE_EVENTS_BATCH_SIZE']
+                )
+            except KafkaError as e:
+                app.logger.error(f"Failed to poll ride events: {e}")
+                time.sleep(backoff)
+                continue
+            if not records:
+                continue
+
+            CONSUMER_BATCH_SIZE.labels(f"projector-{worker_id}").set(
+                sum(len(messages) for messages in records.values())
+            )
+            for partition, messages in records.items():
+                highwater = consumer.highwater(partition)
+                if highwater is not None:
+                    CONSUMER_LAG.labels(partition.topic, partition.partition).set(highwater - messages[-1].offset - 1)
+
+            events = [message.value for messages in records.values() for message in messages]
+            invalid = sum(1 for event in events if not is_valid_ride_event(event))
+            if invalid:
+                # Retrying cannot fix a malformed event, so it is logged and skipped
+                app.logger.error(f"Skipping {invalid} malformed ride events")
+
+            try:
+                statuses = apply_ride_events(app.mongo.db.ride_requests, events)
+                if app.status_cache is not None:
+                    app.status_cache.update_many(
+                        {request_id: {'status': status} for request_id, status in statuses.items()}
+                    )
+                if not publish_status_updates(app.redis_client, app.config['RIDE_STATUS_CHANNEL'], statuses):
+                    app.logger.error(f"Failed to publish {len(statuses)} ride status changes")
+            except Exception as e:
+                # Keep the projector alive: rewind and retry the batch, which
+                # the version checks make safe
+                app.logger.exception(f"Failed to apply {len(events)} ride events: {e}")
+                for partition, messages in records.items():
+                    consumer.seek(partition, messages[0].offset)
+                time.sleep(backoff)
+                continue
+
+            try:
+                consumer.commit()
+            except KafkaError as e:
+                # The batch is applied again after a rebalance, which is a no-op
+                app.logger.error(f"Failed to commit ride events: {e}")
+            app.logger.info(f"Applied {len(statuses)} of {len(events)} ride events")
@@ -1,9 +1,17 @@
 from flask import Blueprint, request, jsonify, current_app, g
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+import hashlib
 import uuid
 from datetime import datetime, timezone
 from enum import Enum
 import requests
-from app.utils import token_required
+from app.db import RIDE_STATUS_PROJECTION
+from app.logger import HOT_PATH
+from app.metrics import timer
+from app.producer import publish_ride_request
+from app.status_events import publish_status_updates
+from app.utils import service_required, token_required
 
 ride_bp = Blueprint('ride_bp', __name__)
 
@@ -14,6 +22,72 @@ class RideStatus(Enum):
     COMPLETED = 'COMPLETED'
     CANCELLED = 'CANCELLED'
 
+def status_etag(status):
+    """Return the ETag of a ride status response."""
+    return hashlib.sha1(status.encode('utf-8')).hexdigest()[:16]
+
+def ride_status_response(status):
+    """
+    Build the response of the status endpoint, or an empty 304 response if
+    the client's If-None-Match already matches the status.
+    """
+    etag = status_etag(status)
+    if request.if_none_match.contains(etag):
+        response = current_app.response_class(status=304)
+    else:
+        current_app.logger.info("Ride status: %s", status, extra=HOT_PATH)
+        response = jsonify({'status': status})
+    response.set_etag(etag)
+    # Clients may keep the response but must revalidate it on every poll
+    response.headers['Cache-Control'] = 'no-cache'
+    return response
+
+def publish_ride_statuses(statuses):
+    """Notify the clients waiting on these rides (see app.async_app) of their new statuses."""
+    if not publish_status_updates(current_app.redis_client, current_app.config['RIDE_STATUS_CHANNEL'], statuses):
+        current_app.logger.error(f"Failed to publish {len(statuses)} ride status changes")
+
+def cancel_ride_request(request_id):
+    """
+    Cancel a ride request that could not be delivered to Kafka, unless it
+    left PENDING meanwhile, and notify the clients waiting on it.
+
+    Returns:
+        bool: True if the ride was cancelled.
+    """
+    with timer('mongo', 'update_one'):
+        result = current_app.mongo.db.ride_requests.update_one(
+            {'request_id': request_id, 'status': RideStatus.PENDING.value},
+            {'$set': {'status': RideStatus.CANCELLED.value}}
+        )
+    if not result.modified_count:
+        return False
+    if current_app.status_cache is not None:
+        current_app.status_cache.update(request_id, status=RideStatus.CANCELLED.value)
+    publish_ride_statuses({request_id: RideStatus.CANCELLED.value})
+    current_app.logger.warning(f"Cancelled undelivered ride request {request_id}")
+    return True
+
+def get_user_profile(user_id):
+    """
+    Return the profile of a user from user-service, or None if it does not exist.
+
+    Lookups go through the application's user profile cache when it is enabled.
+    Raises requests.exceptions.RequestException if user-service cannot be reached.
+    """
+    user_service = current_app.user_service
+
+    def fetch(user_id):
+        response = user_service.get(f"/users/id/{user_id}")
+        if response.status_code == 404:
+            return None
+        response.raise_for_status()
+        return response.json()
+
+    if current_app.user_cache is None:
+        return fetch(user_id)
+    return current_app.user_cache.get(user_id, fetch)
+
 @ride_bp.route('/rides/request', methods=['POST'])
 @token_required
 def create_ride_request():
@@ -22,6 +96,8 @@ def create_ride_request():
     username = data.get('username')
     pickup_location = data.get('pickup_location')
     dropoff_location = data.get('dropoff_location')
+    # Optional {'lat': ..., 'lon': ...} used to match the nearest driver
+    pickup_coordinates = data.get('pickup_coordinates')
 
     current_app.logger.info(f"Ride request for user: {user_id}")
 
@@ -30,24 +106,30 @@ def create_ride_request():
         current_app.logger.warning("Missing required fields during ride request")
         return jsonify({'message': 'Missing required fields'}), 400
 
-    # Retrieve username from user-service
-    user_service_url = current_app.config.get('USER_SERVICE_URL')
-    try:
-        response = requests.get(f"{user_service_url}/users/id/{user_id}", timeout=5)
-        response.raise_for_status()
-    except requests.exceptions.RequestException as e:
-        current_app.logger.error(f"Error contacting user-service: {e}")
-        return jsonify({'message': 'Failed to verify user information'}), 503
+    if g.get('username') and g.get('role'):
+        # Verify the user from the signed token claims
+        verified_username = g.username
+        verified_role = g.role
+    elif current_app.config['USER_LOOKUP_FALLBACK']:
+        # Token issued before the claims were added, ask user-service
+        try:
+            user_data = get_user_profile(user_id)
+        except requests.exceptions.RequestException as e:
+            current_app.logger.error(f"Error contacting user-service: {e}")
+            return jsonify({'message': 'Failed to verify user information'}), 503
 
-    user_data = response.json()
-    user_service_username = user_data.get('username')
-    user_service_role = user_data.get('role')
+        user_data = user_data or {}
+        verified_username = user_data.get('username')
+        verified_role = user_data.get('role')
+    else:
+        current_app.logger.warning("Token without user claims during ride request")
+        return jsonify({'message': 'Token is outdated, please log in again'}), 401
 
-    if not user_service_username or user_service_username != username:
+    if not verified_username or verified_username != username:
         current_app.logger.warning("Username mismatch during ride request")
         return jsonify({'message': 'Username does not match user ID'}), 400
 
-    if not user_service_role or user_service_role != 'rider':
+    if not verified_role or verified_role != 'rider':
         current_app.logger.warning("User is not authorized to request rides")
         return jsonify({'message': 'User is not authorized to request rides'}), 403
 
@@ -62,39 +144,59 @@ def create_ride_request():
         'status': RideStatus.PENDING.value,
         'created_at': datetime.now(timezone.utc).isoformat()
     }
+    if pickup_coordinates:
+        ride_request['pickup_coordinates'] = pickup_coordinates
 
     # Save ride request to MongoDB
-    current_app.mongo.db.ride_requests.insert_one(ride_request)
+    with timer('mongo', 'insert_one'):
+        current_app.mongo.db.ride_requests.insert_one(ride_request)
 
     # Remove '_id' field added by MongoDB
     ride_request.pop('_id', None)
 
+    # Cache the status before publishing, the ride may be accepted right away
+    if current_app.status_cache is not None:
+        current_app.status_cache.update(request_id, status=RideStatus.PENDING.value, user_id=user_id)
+
     # Send ride request to Kafka
-    current_app.kafka_producer.send(current_app.config['KAFKA_TOPIC'], ride_request)
-    current_app.kafka_producer.flush()
+    if not publish_ride_request(current_app._get_current_object(), ride_request,
+                                on_undelivered=cancel_ride_request):
+        cancel_ride_request(request_id)
+        return jsonify({'message': 'Failed to submit ride request'}), 503
 
     current_app.logger.info(f"Ride request created successfully: {request_id}")
     return jsonify({'request_id': request_id, 'status': RideStatus.PENDING.value}), 201
 
+@ride_bp.route('/rides/stats', methods=['GET'])
+def get_stats():
+    stats = {'kafka_delivery': current_app.delivery_stats.as_dict()}
+    if current_app.user_cache is not None:
+        stats['user_cache'] = current_app.user_cache.stats()
+    if current_app.status_cache is not None:
+        stats['status_cache'] = current_app.status_cache.stats()
+    return jsonify(stats), 200
+
 @ride_bp.route('/rides/status/<request_id>', methods=['GET'])
-# @token_required
+@token_required
 def get_ride_status(request_id):
-    # user_id = g.get('user_id')
-    current_app.logger.info(f"Fetching ride status by ID: {request_id}")
-    # current_app.logger.info(f"Fetching ride status by ID: {request_id} by user: {user_id}")
-    ride_request = current_app.mongo.db.ride_requests.find_one({'request_id': request_id})
-    # ride_request = current_app.mongo.db.ride_requests.find_one({'request_id': request_id, 'user_id': user_id})
+    current_app.logger.info("Fetching ride status by ID: %s", request_id, extra=HOT_PATH)
+    ride_request = current_app.status_cache.get(request_id) if current_app.status_cache is not None else None
+    if ride_request is None:
+        with timer('mongo', 'find_one'):
+            ride_request = current_app.mongo.db.ride_requests.find_one(
+                {'request_id': request_id}, RIDE_STATUS_PROJECTION
+            )
+        if ride_request and current_app.status_cache is not None:
+            current_app.status_cache.fill(request_id, ride_request['status'])
     if ride_request:
-        current_app.logger.info(f"Ride status: {ride_request['status']}")
-        return jsonify({'status': ride_request['status']}), 200
+        return ride_status_response(ride_request['status'])
     else:
         current_app.logger.warning("Ride request not found")
-        # current_app.logger.warning("Ride request not found or user not authorized")
         return jsonify({'message': 'Ride request not found'}), 404
-        # return jsonify({'message': 'Ride request not found or user not authorized'}), 404
 
 @ride_bp.route('/rides/update_status', methods=['PUT'])
-# @token_required
+@token_required
+@service_required
 def update_ride_status():
     data = request.get_json()
     request_id = data.get('request_id')
@@ -103,13 +205,111 @@ def update_ride_status():
     if not all([request_id, new_status]):
         return jsonify({'message': 'Missing required fields'}), 400
     # Update ride status in MongoDB
-    result = current_app.mongo.db.ride_requests.update_one(
-        {'request_id': request_id},
-        {'$set': {'status': new_status}}
-    )
+    with timer('mongo', 'update_one'):
+        result = current_app.mongo.db.ride_requests.update_one(
+            {'request_id': request_id},
+            {'$set': {'status': new_status}}
+        )
     if result.matched_count:
+        if current_app.status_cache is not None:
+            current_app.status_cache.update(request_id, status=new_status)
+        publish_ride_statuses({request_id: new_status})
         current_app.logger.info(f"Ride status updated to {new_status} for request_id: {request_id}")
         return jsonify({'message': 'Ride status updated successfully'}), 200
     else:
         current_app.logger.warning("Ride request not found")
-        return jsonify({'message': 'Ride request not found'}), 404
\ No newline at end of file
+        return jsonify({'message': 'Ride request not found'}), 404
+
+@ride_bp.route('/rides/update_status/bulk', methods=['PUT'])
+@token_required
+@service_required
+def bulk_update_ride_status():
+    data = request.get_json()
+    updates = data.get('updates') if isinstance(data, dict) else None
+    # Validate input
+    if not isinstance(updates, list) or not updates:
+        return jsonify({'message': 'Missing required fields'}), 400
+    if len(updates) > current_app.config['RIDE_STATUS_BULK_MAX_ITEMS']:
+        return jsonify({'message': 'Too many updates in a single request'}), 413
+
+    results, operations, operation_items = prepare_bulk_updates(updates)
+
+    if operations:
+        # Unordered, so one failing update does not stop the others
+        try:
+            with timer('mongo', 'bulk_write'):
+                result = current_app.mongo.db.ride_requests.bulk_write(operations, ordered=False)
+            matched_count, write_errors = result.matched_count, []
+        except BulkWriteError as e:
+            matched_count, write_errors = e.details.get('nMatched', 0), e.details.get('writeErrors', [])
+
+        if record_bulk_write_errors(results, operation_items, write_errors, matched_count):
+            # Only look up which rides exist when some update did not match
+            existing = {
+                ride['request_id'] for ride in current_app.mongo.db.ride_requests.find(
+                    {'request_id': {'$in': [results[i]['request_id'] for i in operation_items]}},
+                    {'_id': 0, 'request_id': 1}
+                )
+            }
+            record_missing_rides(results, operation_items, existing)
+
+    statuses = updated_statuses(updates, results)
+    if current_app.status_cache is not None:
+        current_app.status_cache.update_many(statuses)
+    publish_ride_statuses({request_id: fields['status'] for request_id, fields in statuses.items()})
+
+    updated = sum(1 for item in results if item['result'] == 'updated')
+    current_app.logger.info(f"Bulk ride status update: {updated} of {len(results)} updated")
+    return jsonify({'results': results}), 200
+
+def prepare_bulk_updates(updates):
+    """
+    Validate the items of a bulk status update and build the MongoDB operations.
+
+    Returns:
+        tuple: The per-item results, initially 'updated' or 'invalid', the
+        UpdateOne operations, and the index in the results of each operation.
+    """
+    valid_statuses = {status.value for status in RideStatus}
+    results = []
+    operations = []
+    operation_items = []
+    for item in updates:
+        request_id = item.get('request_id') if isinstance(item, dict) else None
+        new_status = item.get('status') if isinstance(item, dict) else None
+        if not all([request_id, new_status]) or new_status not in valid_statuses:
+            results.append({'request_id': request_id, 'result': 'invalid'})
+            continue
+
+        fields = {'status': new_status}
+        for field in ('driver_id', 'assigned_at'):
+            if item.get(field):
+                fields[field] = item[field]
+        operations.append(UpdateOne({'request_id': request_id}, {'$set': fields}))
+        operation_items.append(len(results))
+        results.append({'request_id': request_id, 'result': 'updated'})
+    return results, operations, operation_items
+
+def record_bulk_write_errors(results, operation_items, write_errors, matched_count):
+    """
+    Mark the items whose operation failed as 'error'.
+
+    Returns:
+        bool: True if some of the other operations did not match a ride.
+    """
+    for error in write_errors:
+        results[operation_items[error['index']]]['result'] = 'error'
+    return matched_count < len(operation_items) - len(write_errors)
+
+def updated_statuses(updates, results):
+    """Return {request_id: {'status': status}} for the items of a bulk update that were applied."""
+    return {
+        item['request_id']: {'status': item['status']}
+        for item, result in zip(updates, results) if result['result'] == 'updated'
+    }
+
+def record_missing_rides(results, operation_items, existing):
+    """Mark the updated items whose request_id is not in `existing` as 'not_found'."""
+    for i in operation_items:
+        if results[i]['result'] == 'updated' and results[i]['request_id'] not in existing:
+            results[i]['result'] = 'not_found'
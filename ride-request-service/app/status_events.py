@@ -0,0 +1,130 @@
+import asyncio
+import json
+
+import redis
+import redis.asyncio as aioredis
+
+
+def publish_status_updates(redis_client, channel, statuses):
+    """
+    Publish ride status changes to the Redis status channel.
+
+    Args:
+        redis_client (Redis): An instance of a Redis client, or None to skip publishing.
+        channel (str): The name of the channel.
+        statuses (dict): New statuses keyed by request ID.
+
+    Returns:
+        bool: False if publishing failed.
+    """
+    if redis_client is None or not statuses:
+        return True
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        for request_id, status in statuses.items():
+            pipe.publish(channel, json.dumps({'request_id': request_id, 'status': status}))
+        pipe.execute()
+    except redis.RedisError:
+        return False
+    return True
+
+
+class StatusBroadcaster:
+    """
+    Fans ride status changes out to the requests waiting on them.
+
+    A single Redis subscription per process receives every status change and
+    hands it to the asyncio queues registered for that ride, so idle
+    connections cost a queue each rather than a thread or a Redis connection.
+    Without a Redis URL, only changes made by this process are delivered.
+    """
+
+    def __init__(self, logger, redis_url=None, channel='ride_status_updates', on_update=None):
+        self.logger = logger
+        self.redis_url = redis_url
+        self.channel = channel
+        self.on_update = on_update
+        self._subscribers = {}
+        self._redis = None
+        self._task = None
+
+    @property
+    def connections(self):
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    async def start(self):
+        if self.redis_url:
+            self._redis = aioredis.from_url(self.redis_url)
+            self._task = asyncio.create_task(self._listen())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+        if self._redis is not None:
+            await self._redis.close()
+
+    async def _listen(self):
+        backoff = 0.5
+        while True:
+            pubsub = self._redis.pubsub(ignore_subscribe_messages=True)
+            try:
+                await pubsub.subscribe(self.channel)
+                backoff = 0.5
+                async for message in pubsub.listen():
+                    update = json.loads(message['data'])
+                    self._dispatch(update['request_id'], update['status'])
+            except asyncio.CancelledError:
+                await pubsub.close()
+                raise
+            except (redis.RedisError, ValueError, KeyError) as e:
+                self.logger.error(f"Ride status subscription failed, reconnecting: {e}")
+                await pubsub.close()
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 30)
+
+    def _dispatch(self, request_id, status):
+        if self.on_update is not None:
+            self.on_update(request_id, status)
+        for queue in self._subscribers.get(request_id, ()):
+            queue.put_nowait(status)
+
+    async def publish(self, statuses):
+        """
+        Publish status changes made by this process.
+
+        Args:
+            statuses (dict): New statuses keyed by request ID.
+        """
+        if not statuses:
+            return
+        if self._redis is None:
+            for request_id, status in statuses.items():
+                self._dispatch(request_id, status)
+            return
+        try:
+            async with self._redis.pipeline(transaction=False) as pipe:
+                for request_id, status in statuses.items():
+                    pipe.publish(self.channel, json.dumps({'request_id': request_id, 'status': status}))
+                await pipe.execute()
+        except redis.RedisError as e:
+            self.logger.error(f"Failed to publish ride status changes: {e}")
+            # Still notify the requests waiting in this process
+            for request_id, status in statuses.items():
+                self._dispatch(request_id, status)
+
+    def subscribe(self, request_id):
+        """Return a queue receiving every new status of the ride."""
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(request_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, request_id, queue):
+        queues = self._subscribers.get(request_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[request_id]
@@ -1,16 +1,57 @@
 from flask import request, jsonify, current_app, g
 import jwt
 from functools import wraps
+import hashlib
+import time
+from app.service_client import ServiceToken
+
+def get_bearer_token(headers):
+    """Return the token of a 'Bearer' Authorization header, or None."""
+    auth_header = headers.get('Authorization')
+    if auth_header and auth_header.startswith('Bearer '):
+        return auth_header[len('Bearer '):]
+    return None
+
+def decode_token(token, secret_key, cache=None):
+    """
+    Verify a JWT and return its claims, through a cache of verified tokens.
+
+    Clients send the same token with every request for its whole lifetime,
+    so verified claims are cached under the SHA-256 digest of the token
+    until its `exp` claim, or for the cache's TTL if that is sooner. Invalid
+    tokens are never cached.
+
+    Args:
+        token (str): The encoded token.
+        secret_key (str): The HS256 signing key.
+        cache (TTLCache, optional): The verified token cache.
+
+    Returns:
+        dict: The claims of the token.
+
+    Raises:
+        jwt.InvalidTokenError: If the token is invalid or expired.
+    """
+    if cache is None:
+        return jwt.decode(token, secret_key, algorithms=['HS256'])
+
+    key = hashlib.sha256(token.encode('utf-8')).digest()
+    claims = cache.get(key)
+    if claims is not None:
+        return claims
+    claims = jwt.decode(token, secret_key, algorithms=['HS256'])
+    ttl = cache.ttl
+    if 'exp' in claims:
+        ttl = min(ttl, claims['exp'] - time.time())
+    if ttl > 0:
+        cache.set(key, claims, ttl=ttl)
+    return claims
 
 def token_required(f):
     @wraps(f)
     def decorated(*args, **kwargs):
-        token = None
-
         # Get token from the Authorization header
-        auth_header = request.headers.get('Authorization')
-        if auth_header and auth_header.startswith('Bearer '):
-            token = auth_header[len('Bearer '):]
+        token = get_bearer_token(request.headers)
 
         if not token:
             current_app.logger.warning("Token is missing")
@@ -18,9 +59,12 @@ def token_required(f):
         
         try:
             #Decode token
-            data = jwt.decode(token, current_app.config['SECRET_KEY'], algorithms=['HS256'])
-            # Add user_id to kwargs
+            data = decode_token(token, current_app.config['SECRET_KEY'], current_app.token_cache)
+            # Add the user claims to the request context
             g.user_id = data['user_id']
+            # Tokens issued before username and role were added lack these claims
+            g.username = data.get('username')
+            g.role = data.get('role')
         except jwt.ExpiredSignatureError:
             return jsonify({'message': 'Token is expired'}), 401
         except jwt.InvalidTokenError:
@@ -28,3 +72,13 @@ def token_required(f):
         
         return f(*args, **kwargs)
     return decorated
+
+def service_required(f):
+    """Only let other services of the application through; apply below @token_required."""
+    @wraps(f)
+    def decorated(*args, **kwargs):
+        if g.get('role') != ServiceToken.ROLE:
+            current_app.logger.warning(f"Service role required, user {g.get('user_id')} has role {g.get('role')}")
+            return jsonify({'message': 'Forbidden'}), 403
+        return f(*args, **kwargs)
+    return decorated
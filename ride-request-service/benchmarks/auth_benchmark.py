@@ -0,0 +1,101 @@
+"""
+Authentication overhead per request, with and without the verified token cache.
+
+Measures `decode_token` alone, then the cost `token_required` adds to a
+request: a minimal Flask app serves the same view with and without the
+decorator through its test client, and the difference is the auth overhead.
+Requests pick their token at random among --tokens distinct tokens, like
+clients each reusing their own token.
+
+Usage (from the ride-request-service directory):
+    python -m benchmarks.auth_benchmark [--tokens 1000] [--requests 20000]
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+import random
+import time
+
+from flask import Flask, jsonify
+import jwt
+
+from app.cache import TTLCache
+from app.utils import decode_token, token_required
+
+SECRET_KEY = 'benchmark-secret'
+
+
+def make_tokens(count):
+    expires_at = datetime.now(timezone.utc) + timedelta(hours=1)
+    return [
+        jwt.encode({'user_id': f"user-{i}", 'username': f"user-{i}", 'role': 'RIDER', 'exp': expires_at},
+                   SECRET_KEY, algorithm='HS256')
+        for i in range(count)
+    ]
+
+
+def make_cache(cached, tokens):
+    return TTLCache(len(tokens), 300) if cached else None
+
+
+def measure_decode(tokens, requests, cached):
+    cache = make_cache(cached, tokens)
+    for token in tokens:
+        decode_token(token, SECRET_KEY, cache)
+    picks = [random.choice(tokens) for _ in range(requests)]
+    start = time.perf_counter()
+    for token in picks:
+        decode_token(token, SECRET_KEY, cache)
+    return (time.perf_counter() - start) / requests
+
+
+def create_app(cache):
+    app = Flask(__name__)
+    app.config['SECRET_KEY'] = SECRET_KEY
+    app.token_cache = cache
+
+    @app.route('/open')
+    def open_view():
+        return jsonify({'status': 'PENDING'})
+
+    @app.route('/auth')
+    @token_required
+    def auth_view():
+        return jsonify({'status': 'PENDING'})
+
+    return app
+
+
+def measure_requests(app, path, tokens, requests):
+    picks = [random.choice(tokens) for _ in range(requests)]
+    with app.test_client() as client:
+        start = time.perf_counter()
+        for token in picks:
+            client.get(path, headers={'Authorization': f"Bearer {token}"})
+        return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--tokens', type=int, default=1000, help='distinct tokens')
+    parser.add_argument('--requests', type=int, default=20000)
+    args = parser.parse_args()
+
+    tokens = make_tokens(args.tokens)
+    for cached in (False, True):
+        label = 'cached' if cached else 'uncached'
+        per_decode = measure_decode(tokens, args.requests, cached)
+
+        app = create_app(make_cache(cached, tokens))
+        # Warm up the app and the cache before measuring
+        with app.test_client() as client:
+            for token in tokens:
+                client.get('/auth', headers={'Authorization': f"Bearer {token}"})
+        per_open = measure_requests(app, '/open', tokens, args.requests)
+        per_auth = measure_requests(app, '/auth', tokens, args.requests)
+
+        print(f"{label:<9} decode_token={per_decode * 1e6:7.1f}us  request={per_open * 1e6:7.1f}us  "
+              f"with token_required={per_auth * 1e6:7.1f}us  overhead={(per_auth - per_open) * 1e6:7.1f}us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""
+Load test for POST /rides/request.
+
+Fires ride requests at a running ride-request-service from a pool of
+threads for a fixed duration and reports throughput and latency
+percentiles. Tokens are minted locally with the shared SECRET_KEY:
+
+    * by default they carry the username/role claims, so the service
+      authorizes the rider from the token alone;
+    * with --legacy-token they only carry user_id, as tokens issued before
+      the claims were added, so the service (started with
+      USER_LOOKUP_FALLBACK=true) has to call user-service for every request.
+
+Running it once with and once without --legacy-token gives the before/after
+comparison. The user must exist in user-service with the rider role for the
+legacy run.
+
+Usage (from the ride-request-service directory):
+    python -m benchmarks.ride_request_load --secret-key $SECRET_KEY \\
+        --user-id <user_id> --username <username> [--legacy-token]
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import jwt
+import requests
+
+
+def make_token(secret_key, user_id, username, legacy):
+    claims = {'user_id': user_id, 'exp': datetime.now(timezone.utc) + timedelta(hours=1)}
+    if not legacy:
+        claims.update({'username': username, 'role': 'rider'})
+    return jwt.encode(claims, secret_key, algorithm='HS256')
+
+
+def worker(url, token, username, deadline):
+    session = requests.Session()
+    session.headers['Authorization'] = f"Bearer {token}"
+    payload = {
+        'username': username,
+        'pickup_location': 'Via Santa Sofia 62',
+        'dropoff_location': 'Viale Andrea Doria 16'
+    }
+    latencies, errors = [], 0
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = session.post(f"{url}/rides/request", json=payload, timeout=10)
+            ok = response.status_code == 201
+        except requests.exceptions.RequestException:
+            ok = False
+        latencies.append(time.perf_counter() - start)
+        errors += not ok
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://localhost:5001')
+    parser.add_argument('--secret-key', required=True)
+    parser.add_argument('--user-id', required=True)
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--legacy-token', action='store_true', help='omit the username/role claims')
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30, help='seconds')
+    args = parser.parse_args()
+
+    token = make_token(args.secret_key, args.user_id, args.username, args.legacy_token)
+    deadline = time.perf_counter() + args.duration
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [
+            pool.submit(worker, args.url, token, args.username, deadline)
+            for _ in range(args.concurrency)
+        ]
+        results = [future.result() for future in futures]
+
+    latencies = sorted(latency for worker_latencies, _ in results for latency in worker_latencies)
+    errors = sum(worker_errors for _, worker_errors in results)
+    if not latencies:
+        print("No requests completed")
+        return
+
+    def percentile(p):
+        return latencies[min(int(len(latencies) * p), len(latencies) - 1)] * 1000
+
+    mode = 'legacy token (user-service lookup)' if args.legacy_token else 'token claims'
+    print(f"mode:        {mode}")
+    print(f"requests:    {len(latencies)} ({errors} errors)")
+    print(f"throughput:  {len(latencies) / args.duration:.1f} req/s")
+    print(f"latency:     p50={statistics.median(latencies) * 1000:.1f}ms "
+          f"p95={percentile(0.95):.1f}ms p99={percentile(0.99):.1f}ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,100 @@
+"""
+Compare the Flask and the asyncio (ASGI) serving modes of ride-request-service.
+
+Runs the same workload against both servers: every virtual client creates a
+ride request and then polls its status, in a loop, for a fixed duration.
+Concurrency is driven from a single asyncio loop so that thousands of
+clients can be simulated. Start the two modes side by side against the same
+MongoDB, Kafka and user-service, e.g.:
+
+    flask run --port 5001
+    hypercorn app.asgi:app --bind 0.0.0.0:5011
+
+Usage (from the ride-request-service directory):
+    python -m benchmarks.serving_mode_comparison --secret-key $SECRET_KEY \\
+        --user-id <user_id> --username <username> \\
+        --flask-url http://localhost:5001 --asgi-url http://localhost:5011
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import jwt
+
+
+async def client_loop(client, username, deadline, latencies, errors):
+    payload = {
+        'username': username,
+        'pickup_location': 'Via Santa Sofia 62',
+        'dropoff_location': 'Viale Andrea Doria 16'
+    }
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            response = await client.post('/rides/request', json=payload)
+            latencies['request'].append(time.perf_counter() - start)
+            if response.status_code != 201:
+                errors['request'] += 1
+                continue
+
+            start = time.perf_counter()
+            response = await client.get(f"/rides/status/{response.json()['request_id']}")
+            latencies['status'].append(time.perf_counter() - start)
+            errors['status'] += response.status_code != 200
+        except httpx.HTTPError:
+            errors['transport'] += 1
+
+
+async def run_mode(url, token, username, concurrency, duration):
+    latencies = {'request': [], 'status': []}
+    errors = {'request': 0, 'status': 0, 'transport': 0}
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30,
+                                 headers={'Authorization': f"Bearer {token}"}) as client:
+        deadline = time.perf_counter() + duration
+        await asyncio.gather(*(
+            client_loop(client, username, deadline, latencies, errors) for _ in range(concurrency)
+        ))
+    return latencies, errors
+
+
+def report(mode, latencies, errors, duration):
+    for endpoint, samples in latencies.items():
+        if not samples:
+            print(f"{mode:<6} {endpoint:<8} no successful requests")
+            continue
+        samples = sorted(samples)
+        p99 = samples[min(int(len(samples) * 0.99), len(samples) - 1)]
+        print(f"{mode:<6} {endpoint:<8} {len(samples) / duration:8.1f} req/s  "
+              f"p50={statistics.median(samples) * 1000:7.1f}ms  p99={p99 * 1000:7.1f}ms")
+    print(f"{mode:<6} errors   {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--flask-url', default='http://localhost:5001')
+    parser.add_argument('--asgi-url', default='http://localhost:5011')
+    parser.add_argument('--secret-key', required=True)
+    parser.add_argument('--user-id', required=True)
+    parser.add_argument('--username', required=True)
+    parser.add_argument('--concurrency', type=int, default=500)
+    parser.add_argument('--duration', type=float, default=30, help='seconds per mode')
+    args = parser.parse_args()
+
+    token = jwt.encode({
+        'user_id': args.user_id,
+        'username': args.username,
+        'role': 'rider',
+        'exp': datetime.now(timezone.utc) + timedelta(hours=1)
+    }, args.secret_key, algorithm='HS256')
+
+    for mode, url in (('flask', args.flask_url), ('asgi', args.asgi_url)):
+        latencies, errors = asyncio.run(run_mode(url, token, args.username, args.concurrency, args.duration))
+        report(mode, latencies, errors, args.duration)
+
+
+if __name__ == '__main__':
+    main()
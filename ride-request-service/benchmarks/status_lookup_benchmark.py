@@ -0,0 +1,88 @@
+"""
+Ride status lookup latency at production data sizes.
+
+Seeds a scratch MongoDB database with millions of ride requests, then
+measures the status lookup done by GET /rides/status/<request_id> (a
+find_one by request_id with the status projection) without and with the
+indexes declared in app/db.py. The scratch database is dropped at the end.
+
+Usage (from the ride-request-service directory):
+    python -m benchmarks.status_lookup_benchmark --mongo-uri mongodb://localhost:27017 \\
+        [--rides 2000000] [--lookups 2000]
+"""
+import argparse
+from datetime import datetime, timedelta, timezone
+import random
+import statistics
+import time
+import uuid
+
+from pymongo import MongoClient
+
+from app.db import RIDE_REQUEST_INDEXES, RIDE_STATUS_PROJECTION
+
+STATUSES = ['PENDING', 'ACCEPTED', 'COMPLETED', 'CANCELLED']
+
+
+def seed(collection, rides, users, batch_size=10000):
+    request_ids = []
+    start = datetime.now(timezone.utc) - timedelta(days=365)
+    for offset in range(0, rides, batch_size):
+        batch = []
+        for i in range(offset, min(offset + batch_size, rides)):
+            request_id = str(uuid.uuid4())
+            request_ids.append(request_id)
+            batch.append({
+                'request_id': request_id,
+                'user_id': f"user-{random.randrange(users)}",
+                'username': 'benchmark',
+                'pickup_location': 'Via Santa Sofia 62',
+                'dropoff_location': 'Viale Andrea Doria 16',
+                'status': random.choice(STATUSES),
+                'created_at': (start + timedelta(seconds=i * 15)).isoformat()
+            })
+        collection.insert_many(batch, ordered=False)
+        print(f"\rseeded {min(offset + batch_size, rides)}/{rides}", end='', flush=True)
+    print()
+    return request_ids
+
+
+def measure(label, collection, request_ids, lookups):
+    samples = []
+    for request_id in random.sample(request_ids, lookups):
+        start = time.perf_counter()
+        collection.find_one({'request_id': request_id}, RIDE_STATUS_PROJECTION)
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    p99 = samples[min(int(len(samples) * 0.99), len(samples) - 1)]
+    print(f"{label:<12} p50={statistics.median(samples) * 1000:9.2f}ms  p99={p99 * 1000:9.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--mongo-uri', default='mongodb://localhost:27017')
+    parser.add_argument('--database', default='ride_status_benchmark')
+    parser.add_argument('--rides', type=int, default=2000000)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--lookups', type=int, default=2000)
+    parser.add_argument('--unindexed-lookups', type=int, default=20,
+                        help='lookups without indexes, each is a full collection scan')
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo_uri)
+    client.drop_database(args.database)
+    collection = client[args.database].ride_requests
+    try:
+        request_ids = seed(collection, args.rides, args.users)
+        measure('no index', collection, request_ids, args.unindexed_lookups)
+
+        start = time.perf_counter()
+        collection.create_indexes(RIDE_REQUEST_INDEXES)
+        print(f"index build  {time.perf_counter() - start:.1f}s")
+        measure('indexed', collection, request_ids, args.lookups)
+    finally:
+        client.drop_database(args.database)
+
+
+if __name__ == '__main__':
+    main()
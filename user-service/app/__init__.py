@@ -1,7 +1,10 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect
 from app.config import Config
 from app.logger import setup_logging
+from app.metrics import setup_metrics
+from app.passwords import PasswordHasher
 
 db = SQLAlchemy()
 
@@ -11,14 +14,39 @@ def create_app():
 
     # Initialize logging
     setup_logging(app)
+
+    # Initialize metrics, served at /metrics
+    setup_metrics(app)
     
     # Initialize database
     db.init_app(app)
 
+    # Initialize the password hashing pool
+    app.password_hasher = PasswordHasher.from_config(app.config)
+
     from app.routes import user_bp
     app.register_blueprint(user_bp)
 
-    with app.app_context():
+    # Create the schema explicitly, before starting the service
+    @app.cli.command('init-db')
+    def init_db():
+        """Create the database tables, and the indexes missing from existing tables."""
         db.create_all()
+        create_missing_indexes(app)
 
     return app
+
+def create_missing_indexes(app):
+    """
+    Create the indexes declared on the models that their existing tables lack.
+
+    create_all only creates indexes along with new tables, so indexes added
+    to a model later are created here.
+    """
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name not in existing:
+                index.create(db.engine)
+                app.logger.info(f"Created index {index.name} on {table.name}")
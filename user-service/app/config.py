@@ -5,4 +5,39 @@ class Config:
     #load_dotenv()
     SECRET_KEY = os.getenv('SECRET_KEY')
     SQLALCHEMY_DATABASE_URI = os.getenv('SQLALCHEMY_DATABASE_URI')
-    SQLALCHEMY_TRACK_MODIFICATIONS = False
\ No newline at end of file
+    SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Connection pool of the database engine; pre-ping and recycle (seconds)
+    # drop connections the server closed while they were idle
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.getenv('SQLALCHEMY_POOL_SIZE', 10)),
+        'max_overflow': int(os.getenv('SQLALCHEMY_MAX_OVERFLOW', 20)),
+        'pool_timeout': float(os.getenv('SQLALCHEMY_POOL_TIMEOUT', 10)),
+        'pool_pre_ping': os.getenv('SQLALCHEMY_POOL_PRE_PING', 'true').lower() == 'true',
+        'pool_recycle': int(os.getenv('SQLALCHEMY_POOL_RECYCLE', 1800))
+    }
+
+    # How long (seconds) clients may cache user lookups
+    USER_RESPONSE_MAX_AGE = int(os.getenv('USER_RESPONSE_MAX_AGE', 60))
+    USER_BATCH_MAX_IDS = int(os.getenv('USER_BATCH_MAX_IDS', 500))
+
+    # Password hashing, a werkzeug method including its cost parameters, e.g.
+    # 'scrypt:32768:8:1' or 'pbkdf2:sha256:600000'. Hashes made with another
+    # method are upgraded on login.
+    PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'scrypt:32768:8:1')
+    # Worker threads computing hashes (default: one per core), and how many
+    # hashes may wait for them (and for how long, in seconds) before requests
+    # are rejected with 503
+    PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', 0)) or None
+    PASSWORD_HASH_MAX_PENDING = int(os.getenv('PASSWORD_HASH_MAX_PENDING', 64))
+    PASSWORD_HASH_QUEUE_TIMEOUT = float(os.getenv('PASSWORD_HASH_QUEUE_TIMEOUT', 1))
+
+    # Logging; LOG_FORMAT is 'json' or 'text', hot-path messages are sampled
+    LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+    LOG_FILE = os.getenv('LOG_FILE', 'logs/app.log')
+    LOG_FORMAT = os.getenv('LOG_FORMAT', 'json')
+    LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', 10 * 1024 * 1024))
+    LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', 10))
+    LOG_HOT_PATH_SAMPLE_RATE = float(os.getenv('LOG_HOT_PATH_SAMPLE_RATE', 1.0))
+
+    # Prometheus metrics, served at /metrics
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', 'true').lower() == 'true'
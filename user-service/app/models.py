@@ -15,5 +15,7 @@ class User(db.Model):
     username = db.Column(db.String(80), unique=True, nullable=False)
     password_hash = db.Column(db.String(256), nullable=False)
     email = db.Column(db.String(120), unique=True, nullable=False)
-    role = db.Column(SQLAlchemyEnum(UserRole), nullable=False)
+    # username and email are looked up through the indexes of their unique
+    # constraints; role is indexed for listing drivers or riders
+    role = db.Column(SQLAlchemyEnum(UserRole), nullable=False, index=True)
     created_at = db.Column(db.DateTime, default=func.now())
@@ -0,0 +1,72 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+from threading import BoundedSemaphore
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from app.metrics import timer
+
+
+class HasherBusyError(Exception):
+    """Raised when too many password hashes are already waiting to be computed."""
+
+
+def hash_method(password_hash):
+    """Return the method, including its cost parameters, a werkzeug hash was made with."""
+    return password_hash.split('$', 1)[0]
+
+
+class PasswordHasher:
+    """
+    Computes and verifies password hashes on a bounded pool of worker threads.
+
+    Key derivation (pbkdf2, scrypt) releases the GIL, so the pool uses up to
+    `workers` cores in parallel while every other request keeps the rest.
+    At most `max_pending` hashes may be queued; callers beyond that wait up to
+    `queue_timeout` seconds and then get a HasherBusyError, so a login spike
+    is shed instead of piling up.
+    """
+
+    def __init__(self, method, workers=None, max_pending=64, queue_timeout=1.0):
+        self.method = method
+        # werkzeug stores methods with their defaults filled in (e.g. 'scrypt'
+        # as 'scrypt:32768:8:1'), so compare hashes against the expanded form
+        self.stored_method = hash_method(generate_password_hash('', method))
+        self.queue_timeout = queue_timeout
+        self._executor = ThreadPoolExecutor(max_workers=workers or os.cpu_count() or 1,
+                                            thread_name_prefix='password-hasher')
+        self._slots = BoundedSemaphore(max_pending)
+
+    @classmethod
+    def from_config(cls, config):
+        return cls(
+            config['PASSWORD_HASH_METHOD'],
+            workers=config['PASSWORD_HASH_WORKERS'],
+            max_pending=config['PASSWORD_HASH_MAX_PENDING'],
+            queue_timeout=config['PASSWORD_HASH_QUEUE_TIMEOUT']
+        )
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(timeout=self.queue_timeout):
+            raise HasherBusyError('Too many password hashes pending')
+        try:
+            return self._executor.submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    @timer('password-hasher', 'hash')
+    def hash(self, password):
+        """Hash a password with the configured method."""
+        return self._run(generate_password_hash, password, self.method)
+
+    @timer('password-hasher', 'verify')
+    def verify(self, password_hash, password):
+        """Check a password against a hash made with any method."""
+        return self._run(check_password_hash, password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        """Whether a hash was made with another method or cost than the configured one."""
+        return hash_method(password_hash) != self.stored_method
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
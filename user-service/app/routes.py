@@ -1,8 +1,11 @@
 from flask import Blueprint, request, jsonify, current_app
-from werkzeug.security import generate_password_hash, check_password_hash
+from sqlalchemy.exc import IntegrityError
 import jwt
 from datetime import datetime, timedelta, timezone
+from app.logger import HOT_PATH
+from app.metrics import timer
 from app.models import User
+from app.passwords import HasherBusyError
 from app import db
 
 user_bp = Blueprint('users', __name__)
@@ -22,21 +25,28 @@ def register():
         current_app.logger.warning("Missing required fields during registration")
         return jsonify({'message': 'Missing required fields'}), 400
 
-    # Check if user exists
-    existing_user = User.query.filter_by(username=username).first()
-    if existing_user:
-        current_app.logger.warning(f"User already exists: {username}")
-        return jsonify({'message': 'User already exists'}), 409
+    try:
+        password_hash = current_app.password_hasher.hash(password)
+    except HasherBusyError:
+        current_app.logger.warning("Password hashing queue full during registration")
+        return jsonify({'message': 'Service busy, please retry'}), 503
 
     # Create new user
     new_user = User(
         username=username,
-        password_hash=generate_password_hash(password),
+        password_hash=password_hash,
         email=email,
         role=role
     )
     db.session.add(new_user)
-    db.session.commit()
+    try:
+        with timer('database', 'insert_user'):
+            db.session.commit()
+    except IntegrityError:
+        # The unique username and email constraints reject existing users
+        db.session.rollback()
+        current_app.logger.warning(f"User already exists: {username}")
+        return jsonify({'message': 'User already exists'}), 409
 
     current_app.logger.info(f"User registered successfully: {username}")
     return jsonify({'message': 'User registered successfully'}), 201
@@ -54,11 +64,31 @@ def login():
         current_app.logger.warning("Missing username or password during login")
         return jsonify({'message': 'Missing username or password'}), 400
 
-    user = User.query.filter_by(username=username).first()
-    if user and check_password_hash(user.password_hash, password):
+    with timer('database', 'get_user_by_username'):
+        user = User.query.filter_by(username=username).first()
+    try:
+        verified = user is not None and current_app.password_hasher.verify(user.password_hash, password)
+    except HasherBusyError:
+        current_app.logger.warning("Password hashing queue full during login")
+        return jsonify({'message': 'Service busy, please retry'}), 503
+
+    if verified and current_app.password_hasher.needs_rehash(user.password_hash):
+        # Upgrade the hash to the configured method and cost
+        try:
+            user.password_hash = current_app.password_hasher.hash(password)
+            db.session.commit()
+            current_app.logger.info(f"Password rehashed for username: {username}")
+        except HasherBusyError:
+            # Upgraded on a later login instead
+            pass
+
+    if verified:
         # Generate JWT token
         token = jwt.encode({
             'user_id': user.user_id,
+            # Lets other services authorize the user without calling back here
+            'username': user.username,
+            'role': user.role.value,
             'exp': datetime.now(timezone.utc) + timedelta(hours=1)
         }, current_app.config['SECRET_KEY'], algorithm='HS256')
         current_app.logger.info(f"User logged in successfully: {username}")
@@ -67,28 +97,59 @@ def login():
         current_app.logger.warning(f"Invalid credentials for username: {username}")
         return jsonify({'message': 'Invalid credentials'}), 401
 
+def user_to_dict(user):
+    return {
+        'user_id': user.user_id,
+        'username': user.username,
+        'email': user.email,
+        'role': user.role.value,
+        'created_at': user.created_at.isoformat()
+    }
+
+def cacheable(response):
+    """Let clients and proxies cache a user response briefly and revalidate it with its ETag."""
+    response.cache_control.private = True
+    response.cache_control.max_age = current_app.config['USER_RESPONSE_MAX_AGE']
+    response.add_etag()
+    return response.make_conditional(request)
+
 @user_bp.route('/users/id/<user_id>', methods=['GET'])
 def get_user(user_id):
-    current_app.logger.info(f"Fetching user by ID: {user_id}")
-    user = User.query.get(user_id)
+    current_app.logger.info("Fetching user by ID: %s", user_id, extra=HOT_PATH)
+    with timer('database', 'get_user'):
+        user = db.session.get(User, user_id)
     if user:
-        user_data = {
-            'user_id': user.user_id,
-            'username': user.username,
-            'email': user.email,
-            'role': user.role.value,
-            'created_at': user.created_at.isoformat()
-        }
-        current_app.logger.info(f"User found: {user.username}")
-        return jsonify(user_data), 200
+        current_app.logger.info("User found: %s", user.username, extra=HOT_PATH)
+        return cacheable(jsonify(user_to_dict(user)))
     else:
         current_app.logger.warning(f"User not found with ID: {user_id}")
         return jsonify({'message': 'User not found'}), 404
 
+@user_bp.route('/users/ids', methods=['POST'])
+def get_users():
+    data = request.get_json()
+    user_ids = data.get('user_ids') if isinstance(data, dict) else None
+
+    # Validate input
+    if not isinstance(user_ids, list) or not user_ids or not all(isinstance(i, str) for i in user_ids):
+        current_app.logger.warning("Missing or invalid user_ids during batch user lookup")
+        return jsonify({'message': 'Missing required fields'}), 400
+    if len(user_ids) > current_app.config['USER_BATCH_MAX_IDS']:
+        return jsonify({'message': 'Too many user IDs in a single request'}), 413
+
+    with timer('database', 'get_users'):
+        users = User.query.filter(User.user_id.in_(set(user_ids))).all()
+    found = {user.user_id for user in users}
+    not_found = [user_id for user_id in dict.fromkeys(user_ids) if user_id not in found]
+
+    current_app.logger.info("Fetched %s of %s users by ID", len(users), len(user_ids), extra=HOT_PATH)
+    return jsonify({'users': [user_to_dict(user) for user in users], 'not_found': not_found}), 200
+
 @user_bp.route('/users/username/<username>', methods=['GET'])
 def get_user_by_username(username):
-    current_app.logger.info(f"Fetching user by username: {username}")
-    user = User.query.filter_by(username=username).first()
+    current_app.logger.info("Fetching user by username: %s", username, extra=HOT_PATH)
+    with timer('database', 'get_user_by_username'):
+        user = User.query.filter_by(username=username).first()
     if user:
         user_data = {
             'username': user.username,
@@ -96,7 +157,7 @@ def get_user_by_username(username):
             'role': user.role.value,
             'created_at': user.created_at.isoformat()
         }
-        current_app.logger.info(f"User found: {username}")
+        current_app.logger.info("User found: %s", username, extra=HOT_PATH)
         return jsonify(user_data), 200
     else:
         current_app.logger.warning(f"User not found with username: {username}")
@@ -0,0 +1,74 @@
+"""
+Login throughput at different password hash cost settings.
+
+Runs the password verification done by POST /users/login through the
+application's PasswordHasher pool, from many concurrent client threads, for
+each hash method given. No database is needed: the cost of a login is
+dominated by the key derivation.
+
+Usage (from the user-service directory):
+    python -m benchmarks.login_benchmark [--clients 64] [--duration 10] \\
+        [--methods scrypt:32768:8:1 pbkdf2:sha256:600000 pbkdf2:sha256:260000]
+"""
+import argparse
+import statistics
+import threading
+import time
+
+from werkzeug.security import generate_password_hash
+
+from app.passwords import HasherBusyError, PasswordHasher
+
+
+def client_loop(hasher, password_hash, deadline, latencies, errors):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            hasher.verify(password_hash, 'benchmark-password')
+        except HasherBusyError:
+            errors['busy'] += 1
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+def run_method(method, clients, duration, workers, max_pending):
+    hasher = PasswordHasher(method, workers=workers, max_pending=max_pending, queue_timeout=1.0)
+    password_hash = generate_password_hash('benchmark-password', method)
+    latencies = []
+    errors = {'busy': 0}
+    deadline = time.perf_counter() + duration
+    threads = [
+        threading.Thread(target=client_loop, args=(hasher, password_hash, deadline, latencies, errors))
+        for _ in range(clients)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    hasher.shutdown()
+    return latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--methods', nargs='+',
+                        default=['scrypt:32768:8:1', 'pbkdf2:sha256:600000', 'pbkdf2:sha256:260000'])
+    parser.add_argument('--clients', type=int, default=64)
+    parser.add_argument('--duration', type=float, default=10, help='seconds per method')
+    parser.add_argument('--workers', type=int, default=None, help='hashing threads, default one per core')
+    parser.add_argument('--max-pending', type=int, default=64)
+    args = parser.parse_args()
+
+    for method in args.methods:
+        latencies, errors = run_method(method, args.clients, args.duration, args.workers, args.max_pending)
+        if not latencies:
+            print(f"{method:<24} no successful logins, errors {errors}")
+            continue
+        latencies.sort()
+        p99 = latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+        print(f"{method:<24} {len(latencies) / args.duration:8.1f} logins/s  "
+              f"p50={statistics.median(latencies) * 1000:7.1f}ms  p99={p99 * 1000:7.1f}ms  errors {errors}")
+
+
+if __name__ == '__main__':
+    main()